@@ -0,0 +1,263 @@
+"""
+目录打包导出
+把网盘目录以zip或tar格式边打包边流式返回：条目按遍历顺序写入，同时预先并发下载后面的几个文件，
+每个文件只在有界队列中缓冲少量数据块，内存占用与目录大小无关；已经压缩过的媒体文件使用不压缩的存储模式
+"""
+
+import os
+import time
+import queue
+import tarfile
+import zipfile
+import posixpath
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 同时预取的文件数量，以及每个文件缓冲的数据块数量
+EXPORT_CONCURRENCY = int(os.environ.get('EXPORT_CONCURRENCY', 3))
+EXPORT_BUFFER_CHUNKS = int(os.environ.get('EXPORT_BUFFER_CHUNKS', 16))
+# zip中可压缩文件的压缩级别
+EXPORT_COMPRESS_LEVEL = int(os.environ.get('EXPORT_COMPRESS_LEVEL', 6))
+
+# 本身已经压缩过的格式，再压缩只会浪费CPU
+STORED_EXTENSIONS = {
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'avif',
+    'mp4', 'mkv', 'mov', 'avi', 'wmv', 'flv', 'webm', 'm4v', 'ts', 'rmvb',
+    'mp3', 'm4a', 'aac', 'flac', 'ogg', 'opus', 'wma', 'ape',
+    'zip', 'rar', '7z', 'gz', 'tgz', 'bz2', 'xz', 'zst', 'lz4',
+    'apk', 'ipa', 'dmg', 'iso', 'jar', 'epub',
+    'pdf', 'docx', 'xlsx', 'pptx',
+}
+
+FORMATS = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+}
+
+_DONE = object()
+
+
+class ExportCancelled(Exception):
+    """客户端断开，停止导出"""
+
+
+def is_stored(name):
+    """是否使用不压缩的存储模式"""
+    return posixpath.splitext(name)[1].lstrip('.').lower() in STORED_EXTENSIONS
+
+
+class MemberFetcher:
+    """在线程池中下载单个文件，数据块放入有界队列，写入端按顺序取出"""
+
+    def __init__(self, path, open_member, cancel_event, buffer_chunks):
+        self.path = path
+        self.open_member = open_member
+        self.cancel_event = cancel_event
+        self.queue = queue.Queue(maxsize=max(1, buffer_chunks))
+
+    def run(self):
+        try:
+            for chunk in self.open_member(self.path):
+                self._put(chunk)
+            self._put(_DONE)
+        except ExportCancelled:
+            pass
+        except Exception as e:
+            try:
+                self._put(e)
+            except ExportCancelled:
+                pass
+
+    def _put(self, value):
+        # 队列满时等待写入端消费，期间客户端断开则退出
+        while True:
+            if self.cancel_event.is_set():
+                raise ExportCancelled()
+            try:
+                self.queue.put(value, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def chunks(self):
+        while True:
+            value = self.queue.get()
+            if value is _DONE:
+                return
+            if isinstance(value, Exception):
+                raise value
+            yield value
+
+
+class StreamSink:
+    """只追加的输出缓冲，打包器写入后由响应生成器取走"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._parts:
+            data = b''.join(self._parts)
+            self._parts = []
+            yield data
+
+
+def zip_date_time(mtime):
+    """zip的时间字段不能早于1980年"""
+    return time.localtime(max(mtime or time.time(), 315532800))[:6]
+
+
+class ZipWriter:
+    def __init__(self, sink, compress_level=EXPORT_COMPRESS_LEVEL):
+        self.zf = zipfile.ZipFile(sink, 'w', allowZip64=True)
+        self.compress_level = compress_level
+
+    def add_dir(self, arcname, mtime):
+        info = zipfile.ZipInfo(arcname.rstrip('/') + '/', date_time=zip_date_time(mtime))
+        info.external_attr = 0o40755 << 16 | 0x10
+        self.zf.writestr(info, b'')
+
+    def add_file(self, arcname, size, mtime, chunks):
+        """写入文件条目，每写入一个数据块产出一次，以便调用方取走输出"""
+        info = zipfile.ZipInfo(arcname, date_time=zip_date_time(mtime))
+        info.file_size = size
+        info.external_attr = 0o644 << 16
+        if is_stored(arcname):
+            info.compress_type = zipfile.ZIP_STORED
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info._compresslevel = self.compress_level
+        with self.zf.open(info, 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as dest:
+            for chunk in chunks:
+                dest.write(chunk)
+                yield
+
+    def close(self):
+        self.zf.close()
+
+
+class TarWriter:
+    """直接写出tar头和数据块，不经过tarfile的整文件复制，数据可以边到边写"""
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def _header(self, info):
+        self.sink.write(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+
+    def add_dir(self, arcname, mtime):
+        info = tarfile.TarInfo(arcname.rstrip('/'))
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        info.mtime = mtime or time.time()
+        self._header(info)
+
+    def add_file(self, arcname, size, mtime, chunks):
+        info = tarfile.TarInfo(arcname)
+        info.size = size
+        info.mode = 0o644
+        info.mtime = mtime or time.time()
+        self._header(info)
+        written = 0
+        try:
+            for chunk in chunks:
+                # 上游返回的数据多于列表中的大小时截断，保证归档结构正确
+                chunk = chunk[:size - written]
+                if chunk:
+                    self.sink.write(chunk)
+                    written += len(chunk)
+                yield
+        finally:
+            # 下载失败时用0补足声明的大小，后续条目仍能正确解析
+            if written < size:
+                self._pad(size - written)
+            remainder = size % tarfile.BLOCKSIZE
+            if remainder:
+                self.sink.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    def _pad(self, length):
+        block = tarfile.NUL * 65536
+        while length > 0:
+            self.sink.write(block[:min(length, len(block))])
+            length -= len(block)
+
+    def close(self):
+        self.sink.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+
+
+def stream_archive(entries, fmt, open_member, concurrency=EXPORT_CONCURRENCY, buffer_chunks=EXPORT_BUFFER_CHUNKS):
+    """生成归档文件的字节流
+
+    entries逐个产出 {"arcname", "type", "path", "size", "mtime"}，或 {"error", "path"} 表示无法列出的目录；
+    open_member(path)返回文件内容的数据块迭代器。单个文件失败不会中断导出，
+    所有错误最后写入归档根目录的EXPORT_ERRORS.txt
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    sink = StreamSink()
+    writer = ZipWriter(sink) if fmt == 'zip' else TarWriter(sink)
+    cancel_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='export')
+    errors = []
+    pending = deque()
+    prefetched = 0
+    entries = iter(entries)
+    exhausted = False
+
+    def fill_pending():
+        # 保持最多concurrency个文件在预取中，目录和错误条目按原顺序排队
+        nonlocal prefetched, exhausted
+        while not exhausted and prefetched < concurrency:
+            entry = next(entries, None)
+            if entry is None:
+                exhausted = True
+                return
+            fetcher = None
+            if entry.get("type") == "file":
+                fetcher = MemberFetcher(entry["path"], open_member, cancel_event, buffer_chunks)
+                executor.submit(fetcher.run)
+                prefetched += 1
+            pending.append((entry, fetcher))
+
+    try:
+        fill_pending()
+        while pending:
+            entry, fetcher = pending.popleft()
+            if "error" in entry:
+                errors.append(f"{entry['path']}: {entry['error']}")
+            elif fetcher is None:
+                writer.add_dir(entry["arcname"], entry.get("mtime"))
+            else:
+                prefetched -= 1
+                fill_pending()
+                try:
+                    for _ in writer.add_file(entry["arcname"], entry.get("size") or 0, entry.get("mtime"),
+                                             fetcher.chunks()):
+                        yield from sink.drain()
+                except Exception as e:
+                    logger.warning(f"导出 {entry['path']} 失败: {e}")
+                    errors.append(f"{entry['path']}: {e}")
+            fill_pending()
+            yield from sink.drain()
+
+        if errors:
+            body = ('\n'.join(errors) + '\n').encode('utf-8')
+            for _ in writer.add_file('EXPORT_ERRORS.txt', len(body), time.time(), [body]):
+                pass
+        writer.close()
+        yield from sink.drain()
+    finally:
+        # 正常结束或客户端断开时停止所有预取
+        cancel_event.set()
+        executor.shutdown(wait=False)
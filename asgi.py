@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+百度网盘API服务 - ASGI入口
+流式下载（GET /download，stream模式）在事件循环中用httpx异步转发百度CDN的响应，
+一个进程可以同时转发大量慢速下载而不占用线程；会话、下载链接等阻塞的BaiDuDrive调用放到有界线程池中执行。
+其余接口通过a2wsgi在线程池中运行原有的Flask应用，接口路径和返回结构保持不变；
+上传、导出等长时间的传输使用单独的线程池，占满时不影响/list等短请求，/health直接在事件循环中返回
+
+启动方式：
+    uvicorn asgi:app --host 0.0.0.0 --port 10000
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker --workers 2
+需要额外安装：a2wsgi、httpx、uvicorn
+"""
+
+import os
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+try:
+    import httpx
+    from a2wsgi import WSGIMiddleware
+except ImportError as e:
+    raise ImportError(f"ASGI模式需要安装a2wsgi和httpx: pip install a2wsgi httpx uvicorn ({e})")
+
+import baidu_drive_api as api
+import metrics
+from download_proxy import build_download_headers, content_disposition, passthrough_headers, CHUNK_SIZE
+from upstream import UpstreamUnavailable
+from transport import TRANSPORT_HTTP2, reject_cookies
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 运行Flask路由的线程数，决定同时处理的同步短请求（列表、查询等）数量
+ASGI_WSGI_WORKERS = int(os.environ.get('ASGI_WSGI_WORKERS', 32))
+# 运行长时间传输（上传、导出、可续传上传的PATCH、需要落盘的下载）的线程数
+ASGI_TRANSFER_WORKERS = int(os.environ.get('ASGI_TRANSFER_WORKERS', 32))
+# 执行阻塞的BaiDuDrive调用（获取会话、下载链接）的线程数
+ASGI_OFFLOAD_WORKERS = int(os.environ.get('ASGI_OFFLOAD_WORKERS', 16))
+# 到百度CDN的最大连接数，即同时进行的异步下载数上限
+ASGI_MAX_CONNECTIONS = int(os.environ.get('ASGI_MAX_CONNECTIONS', 512))
+
+# 长时间传输的接口路径，可续传上传只有PATCH属于传输
+TRANSFER_PATHS = {'/upload', '/upload_stream', '/export', '/download'}
+
+wsgi_app = WSGIMiddleware(api.app, workers=ASGI_WSGI_WORKERS)
+transfer_app = WSGIMiddleware(api.app, workers=ASGI_TRANSFER_WORKERS)
+offload_executor = ThreadPoolExecutor(max_workers=ASGI_OFFLOAD_WORKERS, thread_name_prefix='asgi-offload')
+
+_http = None
+
+
+def get_http():
+    """事件循环内共享的httpx客户端，首次使用时创建"""
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(60, connect=10),
+            limits=httpx.Limits(max_connections=ASGI_MAX_CONNECTIONS, max_keepalive_connections=64),
+            follow_redirects=True,
+            http2=TRANSPORT_HTTP2,
+        )
+        # 客户端由所有账号共享，不保存CDN重定向设置的Cookie，避免带到其他账号的请求上
+        _http.cookies.jar.set_policy(reject_cookies())
+    return _http
+
+
+async def offload(fn, *args, timing=None):
+    """在有界线程池中执行阻塞调用；传入timing时其中的上游调用耗时计入该请求"""
+    if timing is not None:
+        fn, args = metrics.run_with_timing, (timing, fn) + args
+    return await asyncio.get_running_loop().run_in_executor(offload_executor, fn, *args)
+
+
+async def send_json(send, status, body, headers=()):
+    data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())]
+                   + [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+async def send_error(send, message, e):
+    """与Flask接口的error_response保持一致：上游不可用返回503和Retry-After，其余返回500"""
+    body = {"status": "error", "message": f"{message}: {str(e)}"}
+    if isinstance(e, UpstreamUnavailable):
+        await send_json(send, 503, body, [("Retry-After", str(max(1, int(e.retry_after or 1))))])
+    else:
+        await send_json(send, 500, body)
+
+
+async def open_cdn(link, headers):
+    http = get_http()
+    return await http.send(http.build_request('GET', link, headers=headers), stream=True)
+
+
+async def watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            disconnected.set()
+            return
+
+
+async def stream_download(scope, receive, send, query, headers, timing):
+    """异步流式下载，行为与Flask的/download（stream模式）一致"""
+    file_path = query.get('path')
+    client = await offload(api.get_client, headers.get('x-session-id'), timing=timing)
+    if client is None:
+        return await send_json(send, 401, {"status": "error", "message": "未登录或会话已过期"})
+    if not file_path:
+        return await send_json(send, 400, {"status": "error", "message": "缺少文件路径参数"})
+
+    try:
+        link = await offload(api.resolve_dlink, client, file_path, timing=timing)
+        if not link:
+            return await send_json(send, 404, {"status": "error", "message": "无法获取文件下载链接"})
+
+        request_headers = build_download_headers(client)
+        if headers.get('range'):
+            request_headers['Range'] = headers['range']
+        upstream = await open_cdn(link, request_headers)
+        if upstream.status_code == 403:
+            # 缓存的链接提前失效，重新获取一次
+            await upstream.aclose()
+            await offload(api.dlink_cache.invalidate, api.get_account(client), file_path)
+            link = await offload(api.resolve_dlink, client, file_path, timing=timing)
+            upstream = await open_cdn(link, request_headers)
+    except Exception as e:
+        return await send_error(send, "下载文件异常", e)
+
+    try:
+        if upstream.status_code not in (200, 206, 416):
+            return await send_json(send, 502, {
+                "status": "error", "message": f"下载文件失败，上游状态码: {upstream.status_code}"})
+
+        # aiter_raw转发的是未解压的原始数据
+        response_headers = list(passthrough_headers(upstream.headers, decoded=False).items())
+        if 'Accept-Ranges' not in upstream.headers:
+            response_headers.append(('Accept-Ranges', 'bytes'))
+        response_headers.append(('Content-Disposition', content_disposition(os.path.basename(file_path))))
+        response_headers.append(('Content-Type', 'application/octet-stream'))
+        if api.SERVER_TIMING:
+            response_headers.append(('Server-Timing', timing.server_timing()))
+        await send({
+            "type": "http.response.start",
+            "status": upstream.status_code,
+            "headers": [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response_headers],
+        })
+
+        # 客户端断开后停止读取上游
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+        try:
+            async for chunk in upstream.aiter_raw(CHUNK_SIZE):
+                if disconnected.is_set():
+                    return
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                metrics.bytes_out.inc('/download', amount=len(chunk))
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
+    finally:
+        await upstream.aclose()
+
+
+async def instrumented_download(scope, receive, send, query, headers):
+    """记录与Flask路由相同的请求指标"""
+    timing = metrics.RequestTiming()
+    status = [500]
+
+    async def send_and_record(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+        await send(message)
+
+    metrics.transfers_in_flight.inc('/download')
+    try:
+        await stream_download(scope, receive, send_and_record, query, headers, timing)
+    finally:
+        api.finish_request_metrics(timing, '/download', 'GET', status[0], True)
+
+
+async def health(send):
+    """健康检查直接在事件循环中返回，不经过可能被占满的线程池"""
+    timing = metrics.RequestTiming()
+    await send_json(send, 200, {"status": "ok", "message": "服务正常运行"})
+    api.finish_request_metrics(timing, '/health', 'GET', 200, False)
+
+
+def is_transfer(scope):
+    return scope["path"] in TRANSFER_PATHS or (scope["path"].startswith('/uploads/') and scope["method"] == 'PATCH')
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _http is not None:
+                await _http.aclose()
+            offload_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI入口：流式下载走异步路径，健康检查直接返回，其余请求按是否为长时间传输交给不同线程池中的Flask"""
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] == "http" and scope["path"] == '/download' and scope["method"] == 'GET':
+        query = {k: v[0] for k, v in parse_qs(scope["query_string"].decode('latin-1')).items()}
+        # 内容缓存和temp/segmented模式需要落盘，仍由Flask处理
+        if api.content_cache is None and query.get('mode', api.DOWNLOAD_MODE) == 'stream':
+            headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope["headers"]}
+            return await instrumented_download(scope, receive, send, query, headers)
+
+    if scope["type"] == "http" and scope["path"] == '/health' and scope["method"] == 'GET':
+        return await health(send)
+
+    if scope["type"] == "http" and is_transfer(scope):
+        return await transfer_app(scope, receive, send)
+    return await wsgi_app(scope, receive, send)
@@ -5,11 +5,23 @@
 
 import os
 import json
+import base64
 import tempfile
+import shutil
+import uuid
+import posixpath
+import time
 import sys
 import logging
-from flask import Flask, request, jsonify, send_file
+import threading
+import traceback
+from importlib import metadata as importlib_metadata
+from collections import OrderedDict
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from flask import Flask, Request, Response, request, jsonify, send_file, g, make_response
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import ClientDisconnected
 
 # 配置日志
 logging.basicConfig(level=logging.INFO,
@@ -17,55 +29,383 @@ logging.basicConfig(level=logging.INFO,
                     handlers=[logging.StreamHandler(sys.stdout)])
 logger = logging.getLogger('baidu_drive_api')
 
-# 创建必要的目录，避免fundrive依赖问题
-try:
-    # 尝试创建多个可能的目录路径
-    for path in [
-        '/app/logs', '/app/.fundrive',
-        '/tmp/logs', '/tmp/.fundrive',
-        './logs', './.fundrive'
-    ]:
-        os.makedirs(path, exist_ok=True)
-        print(f"成功创建目录: {path}")
-    logger.info("所有必要目录创建完成")
-except Exception as e:
-    print(f"创建目录失败: {e}")
-    logger.warning(f"创建目录失败: {e}")
-
 # 设置HOME环境变量（如果不存在）
 if 'HOME' not in os.environ:
     os.environ['HOME'] = os.environ.get('USERPROFILE', '/tmp')
     print(f"已设置HOME环境变量为: {os.environ['HOME']}")
 
-# 导入百度网盘API
-try:
-    # 先检查所有依赖包
-    import sys
-    logger.info(f"Python 版本: {sys.version}")
-    logger.info(f"Python 路径: {sys.path}")
+# fundrive运行时需要的目录，在首次加载BaiDuDrive时创建
+FUNDRIVE_DIRS = [
+    '/app/logs', '/app/.fundrive',
+    '/tmp/logs', '/tmp/.fundrive',
+    './logs', './.fundrive'
+]
+# /debug/deps中检查版本的依赖包
+DIAGNOSTIC_PACKAGES = ['numpy', 'pandas', 'funutil', 'funsecret', 'funfile', 'fundrive']
+# 默认在首次登录时才导入fundrive；设为0时在启动时导入，依赖问题在启动阶段就暴露出来
+LAZY_INIT = os.environ.get('LAZY_INIT', '1') == '1'
+# 为1时开放/debug/deps诊断接口
+DEBUG_ENDPOINTS = os.environ.get('DEBUG_ENDPOINTS', '0') == '1'
+
+BaiDuDrive = None
+_drive_lock = threading.Lock()
 
-    # 检查fundrive相关包
-    import pkg_resources
-    for package in ['numpy', 'pandas', 'funutil', 'funsecret', 'funfile', 'fundrive']:
+def prepare_dirs():
+    """创建必要的目录，避免fundrive依赖问题"""
+    for path in FUNDRIVE_DIRS:
         try:
-            version = pkg_resources.get_distribution(package).version
-            logger.info(f"已安装 {package} 版本: {version}")
-        except pkg_resources.DistributionNotFound:
-            logger.warning(f"未安装 {package}")
-
-    # 尝试导入BaiDuDrive
-    from fundrive.drives.baidu.drive import BaiDuDrive
-    logger.info("成功导入BaiDuDrive")
-except Exception as e:
-    logger.error(f"导入BaiDuDrive失败: {e}")
-    import traceback
-    logger.error(traceback.format_exc())
-    raise
+            os.makedirs(path, exist_ok=True)
+        except Exception as e:
+            logger.warning(f"创建目录 {path} 失败: {e}")
+
+def dependency_versions():
+    """依赖包的版本，未安装的为None"""
+    versions = {}
+    for package in DIAGNOSTIC_PACKAGES:
+        try:
+            versions[package] = importlib_metadata.version(package)
+        except importlib_metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+def load_drive_class():
+    """返回BaiDuDrive类，首次调用时创建目录并导入fundrive"""
+    global BaiDuDrive
+    if BaiDuDrive is None:
+        with _drive_lock:
+            if BaiDuDrive is None:
+                prepare_dirs()
+                started = time.monotonic()
+                try:
+                    from fundrive.drives.baidu.drive import BaiDuDrive as drive_class
+                except Exception as e:
+                    logger.error(f"导入BaiDuDrive失败: {e}")
+                    logger.error(traceback.format_exc())
+                    raise
+                logger.info(f"成功导入BaiDuDrive，耗时{time.monotonic() - started:.2f}秒")
+                BaiDuDrive = drive_class
+    return BaiDuDrive
+
+if not LAZY_INIT:
+    logger.info(f"依赖版本: {dependency_versions()}")
+    load_drive_class()
+
+from session_store import create_session_store, pick_credentials, account_key
+from client_pool import ClientPool
+from list_cache import ListingCache, normalize_path
+from concurrency import get_executor, SingleFlight
+from download_proxy import build_download_headers, open_upstream, iter_upstream, stream_response, content_disposition
+from segmented_download import segmented_download, file_identity
+from upload_pipeline import UploadPipeline
+from rapid_upload import create_rapid_uploader, hash_stream, hashes_from_headers, HashingFile
+from resumable_upload import create_resumable_uploads, UploadLocked, COMPLETED as UPLOAD_COMPLETED, LOCK_SECONDS
+from jobs import create_job_manager, describe_job, ProgressReader
+from batch_ops import batch_delete, batch_stat, batch_download_link
+from tree_walk import walk, iter_ndjson, encode_cursor, decode_cursor, WALK_CONCURRENCY, WALK_MAX_DEPTH
+from metadata_index import create_metadata_index
+from upstream import UpstreamGuard, UpstreamUnavailable
+from dlink_cache import DlinkCache
+from content_cache import create_content_cache, cache_key
+from archive_export import stream_archive, FORMATS as EXPORT_FORMATS
+from transport import transport, install_dns_cache, TRANSPORT_DNS_CACHE
+import metrics
+
+class UploadRequest(Request):
+    """multipart上传的文件在werkzeug写入临时文件的同时计算秒传所需的哈希，上传前不必再把请求体读一遍"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return HashingFile(stream) if RAPID_UPLOAD else stream
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+
+# 会话凭证存储（所有worker共享）
+session_store = create_session_store()
+
+# 目录列表缓存
+list_cache = ListingCache(
+    ttl=int(os.environ.get('LIST_CACHE_TTL', 10)),
+    max_size=int(os.environ.get('LIST_CACHE_SIZE', 1024)),
+)
+list_flight = SingleFlight()
+
+# /upload的默认上传模式：pipeline（分片并发上传）或temp（临时文件中转）
+UPLOAD_MODE = os.environ.get('UPLOAD_MODE', 'pipeline')
+
+# 秒传及本地哈希索引
+RAPID_UPLOAD = os.environ.get('RAPID_UPLOAD', '1') == '1'
+rapid_uploader = create_rapid_uploader()
+
+# 可续传上传（tus协议）的会话
+resumable_uploads = create_resumable_uploads()
+
+# /walk允许客户端指定的最大并发数
+WALK_CONCURRENCY_LIMIT = int(os.environ.get('WALK_CONCURRENCY_LIMIT', 16))
+
+# 批量接口单次请求的路径数量上限
+BATCH_MAX_PATHS = int(os.environ.get('BATCH_MAX_PATHS', 10000))
+
+# 后台传输任务，JOBS_DIR用于存放待上传和已下载的文件
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(os.environ.get('HOME', '/tmp'), '.fundrive', 'jobs'))
+job_manager = create_job_manager()
+
+# 本地元数据索引，/search直接查询索引，不调用百度网盘接口
+metadata_index = create_metadata_index()
+# 建立索引时每批写入的条目数量，以及/search单页的最大条目数
+INDEX_BATCH_SIZE = int(os.environ.get('INDEX_BATCH_SIZE', 500))
+SEARCH_MAX_LIMIT = int(os.environ.get('SEARCH_MAX_LIMIT', 1000))
+
+# 下载链接缓存
+dlink_cache = DlinkCache()
+
+# 磁盘内容缓存，CONTENT_CACHE_MAX_BYTES为0时不启用
+content_cache = create_content_cache()
+
+# /download的默认下载模式：stream（流式转发）、temp（临时文件中转）或segmented（多连接分段下载）
+DOWNLOAD_MODE = os.environ.get('DOWNLOAD_MODE', 'stream')
+# 分段下载时客户端通过connections参数可以指定的最大连接数
+DOWNLOAD_CONNECTIONS_LIMIT = int(os.environ.get('DOWNLOAD_CONNECTIONS_LIMIT', 16))
+
+def build_client(credentials):
+    """根据凭证创建并登录BaiDuDrive客户端"""
+    client = load_drive_class()()
+    if not client.login(**credentials):
+        return None
+    # 所有客户端共用进程内的keep-alive连接池，避免每个账号各自重新握手
+    transport.attach_client(client)
+    return client
+
+# 对百度网盘的调用按账号限速、重试和熔断，每次调用的耗时和错误计入指标
+upstream_guard = UpstreamGuard(context=metrics.current_timing, observer=metrics.observe_upstream)
+
+# 本worker内已登录客户端的客户端池，按账号复用
+client_pool = ClientPool(
+    factory=build_client,
+    max_size=int(os.environ.get('MAX_LIVE_CLIENTS', 64)),
+    idle_ttl=int(os.environ.get('CLIENT_IDLE_TTL', 1800)),
+)
+
+def get_client(session_id):
+    """获取会话对应的客户端，本worker没有时根据共享存储中的凭证懒加载重建"""
+    if not session_id:
+        return None
+
+    # 每次都以共享存储为准，其他worker上的登出也能立即生效
+    credentials = session_store.get(session_id)
+    if not credentials:
+        return None
+
+    try:
+        client = client_pool.get_or_create(credentials)
+    except Exception as e:
+        logger.warning(f"重建会话 {session_id} 的客户端失败: {e}")
+        return None
+    if client is None:
+        return None
+    return upstream_guard.wrap(client, account_key(credentials['bduss']))
+
+def error_response(message, e):
+    """异常对应的错误响应；上游熔断或排队超时返回503和Retry-After，其余返回500"""
+    if isinstance(e, UpstreamUnavailable):
+        response = jsonify({"status": "error", "message": f"{message}: {str(e)}"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, int(e.retry_after or 1)))
+        return response
+    return jsonify({"status": "error", "message": f"{message}: {str(e)}"}), 500
+
+def get_account(client):
+    """客户端对应的账号标识"""
+    return account_key(client.drive.bduss)
+
+def get_listing(client, path, refresh=False):
+    """获取目录列表缓存项，未命中时从网盘获取；refresh为True时跳过缓存"""
+    account = get_account(client)
+    entry = None if refresh else list_cache.get(account, path)
+    if entry is None:
+        # 同一账号同一目录的并发请求合并为一次上游调用；失效之后到达的请求不再合并到失效之前开始的获取
+        generation = list_cache.generation(account)
+
+        def fill():
+            started_at = time.time()
+            return list_cache.set(account, path, fetch_listing(client, path),
+                                  generation=generation, fetched_at=started_at)
+
+        entry = list_flight.do((account, normalize_path(path), generation), fill)
+    return entry
 
-# 全局变量存储客户端实例
-client_instances = {}
+def fetch_listing(client, path):
+    """从网盘获取目录下的文件和子目录，并格式化为接口返回的结构"""
+    # 文件和子目录列表在共享线程池中并发获取
+    executor = get_executor()
+    file_future = executor.submit(client.get_file_list, path)
+    dir_future = executor.submit(client.get_dir_list, path)
+    file_list = file_future.result()
+    dir_list = dir_future.result()
+
+    # 合并并格式化结果
+    result = []
+
+    for item in file_list:
+        result.append({
+            "name": item.name if hasattr(item, 'name') else "未知",
+            "type": "file",
+            "size": item.size if hasattr(item, 'size') else 0,
+            "size_formatted": f"{item.size / (1024 * 1024):.2f} MB" if hasattr(item, 'size') else "0 MB",
+            "mtime": item.mtime if hasattr(item, 'mtime') else None,
+            "path": f"{path.rstrip('/')}/{item.name}" if hasattr(item, 'name') else path,
+            "fs_id": getattr(item, 'fs_id', None),
+            "md5": getattr(item, 'md5', None)
+        })
+
+    for item in dir_list:
+        result.append({
+            "name": item.name if hasattr(item, 'name') else "未知",
+            "type": "directory",
+            "mtime": item.mtime if hasattr(item, 'mtime') else None,
+            "path": f"{path.rstrip('/')}/{item.name}" if hasattr(item, 'name') else path
+        })
+
+    return result
+
+def listed_file(client, path, with_time=False):
+    """目录列表缓存中path对应的文件条目，所在目录没有未过期的缓存时返回None，不调用网盘接口；
+    with_time为True时返回(条目, 缓存时间)"""
+    path = normalize_path(path)
+    entry = list_cache.peek(get_account(client), posixpath.dirname(path))
+    item = None
+    if entry is not None:
+        item = next((item for item in entry["items"] if item["type"] == "file" and item["path"] == path), None)
+    if with_time:
+        return (item, entry["cached_at"]) if item is not None else (None, None)
+    return item
+
+def resolve_dlink(client, path, fs_id=None):
+    """通过下载链接缓存获取path的下载链接；未给出fs_id时取目录列表缓存中的fs_id，
+    文件在本服务之外被替换后fs_id改变，缓存的旧链接随之失效"""
+    if fs_id is None:
+        item = listed_file(client, path)
+        fs_id = item.get("fs_id") if item else None
+    return dlink_cache.resolve(client, path, fs_id=fs_id)
+
+def record_upload(client, remote_file_path, upload_result):
+    """上传成功后使目录缓存和下载链接失效，并把新文件写入元数据索引"""
+    account = get_account(client)
+    list_cache.invalidate_parent(account, remote_file_path)
+    dlink_cache.invalidate(account, remote_file_path)
+    if content_cache is not None:
+        content_cache.record_write(account, normalize_path(remote_file_path))
+    metadata_index.upsert(account, [{
+        "path": normalize_path(remote_file_path),
+        "type": "file",
+        "size": upload_result.get("size") if isinstance(upload_result, dict) else None,
+        "mtime": int(time.time()),
+    }])
+
+def record_delete(client, file_path):
+    """删除成功后使目录缓存和下载链接失效，并从哈希索引和元数据索引中移除"""
+    account = get_account(client)
+    list_cache.invalidate_parent(account, file_path)
+    rapid_uploader.index.forget(account, file_path)
+    dlink_cache.invalidate(account, file_path)
+    if content_cache is not None:
+        content_cache.record_write(account, normalize_path(file_path))
+    metadata_index.remove(account, normalize_path(file_path))
+
+# 计入进行中传输数的接口
+TRANSFER_ENDPOINTS = {'upload_file', 'upload_stream', 'patch_upload', 'download_file', 'export_directory'}
+# 是否在响应中添加Server-Timing头
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_active_sessions', '有效会话数', session_store.count))
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_pooled_clients', '本worker客户端池中已登录的客户端数', lambda: client_pool.stats()["size"]))
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_upstream_connections', '共享连接池中各主机的连接数',
+    lambda: {(host, state): pool[state] for host, pool in transport.stats()["pools"].items()
+             for state in ('in_use', 'idle')}, ('host', 'state')))
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_upstream_concurrency_limit', '各账号当前允许的上游并发数，call为元数据调用，transfer为文件内容传输',
+    lambda: {(account, kind): stats[key] for account, stats in upstream_guard.stats().items()
+             for kind, key in (('call', 'concurrency_limit'), ('transfer', 'transfer_concurrency_limit'))},
+    ('account', 'kind')))
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_upstream_in_flight', '各账号进行中的上游调用数',
+    lambda: {(account, kind): stats[key] for account, stats in upstream_guard.stats().items()
+             for kind, key in (('call', 'in_flight'), ('transfer', 'transfer_in_flight'))},
+    ('account', 'kind')))
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_upstream_breaker_open', '各账号的熔断器是否打开（半开时也为1）',
+    lambda: {(account,): int(stats["breaker"] != 'closed') for account, stats in upstream_guard.stats().items()},
+    ('account',)))
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_upstream_calls', '各账号的上游调用、重试、限流、失败和拒绝次数',
+    lambda: {(account, kind): stats[kind] for account, stats in upstream_guard.stats().items()
+             for kind in ('calls', 'retried', 'throttled', 'failures', 'rejected')},
+    ('account', 'kind')))
+if content_cache is not None:
+    metrics.registry.register(metrics.CallbackGauge(
+        'baidu_api_content_cache_lookups', '磁盘内容缓存的命中和未命中次数',
+        lambda: {(result,): content_cache.stats()[result] for result in ('hits', 'misses')}, ('result',)))
+    metrics.registry.register(metrics.CallbackGauge(
+        'baidu_api_content_cache_bytes', '磁盘内容缓存的字节数：saved为命中节省的下载量，filled为填充量，used为当前占用',
+        lambda: {(kind,): content_cache.stats()[key]
+                 for kind, key in (('saved', 'bytes_saved'), ('filled', 'bytes_filled'), ('used', 'bytes_used'))},
+        ('kind',)))
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_rapid_upload_attempts', '各结果的秒传尝试次数',
+    lambda: {(result,): rapid_uploader.stats()[result]
+             for result in ('index_hits', 'remote_hits', 'misses', 'errors')}, ('result',)))
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_rapid_upload_hit_ratio', '秒传命中率（命中次数占命中与未命中次数之和）',
+    lambda: rapid_uploader.stats()["hit_ratio"]))
+metrics.registry.register(metrics.CallbackGauge(
+    'baidu_api_jobs', '各状态的后台任务数',
+    lambda: {(state,): count for state, count in job_manager.stats().items()}, ('state',)))
+
+@app.before_request
+def begin_request_metrics():
+    """开始累计本请求的上游耗时，并统计请求体字节数"""
+    metrics.begin_request()
+    g.metrics_route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request.environ['wsgi.input'] = metrics.CountingStream(request.environ['wsgi.input'], g.metrics_route)
+    g.metrics_transfer = request.endpoint in TRANSFER_ENDPOINTS
+    if g.metrics_transfer:
+        metrics.transfers_in_flight.inc(g.metrics_route)
+
+def finish_request_metrics(timing, route, method, status, transfer):
+    metrics.request_latency.observe(time.perf_counter() - timing.started, route, method)
+    metrics.requests_total.inc(route, method, str(status))
+    if transfer:
+        metrics.transfers_in_flight.dec(route)
+
+@app.after_request
+def add_request_metrics(response):
+    """添加Server-Timing头；请求耗时和进行中的传输在响应体发送完毕后才记录"""
+    timing = metrics.current_timing()
+    if timing is None:
+        return response
+    route = g.metrics_route
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = timing.server_timing()
+    if response.content_length is not None:
+        metrics.bytes_out.inc(route, amount=response.content_length)
+    elif response.is_streamed:
+        response.response = metrics.count_chunks(response.response, route)
+    args = (timing, route, request.method, response.status_code, g.metrics_transfer)
+    response.call_on_close(lambda: finish_request_metrics(*args))
+    g.metrics_finished = True
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc):
+    # 未经过after_request的请求（未处理的异常）在这里记录
+    timing = metrics.current_timing()
+    if timing is not None and not g.get('metrics_finished'):
+        finish_request_metrics(timing, g.get('metrics_route', 'unmatched'), request.method, 500,
+                               g.get('metrics_transfer', False))
+    metrics.end_request()
 
 @app.route('/', methods=['GET'])
 def index():
@@ -78,11 +418,33 @@ def index():
             {"path": "/health", "method": "GET", "description": "健康检查"},
             {"path": "/login", "method": "POST", "description": "登录百度网盘"},
             {"path": "/list", "method": "GET", "description": "列出文件和目录"},
+            {"path": "/walk", "method": "GET", "description": "递归遍历目录树（NDJSON流）"},
             {"path": "/upload", "method": "POST", "description": "上传文件"},
+            {"path": "/upload_stream", "method": "PUT", "description": "以原始请求体流式上传文件"},
+            {"path": "/uploads", "method": "POST", "description": "创建可续传上传（tus协议）"},
+            {"path": "/uploads/<upload_id>", "method": "HEAD", "description": "查询可续传上传已提交的偏移量"},
+            {"path": "/uploads/<upload_id>", "method": "PATCH", "description": "从指定偏移量继续上传"},
+            {"path": "/uploads/<upload_id>", "method": "DELETE", "description": "取消可续传上传"},
             {"path": "/download", "method": "GET", "description": "下载文件"},
             {"path": "/download_link", "method": "GET", "description": "获取文件下载链接"},
+            {"path": "/export", "method": "GET", "description": "把目录打包为zip或tar流式下载"},
             {"path": "/delete", "method": "DELETE", "description": "删除文件"},
-            {"path": "/logout", "method": "POST", "description": "登出"}
+            {"path": "/batch/delete", "method": "POST", "description": "批量删除文件"},
+            {"path": "/batch/stat", "method": "POST", "description": "批量查询文件元数据"},
+            {"path": "/batch/download_link", "method": "POST", "description": "批量获取下载链接"},
+            {"path": "/search", "method": "GET", "description": "在本地元数据索引中搜索文件"},
+            {"path": "/index/rebuild", "method": "POST", "description": "提交重建元数据索引的后台任务"},
+            {"path": "/index/status", "method": "GET", "description": "查询元数据索引状态"},
+            {"path": "/jobs/upload", "method": "POST", "description": "提交后台上传任务"},
+            {"path": "/jobs/download", "method": "POST", "description": "提交后台下载任务"},
+            {"path": "/jobs", "method": "GET", "description": "列出后台任务"},
+            {"path": "/jobs/<job_id>", "method": "GET", "description": "查询任务进度"},
+            {"path": "/jobs/<job_id>/cancel", "method": "POST", "description": "取消任务"},
+            {"path": "/jobs/<job_id>/retry", "method": "POST", "description": "重试任务"},
+            {"path": "/jobs/<job_id>/result", "method": "GET", "description": "获取下载任务的文件"},
+            {"path": "/logout", "method": "POST", "description": "登出"},
+            {"path": "/stats", "method": "GET", "description": "运行统计"},
+            {"path": "/metrics", "method": "GET", "description": "Prometheus格式的运行指标"}
         ]
     })
 
@@ -91,6 +453,52 @@ def health_check():
     """健康检查接口"""
     return jsonify({"status": "ok", "message": "服务正常运行"})
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    """运行统计接口"""
+    return jsonify({
+        "status": "success",
+        "sessions": session_store.count(),
+        "client_pool": client_pool.stats(),
+        "list_cache": list_cache.stats(),
+        "list_coalescing": list_flight.stats(),
+        "rapid_upload": rapid_uploader.stats(),
+        "jobs": job_manager.stats(),
+        "resumable_uploads": resumable_uploads.stats(),
+        "upstream": upstream_guard.stats(),
+        "dlink_cache": dlink_cache.stats(),
+        "content_cache": content_cache.stats() if content_cache is not None else None,
+        "transport": transport.stats()
+    })
+
+@app.route('/debug/deps', methods=['GET'])
+def debug_deps():
+    """依赖诊断接口，设置DEBUG_ENDPOINTS=1后可用；load=1时尝试导入BaiDuDrive并返回导入错误"""
+    if not DEBUG_ENDPOINTS:
+        return jsonify({"status": "error", "message": "接口未开放"}), 404
+
+    import_error = None
+    if request.args.get('load') == '1':
+        try:
+            load_drive_class()
+        except Exception as e:
+            import_error = f"{type(e).__name__}: {e}"
+    return jsonify({
+        "status": "success",
+        "python_version": sys.version,
+        "python_path": sys.path,
+        "packages": dependency_versions(),
+        "lazy_init": LAZY_INIT,
+        "baidu_drive_loaded": BaiDuDrive is not None,
+        "import_error": import_error,
+        "directories": {path: os.path.isdir(path) for path in FUNDRIVE_DIRS},
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus文本格式的运行指标，每个worker进程各自统计"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/login', methods=['POST'])
 def login():
     """登录接口"""
@@ -103,12 +511,12 @@ def login():
 
     try:
         # 初始化客户端
-        client = BaiDuDrive()
-        login_result = client.login(bduss=bduss)
+        credentials = pick_credentials(data)
+        client = client_pool.get_or_create(credentials)
 
-        if login_result:
-            # 存储客户端实例
-            client_instances[session_id] = client
+        if client is not None:
+            # 凭证写入共享存储，同一bduss重复登录时复用池中的客户端
+            session_store.set(session_id, credentials)
             return jsonify({
                 "status": "success",
                 "message": "登录成功",
@@ -117,7 +525,7 @@ def login():
         else:
             return jsonify({"status": "error", "message": "登录失败，请检查bduss是否有效"}), 401
     except Exception as e:
-        return jsonify({"status": "error", "message": f"登录异常: {str(e)}"}), 500
+        return error_response("登录异常", e)
 
 @app.route('/list', methods=['GET'])
 def list_files():
@@ -125,43 +533,79 @@ def list_files():
     session_id = request.headers.get('X-Session-ID')
     path = request.args.get('path', '/')
 
-    if not session_id or session_id not in client_instances:
+    client = get_client(session_id)
+    if client is None:
         return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
 
-    client = client_instances[session_id]
-
     try:
-        # 获取文件和目录列表
-        file_list = client.get_file_list(path)
-        dir_list = client.get_dir_list(path)
-
-        # 合并并格式化结果
-        result = []
-
-        for item in file_list:
-            result.append({
-                "name": item.name if hasattr(item, 'name') else "未知",
-                "type": "file",
-                "size": item.size if hasattr(item, 'size') else 0,
-                "size_formatted": f"{item.size / (1024 * 1024):.2f} MB" if hasattr(item, 'size') else "0 MB",
-                "path": f"{path.rstrip('/')}/{item.name}" if hasattr(item, 'name') else path
-            })
+        offset, limit = parse_pagination()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-        for item in dir_list:
-            result.append({
-                "name": item.name if hasattr(item, 'name') else "未知",
-                "type": "directory",
-                "path": f"{path.rstrip('/')}/{item.name}" if hasattr(item, 'name') else path
-            })
+    try:
+        entry = get_listing(client, path, refresh=request.args.get('refresh') == '1')
+        result = entry["items"]
 
-        return jsonify({
+        body = {
             "status": "success",
             "path": path,
             "items": result,
             "total": len(result)
-        })
+        }
+        if offset or limit is not None:
+            # 分页：items只包含当前页，total仍为目录下的条目总数
+            end = len(result) if limit is None else offset + limit
+            body["items"] = result[offset:end]
+            body["offset"] = offset
+            body["limit"] = limit
+            body["next_cursor"] = encode_cursor(end) if end < len(result) else None
+
+        response = jsonify(body)
+        # 带上ETag/Last-Modified，客户端条件请求命中时返回304
+        response.set_etag(entry["etag"])
+        response.last_modified = datetime.fromtimestamp(entry["last_modified"], tz=timezone.utc)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
-        return jsonify({"status": "error", "message": f"获取文件列表异常: {str(e)}"}), 500
+        return error_response("获取文件列表异常", e)
+
+def parse_pagination():
+    """读取offset/limit/cursor分页参数，cursor优先于offset"""
+    cursor = request.args.get('cursor')
+    offset = decode_cursor(cursor) if cursor else request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if offset < 0 or (limit is not None and limit <= 0):
+        raise ValueError("offset或limit参数无效")
+    return offset, limit
+
+@app.route('/walk', methods=['GET'])
+def walk_tree():
+    """递归遍历目录树，以NDJSON流式返回发现的每个条目"""
+    session_id = request.headers.get('X-Session-ID')
+    path = request.args.get('path', '/')
+    max_depth = request.args.get('max_depth', WALK_MAX_DEPTH, type=int)
+    concurrency = min(request.args.get('concurrency', WALK_CONCURRENCY, type=int), WALK_CONCURRENCY_LIMIT)
+
+    client = get_client(session_id)
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    if max_depth < 1 or concurrency < 1:
+        return jsonify({"status": "error", "message": "max_depth或concurrency参数无效"}), 400
+
+    def records():
+        total = errors = 0
+        for kind, item, depth in walk(lambda p: get_listing(client, p)["items"], path, max_depth, concurrency):
+            if kind == "error":
+                errors += 1
+                yield {"type": "error", "path": item, "error": str(depth)}
+            else:
+                total += 1
+                yield dict(item, depth=depth)
+        yield {"type": "summary", "path": path, "total": total, "errors": errors}
+
+    return Response(iter_ndjson(records()), mimetype='application/x-ndjson')
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -169,7 +613,8 @@ def upload_file():
     session_id = request.headers.get('X-Session-ID')
     remote_path = request.form.get('path', '/')
 
-    if not session_id or session_id not in client_instances:
+    client = get_client(session_id)
+    if client is None:
         return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
 
     if 'file' not in request.files:
@@ -179,22 +624,71 @@ def upload_file():
     if file.filename == '':
         return jsonify({"status": "error", "message": "未选择文件"}), 400
 
-    client = client_instances[session_id]
+    filename = secure_filename(file.filename)
+    remote_file_path = f"{remote_path.rstrip('/')}/{filename}"
 
     try:
-        # 保存上传的文件到临时目录
-        filename = secure_filename(file.filename)
-        temp_dir = tempfile.mkdtemp()
-        temp_file_path = os.path.join(temp_dir, filename)
+        if request.form.get('mode', UPLOAD_MODE) == 'temp':
+            upload_result = upload_via_temp_file(client, file, remote_file_path)
+        else:
+            # 先用解析请求体时算出的哈希尝试秒传，未命中时直接从请求体分片并发上传，不再另存一份临时文件
+            hashes = file.stream.hashes() if isinstance(file.stream, HashingFile) else None
+            upload_result = upload_with_rapid(client, file.stream, remote_file_path, hashes=hashes)
+        record_upload(client, remote_file_path, upload_result)
+
+        return jsonify({
+            "status": "success",
+            "message": "文件上传成功",
+            "remote_path": remote_file_path,
+            "result": upload_result
+        })
+    except Exception as e:
+        return error_response("上传文件异常", e)
+
+def upload_with_rapid(client, stream, remote_file_path, hashes=None):
+    """已知哈希时先尝试秒传，未命中时通过分片流水线上传（读取时顺带计算哈希），并把结果记录到本地哈希索引"""
+    account = get_account(client)
+
+    if RAPID_UPLOAD and hashes is not None:
+        result = rapid_uploader.try_upload(client, account, hashes, remote_file_path)
+        if result is not None:
+            return result
+
+    result = UploadPipeline(client, remote_file_path).upload(stream, hashes=hashes)
+    rapid_uploader.index.record(account, remote_file_path, result)
+    return result
+
+def upload_via_temp_file(client, file, remote_file_path):
+    """保存到临时目录后通过client.upload_file上传，无论成功与否都清理临时目录"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        temp_file_path = os.path.join(temp_dir, os.path.basename(remote_file_path))
         file.save(temp_file_path)
+        return client.upload_file(temp_file_path, remote_file_path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+@app.route('/upload_stream', methods=['PUT', 'POST'])
+def upload_stream():
+    """以原始请求体上传文件，边接收边分片上传，不经过multipart解析和磁盘"""
+    session_id = request.headers.get('X-Session-ID')
+    remote_path = request.args.get('path', '/')
+    filename = request.args.get('filename')
+
+    client = get_client(session_id)
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
 
-        # 上传到百度网盘
-        remote_file_path = f"{remote_path.rstrip('/')}/{filename}"
-        upload_result = client.upload_file(temp_file_path, remote_file_path)
+    if not filename:
+        return jsonify({"status": "error", "message": "缺少文件名参数"}), 400
 
-        # 清理临时文件
-        os.remove(temp_file_path)
-        os.rmdir(temp_dir)
+    remote_file_path = f"{remote_path.rstrip('/')}/{secure_filename(filename)}"
+
+    try:
+        # 客户端通过请求头提供哈希时，在读取请求体之前先尝试秒传
+        hashes = hashes_from_headers(request.headers)
+        upload_result = upload_with_rapid(client, request.stream, remote_file_path, hashes=hashes)
+        record_upload(client, remote_file_path, upload_result)
 
         return jsonify({
             "status": "success",
@@ -203,7 +697,199 @@ def upload_file():
             "result": upload_result
         })
     except Exception as e:
-        return jsonify({"status": "error", "message": f"上传文件异常: {str(e)}"}), 500
+        return error_response("上传文件异常", e)
+
+# ---- 可续传上传（tus 1.0.0核心协议及creation、termination、expiration扩展） ----
+
+TUS_VERSION = '1.0.0'
+
+def tus_response(response, upload=None):
+    """加上tus协议响应头；upload不为None时带上当前偏移量、总长度和过期时间"""
+    response = make_response(response)
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    if upload is not None:
+        response.headers['Upload-Offset'] = str(resumable_uploads.offset(upload))
+        response.headers['Upload-Length'] = str(upload["length"])
+        response.headers['Upload-Expires'] = http_date(upload["expires_at"])
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def tus_error(message, code, upload=None):
+    response = jsonify({"status": "error", "message": message})
+    response.status_code = code
+    return tus_response(response, upload)
+
+def http_date(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+def parse_upload_metadata(value):
+    """解析Upload-Metadata请求头：逗号分隔的“键 base64值”"""
+    metadata = {}
+    for pair in (value or '').split(','):
+        parts = pair.strip().split(' ', 1)
+        if not parts[0]:
+            continue
+        try:
+            metadata[parts[0]] = base64.b64decode(parts[1]).decode('utf-8') if len(parts) > 1 else ''
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError(f"Upload-Metadata中{parts[0]}的值不是有效的base64")
+    return metadata
+
+def describe_upload(upload):
+    return {
+        "upload_id": upload["id"],
+        "state": upload["state"],
+        "remote_path": upload["remote_path"],
+        "offset": resumable_uploads.offset(upload),
+        "length": upload["length"],
+        "slices": len(upload["slices"]),
+        "result": upload["result"],
+        "created_at": upload["created_at"],
+        "expires_at": upload["expires_at"],
+    }
+
+def get_owned_upload(client, upload_id):
+    """获取属于当前账号的上传会话，不存在、已过期或不属于该账号时返回None"""
+    upload = resumable_uploads.get(upload_id)
+    if upload is None or upload["account"] != get_account(client):
+        return None
+    return upload
+
+def finish_upload(client, upload, token):
+    """合并分片并记录上传结果"""
+    result = resumable_uploads.finish(client, upload, token)
+    record_upload(client, upload["remote_path"], result)
+    return result
+
+@app.route('/uploads', methods=['POST', 'OPTIONS'])
+def create_upload():
+    """创建可续传上传，Upload-Length为文件总长度；目录和文件名通过Upload-Metadata或path、filename参数指定"""
+    if request.method == 'OPTIONS':
+        response = Response(status=204)
+        response.headers['Tus-Version'] = TUS_VERSION
+        response.headers['Tus-Extension'] = 'creation,termination,expiration'
+        return tus_response(response)
+
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return tus_error("未登录或会话已过期", 401)
+
+    try:
+        length = int(request.headers.get('Upload-Length', ''))
+        if length < 0:
+            raise ValueError
+    except ValueError:
+        return tus_error("缺少或无效的Upload-Length请求头", 400)
+
+    try:
+        metadata = parse_upload_metadata(request.headers.get('Upload-Metadata'))
+    except ValueError as e:
+        return tus_error(str(e), 400)
+    remote_path = request.args.get('path') or metadata.get('path') or '/'
+    filename = request.args.get('filename') or metadata.get('filename')
+    if not filename:
+        return tus_error("缺少文件名参数", 400)
+
+    remote_file_path = f"{remote_path.rstrip('/')}/{secure_filename(filename)}"
+
+    try:
+        upload = resumable_uploads.create(get_account(client), remote_file_path, length)
+        if length == 0:
+            token = resumable_uploads.acquire(upload["id"])
+            try:
+                finish_upload(client, upload, token)
+            finally:
+                resumable_uploads.release(upload["id"], token)
+
+        response = jsonify({"status": "success", "upload": describe_upload(upload)})
+        response.status_code = 201
+        response.headers['Location'] = f"/uploads/{upload['id']}"
+        return tus_response(response, upload)
+    except Exception as e:
+        return tus_response(error_response("创建上传异常", e))
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'DELETE'])
+def upload_detail(upload_id):
+    """查询上传进度（HEAD只返回Upload-Offset等响应头）；DELETE取消上传并删除暂存数据"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return tus_error("未登录或会话已过期", 401)
+
+    upload = get_owned_upload(client, upload_id)
+    if upload is None:
+        return tus_error("上传不存在或已过期", 404)
+
+    if request.method == 'DELETE':
+        try:
+            # 正在写入的会话不能删除，否则暂存文件会被写入请求重新创建
+            resumable_uploads.acquire(upload_id)
+        except UploadLocked as e:
+            return tus_error(str(e), 423, upload)
+        resumable_uploads.delete(upload_id)
+        return tus_response(Response(status=204))
+
+    return tus_response(jsonify({"status": "success", "upload": describe_upload(upload)}), upload)
+
+@app.route('/uploads/<upload_id>', methods=['PATCH'])
+def patch_upload(upload_id):
+    """从Upload-Offset处追加数据，偏移量必须等于已提交的偏移量；数据到齐后自动合并"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return tus_error("未登录或会话已过期", 401)
+
+    if request.headers.get('Tus-Resumable', TUS_VERSION) != TUS_VERSION:
+        response = tus_error("不支持的tus协议版本", 412)
+        response.headers['Tus-Version'] = TUS_VERSION
+        return response
+
+    if request.mimetype != 'application/offset+octet-stream':
+        return tus_error("Content-Type必须为application/offset+octet-stream", 415)
+
+    upload = get_owned_upload(client, upload_id)
+    if upload is None:
+        return tus_error("上传不存在或已过期", 404)
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return tus_error("缺少或无效的Upload-Offset请求头", 400)
+
+    if offset != resumable_uploads.offset(upload):
+        return tus_error("Upload-Offset与已提交的偏移量不一致", 409, upload)
+    if request.content_length is not None and offset + request.content_length > upload["length"]:
+        return tus_error("数据超出Upload-Length", 400, upload)
+    if upload["state"] == UPLOAD_COMPLETED:
+        return tus_response(Response(status=204), upload)
+
+    try:
+        token = resumable_uploads.acquire(upload_id)
+    except UploadLocked as e:
+        response = tus_error(str(e), 423, upload)
+        response.headers['Retry-After'] = str(LOCK_SECONDS // 4)
+        return response
+
+    try:
+        # 获取锁之前检查时读到的状态可能已被其他请求改变，持有锁后重新读取并检查
+        upload = resumable_uploads.get(upload_id)
+        if upload is None or upload["state"] == UPLOAD_COMPLETED:
+            return tus_error("上传不存在、已过期或已完成", 404)
+        if offset != resumable_uploads.offset(upload):
+            return tus_error("Upload-Offset与已提交的偏移量不一致", 409, upload)
+
+        offset = resumable_uploads.write(client, upload, token, request.stream)
+        if offset == upload["length"]:
+            finish_upload(client, upload, token)
+        return tus_response(Response(status=204), upload)
+    except ClientDisconnected:
+        # 已接收的数据已写入暂存文件，客户端重连后通过HEAD查询偏移量继续
+        logger.info(f"上传 {upload_id} 的客户端在传输中断开，已提交 {resumable_uploads.offset(upload)} 字节")
+        return tus_error("客户端连接中断", 400, upload)
+    except UploadLocked as e:
+        return tus_error(str(e), 423, upload)
+    except Exception as e:
+        return tus_response(error_response("上传数据异常", e), upload)
+    finally:
+        resumable_uploads.release(upload_id, token)
 
 @app.route('/download', methods=['GET'])
 def download_file():
@@ -211,35 +897,211 @@ def download_file():
     session_id = request.headers.get('X-Session-ID')
     file_path = request.args.get('path')
 
-    if not session_id or session_id not in client_instances:
+    client = get_client(session_id)
+    if client is None:
         return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
 
     if not file_path:
         return jsonify({"status": "error", "message": "缺少文件路径参数"}), 400
 
-    client = client_instances[session_id]
+    # stream: 直接转发百度CDN的响应（默认）；temp: 先完整下载到临时目录再发送；
+    # segmented: 多连接分段下载到临时文件再发送，适合被限速的大文件
+    mode = request.args.get('mode', DOWNLOAD_MODE)
+    filename = os.path.basename(file_path)
+
+    cached_file = None
+    if content_cache is not None:
+        # temp/segmented本来就要完整下载到本地，未命中时直接填充缓存；stream未命中时照常转发，同时用转发的数据填充
+        cached_file = content_cache_file(client, file_path)
+        if cached_file is not None:
+            response = download_via_content_cache(client, file_path, filename, cached_file,
+                                                  fill=(mode in ('temp', 'segmented')))
+            if response is not None:
+                return response
 
+    if mode in ('temp', 'segmented'):
+        return download_via_temp_file(client, file_path, filename, segmented=(mode == 'segmented'))
+
+    # 登记了缓存填充时，直到把填充交给响应之前都由这里负责释放
+    claimed = cached_file is not None and cached_file.get("claimed", False)
+    try:
+        fs_id = cached_file["fs_id"] if cached_file is not None else None
+        download_link = resolve_dlink(client, file_path, fs_id=fs_id)
+        if not download_link:
+            return jsonify({"status": "error", "message": "无法获取文件下载链接"}), 404
+
+        headers = build_download_headers(client)
+        upstream = open_upstream(download_link, headers, range_header=request.headers.get('Range'))
+        if upstream.status_code == 403:
+            # 缓存的链接提前失效，重新获取一次
+            upstream.close()
+            dlink_cache.invalidate(get_account(client), file_path)
+            download_link = resolve_dlink(client, file_path, fs_id=fs_id)
+            upstream = open_upstream(download_link, headers, range_header=request.headers.get('Range'))
+        if upstream.status_code not in (200, 206, 416):
+            upstream.close()
+            return jsonify({"status": "error", "message": f"下载文件失败，上游状态码: {upstream.status_code}"}), 502
+
+        if not (claimed and upstream.status_code == 200):
+            return stream_response(upstream, filename)
+
+        # 完整响应边转发边写入缓存，其他请求等待写入完成后从缓存发送
+        key, size = cached_file["key"], cached_file["size"]
+        response = stream_response(upstream, filename,
+                                   tee=lambda chunks: content_cache.tee(key, size, chunks, claimed=True))
+        # 响应体没有开始发送就被关闭时tee不会执行，同样要释放登记
+        response.call_on_close(lambda: content_cache.release(key))
+        claimed = False
+        return response
+    except Exception as e:
+        return error_response("下载文件异常", e)
+    finally:
+        if claimed:
+            content_cache.release(cached_file["key"])
+
+def content_cache_file(client, file_path):
+    """计算文件的缓存键，返回包含key、size和fs_id的字典，不适合缓存或出错时返回None。
+    目录列表缓存中有未过期、且之后没有通过本服务写入过的条目时直接使用，否则查询文件元数据"""
+    try:
+        item, cached_at = listed_file(client, file_path, with_time=True)
+        if item is not None and content_cache.written_since(get_account(client), normalize_path(file_path), cached_at):
+            # 列表缓存之后文件通过本服务（可能是其他worker）被覆盖或删除，列表中的元数据已经过时
+            item = None
+        if item is not None and item.get("md5"):
+            # 列表与元数据中的MD5相同，两种方式得到的缓存键一致
+            pcs_file = SimpleNamespace(md5=item["md5"], fs_id=item.get("fs_id"), mtime=item.get("mtime"),
+                                       size=item["size"], is_dir=False)
+        else:
+            pcs_file = client.drive.meta(file_path)[0]
+        if pcs_file.is_dir or not content_cache.cacheable(pcs_file.size):
+            return None
+        # 缓存键由网盘当前的MD5（或fs_id、修改时间和大小）决定，远程文件变化后不会命中旧内容
+        return {"key": cache_key(pcs_file), "size": pcs_file.size, "fs_id": pcs_file.fs_id}
+    except Exception as e:
+        logger.warning(f"获取 {file_path} 的缓存键失败，直接下载: {e}")
+        return None
+
+def download_via_content_cache(client, file_path, filename, cached_file, fill):
+    """从磁盘内容缓存发送文件；未命中且不填充或缓存出错时返回None，由调用方照常下载。
+    未命中且不填充时登记该文件的填充并把cached_file["claimed"]设为True，调用方转发时写入缓存，结束后释放登记"""
+    key, size = cached_file["key"], cached_file["size"]
+    try:
+        # 同一文件正在被其他请求填充（包括stream模式边转发边写入）时等待其完成，不再重复从网盘下载
+        content_cache.wait_fill(key)
+        cached = content_cache.lookup(key, size)
+        if cached is None and not fill:
+            if content_cache.claim(key):
+                # 由调用方边转发边填充，并负责释放登记
+                cached_file["claimed"] = True
+                return None
+            # 其他请求刚开始填充
+            content_cache.wait_fill(key)
+            cached = content_cache.lookup(key, size)
+            if cached is None:
+                return None
+        if cached is None:
+            cached = content_cache.fill(key, size, lambda target: segmented_download(
+                client, file_path, target,
+                download_link=resolve_dlink(client, file_path, fs_id=cached_file["fs_id"])))
+
+        # 由WSGI服务器的file_wrapper发送，gunicorn下使用sendfile；支持Range和条件请求
+        return send_file(
+            cached,
+            as_attachment=True,
+            download_name=filename,
+            mimetype='application/octet-stream',
+            conditional=True
+        )
+    except Exception as e:
+        # 包括缓存文件在发送前被其他worker淘汰的情况
+        logger.warning(f"内容缓存处理 {file_path} 失败，直接下载: {e}")
+        return None
+
+def download_via_temp_file(client, file_path, filename, segmented=False):
+    """先把文件完整下载到临时目录再发送，响应结束后删除临时目录"""
+    temp_dir = tempfile.mkdtemp()
     try:
-        # 创建临时目录用于下载
-        temp_dir = tempfile.mkdtemp()
-        filename = os.path.basename(file_path)
         temp_file_path = os.path.join(temp_dir, filename)
 
         # 下载文件
-        download_result = client.download_file(file_path, filepath=temp_file_path)
+        if segmented:
+            connections = request.args.get('connections', type=int)
+            if connections:
+                connections = min(connections, DOWNLOAD_CONNECTIONS_LIMIT)
+            segmented_download(client, file_path, temp_file_path,
+                               download_link=resolve_dlink(client, file_path),
+                               **({"connections": connections} if connections else {}))
+        else:
+            client.download_file(file_path, filepath=temp_file_path)
 
         if os.path.exists(temp_file_path):
             # 发送文件给客户端
-            return send_file(
+            response = send_file(
                 temp_file_path,
                 as_attachment=True,
                 download_name=filename,
                 mimetype='application/octet-stream'
             )
-        else:
-            return jsonify({"status": "error", "message": "文件下载失败"}), 500
+            response.call_on_close(lambda: shutil.rmtree(temp_dir, ignore_errors=True))
+            return response
+
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return jsonify({"status": "error", "message": "文件下载失败"}), 500
+    except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return error_response("下载文件异常", e)
+
+@app.route('/export', methods=['GET'])
+def export_directory():
+    """把目录打包为zip或tar，边遍历、边下载、边打包地流式返回"""
+    session_id = request.headers.get('X-Session-ID')
+    path = normalize_path(request.args.get('path', '/'))
+    fmt = request.args.get('format', 'zip')
+    max_depth = request.args.get('max_depth', WALK_MAX_DEPTH, type=int)
+
+    client = get_client(session_id)
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": "format参数只能是zip或tar"}), 400
+
+    try:
+        # 开始输出之前先确认目录可以列出，之后的错误只能写入归档
+        get_listing(client, path)
     except Exception as e:
-        return jsonify({"status": "error", "message": f"下载文件异常: {str(e)}"}), 500
+        return error_response("导出目录异常", e)
+
+    base = posixpath.basename(path)
+    prefix = path.rstrip('/') + '/'
+
+    def entries():
+        for kind, item, detail in walk(lambda p: get_listing(client, p)["items"], path, max_depth):
+            if kind == "error":
+                yield {"path": item, "error": str(detail)}
+                continue
+            rel = item["path"][len(prefix):]
+            yield dict(item, arcname=f"{base}/{rel}" if base else rel)
+
+    headers = build_download_headers(client)
+
+    def open_member(file_path):
+        upstream = open_upstream(resolve_dlink(client, file_path), headers)
+        if upstream.status_code == 403:
+            # 缓存的链接提前失效，重新获取一次
+            upstream.close()
+            dlink_cache.invalidate(get_account(client), file_path)
+            upstream = open_upstream(resolve_dlink(client, file_path), headers)
+        if upstream.status_code != 200:
+            upstream.close()
+            raise RuntimeError(f"下载失败，上游状态码: {upstream.status_code}")
+        return iter_upstream(upstream)
+
+    return Response(
+        stream_archive(entries(), fmt, open_member),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": content_disposition(f"{base or 'export'}.{fmt}")}
+    )
 
 @app.route('/download_link', methods=['GET'])
 def get_download_link():
@@ -247,26 +1109,27 @@ def get_download_link():
     session_id = request.headers.get('X-Session-ID')
     file_path = request.args.get('path')
 
-    if not session_id or session_id not in client_instances:
+    client = get_client(session_id)
+    if client is None:
         return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
 
     if not file_path:
         return jsonify({"status": "error", "message": "缺少文件路径参数"}), 400
 
-    client = client_instances[session_id]
-
     try:
-        # 获取下载链接
-        download_link = client.drive.download_link(file_path)
+        # 获取下载链接，优先使用缓存
+        download_link = resolve_dlink(client, file_path)
+        expires_at = dlink_cache.expires_at(client, file_path)
 
         return jsonify({
             "status": "success",
             "file_path": file_path,
             "download_link": download_link,
+            "expires_at": int(expires_at) if expires_at else None,
             "note": "下载链接需要带上相应的Cookie才能访问"
         })
     except Exception as e:
-        return jsonify({"status": "error", "message": f"获取下载链接异常: {str(e)}"}), 500
+        return error_response("获取下载链接异常", e)
 
 @app.route('/delete', methods=['DELETE'])
 def delete_file():
@@ -274,17 +1137,17 @@ def delete_file():
     session_id = request.headers.get('X-Session-ID')
     file_path = request.args.get('path')
 
-    if not session_id or session_id not in client_instances:
+    client = get_client(session_id)
+    if client is None:
         return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
 
     if not file_path:
         return jsonify({"status": "error", "message": "缺少文件路径参数"}), 400
 
-    client = client_instances[session_id]
-
     try:
         # 删除文件
         delete_result = client.delete(file_path)
+        record_delete(client, file_path)
 
         return jsonify({
             "status": "success",
@@ -293,16 +1156,389 @@ def delete_file():
             "result": delete_result
         })
     except Exception as e:
-        return jsonify({"status": "error", "message": f"删除文件异常: {str(e)}"}), 500
+        return error_response("删除文件异常", e)
+
+def parse_batch_paths():
+    """读取批量接口的paths参数，返回(路径列表, 错误响应)"""
+    data = request.get_json(silent=True) or {}
+    paths = data.get('paths')
+    if not isinstance(paths, list) or not paths or not all(isinstance(p, str) and p for p in paths):
+        return None, (jsonify({"status": "error", "message": "paths参数必须是非空的路径列表"}), 400)
+    if len(paths) > BATCH_MAX_PATHS:
+        return None, (jsonify({"status": "error", "message": f"单次最多处理{BATCH_MAX_PATHS}个路径"}), 400)
+    # 规范化并去重，保持原有顺序
+    return list(OrderedDict.fromkeys(normalize_path(p) for p in paths)), None
+
+def batch_response(results):
+    """批量接口的统一返回结构，部分失败时status为partial"""
+    failed = sum(1 for item in results if item["status"] != "success")
+    if not failed:
+        status = "success"
+    elif failed < len(results):
+        status = "partial"
+    else:
+        status = "error"
+    return jsonify({
+        "status": status,
+        "results": results,
+        "total": len(results),
+        "succeeded": len(results) - failed,
+        "failed": failed
+    })
+
+@app.route('/batch/delete', methods=['POST'])
+def batch_delete_files():
+    """批量删除文件"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    paths, error = parse_batch_paths()
+    if error:
+        return error
+
+    try:
+        results = batch_delete(client, paths)
+        for item in results:
+            if item["status"] == "success":
+                record_delete(client, item["path"])
+        return batch_response(results)
+    except Exception as e:
+        return error_response("批量删除异常", e)
+
+@app.route('/batch/stat', methods=['POST'])
+def batch_stat_files():
+    """批量查询文件元数据"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    paths, error = parse_batch_paths()
+    if error:
+        return error
+
+    try:
+        return batch_response(batch_stat(client, paths))
+    except Exception as e:
+        return error_response("批量查询异常", e)
+
+@app.route('/batch/download_link', methods=['POST'])
+def batch_download_links():
+    """批量获取下载链接"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    paths, error = parse_batch_paths()
+    if error:
+        return error
+
+    try:
+        return batch_response(batch_download_link(client, paths, resolve=lambda p: resolve_dlink(client, p)))
+    except Exception as e:
+        return error_response("批量获取下载链接异常", e)
+
+def run_upload_job(context):
+    """后台上传任务：把暂存的文件上传到网盘，成功后删除暂存文件"""
+    client = get_client(context.job["session_id"])
+    if client is None:
+        raise RuntimeError("未登录或会话已过期")
+
+    staging_file = context.params["_staging_file"]
+    remote_file_path = context.params["remote_path"]
+    with open(staging_file, 'rb') as f:
+        hashes = hash_stream(f) if RAPID_UPLOAD else None
+        f.seek(0)
+        context.report(0, os.path.getsize(staging_file))
+        result = upload_with_rapid(client, ProgressReader(f, context.progress), remote_file_path, hashes=hashes)
+    record_upload(client, remote_file_path, result)
+
+    shutil.rmtree(os.path.dirname(staging_file), ignore_errors=True)
+    return result
+
+def run_download_job(context):
+    """后台下载任务：分段下载到暂存目录，重试或重启后从分段表继续"""
+    client = get_client(context.job["session_id"])
+    if client is None:
+        raise RuntimeError("未登录或会话已过期")
+
+    remote_path = context.params["remote_path"]
+    output_file = context.params["_output_file"]
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    # 查询网盘当前的元数据，远程文件在两次运行之间被替换时丢弃旧的分段表
+    pcs_file = client.drive.meta(remote_path)[0]
+    segmented_download(client, remote_path, output_file,
+                       download_link=resolve_dlink(client, remote_path, fs_id=pcs_file.fs_id),
+                       identity=file_identity(pcs_file.fs_id, pcs_file.md5),
+                       on_progress=context.report, cancel_event=context.cancel_event)
+    return {"size": os.path.getsize(output_file)}
+
+def run_index_job(context):
+    """后台索引任务：遍历目录树并分批写入元数据索引，进度以已索引的条目数汇报"""
+    client = get_client(context.job["session_id"])
+    if client is None:
+        raise RuntimeError("未登录或会话已过期")
+
+    account = get_account(client)
+    root = context.params["root"]
+    started_at = time.time()
+    entries = errors = 0
+    batch = []
+    # 跳过目录列表缓存，保证索引反映网盘当前的内容
+    for kind, item, depth in walk(lambda p: get_listing(client, p, refresh=True)["items"], root):
+        if kind == "error":
+            errors += 1
+            logger.warning(f"索引目录 {item} 失败: {depth}")
+            continue
+        batch.append(item)
+        entries += 1
+        if len(batch) >= INDEX_BATCH_SIZE:
+            metadata_index.upsert(account, batch)
+            batch = []
+            context.progress(entries)
+    metadata_index.upsert(account, batch)
+    metadata_index.finish_crawl(account, root, started_at, entries, errors)
+    return {"root": root, "entries": entries, "errors": errors}
+
+job_manager.register('upload', run_upload_job)
+job_manager.register('download', run_download_job)
+job_manager.register('index', run_index_job)
+
+def start_background():
+    """启动本进程的后台工作线程；gunicorn预加载应用时由gunicorn.conf.py在fork之后调用"""
+    if TRANSPORT_DNS_CACHE:
+        # 缓存百度网盘和CDN域名的DNS解析结果，只在显式开启时替换socket.getaddrinfo
+        install_dns_cache()
+    job_manager.start()
+
+# 预加载时在fork之前启动的线程不会进入worker进程，由post_fork钩子启动
+if os.environ.get('DEFER_BACKGROUND_START') != '1':
+    start_background()
+
+def get_owned_job(client, job_id):
+    """获取属于当前账号的任务，不存在或不属于该账号时返回None"""
+    job = job_manager.get(job_id)
+    if job is None or job["account"] != get_account(client):
+        return None
+    return job
+
+@app.route('/jobs/upload', methods=['POST'])
+def submit_upload_job():
+    """提交后台上传任务"""
+    session_id = request.headers.get('X-Session-ID')
+    remote_path = request.form.get('path', '/')
+
+    client = get_client(session_id)
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    if 'file' not in request.files:
+        return jsonify({"status": "error", "message": "没有文件被上传"}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"status": "error", "message": "未选择文件"}), 400
+
+    filename = secure_filename(file.filename)
+    staging_dir = os.path.join(JOBS_DIR, uuid.uuid4().hex)
+    try:
+        # 任务需要在重启后继续，文件先暂存到本地
+        os.makedirs(staging_dir, exist_ok=True)
+        staging_file = os.path.join(staging_dir, filename)
+        file.save(staging_file)
+
+        job = job_manager.submit('upload', session_id, get_account(client), {
+            "remote_path": f"{remote_path.rstrip('/')}/{filename}",
+            "_staging_file": staging_file,
+        }, bytes_total=os.path.getsize(staging_file))
+        return jsonify({"status": "success", "job": describe_job(job)}), 202
+    except Exception as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return error_response("提交上传任务异常", e)
+
+@app.route('/jobs/download', methods=['POST'])
+def submit_download_job():
+    """提交后台下载任务，完成后通过/jobs/<job_id>/result获取文件"""
+    session_id = request.headers.get('X-Session-ID')
+    data = request.get_json(silent=True) or {}
+    file_path = data.get('path') or request.args.get('path')
+
+    client = get_client(session_id)
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    if not file_path:
+        return jsonify({"status": "error", "message": "缺少文件路径参数"}), 400
+
+    try:
+        staging_dir = os.path.join(JOBS_DIR, uuid.uuid4().hex)
+        job = job_manager.submit('download', session_id, get_account(client), {
+            "remote_path": file_path,
+            "_output_file": os.path.join(staging_dir, os.path.basename(file_path)),
+        })
+        return jsonify({"status": "success", "job": describe_job(job)}), 202
+    except Exception as e:
+        return error_response("提交下载任务异常", e)
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """列出当前账号的任务"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    jobs = [describe_job(job) for job in job_manager.list(get_account(client))]
+    return jsonify({"status": "success", "jobs": jobs, "total": len(jobs)})
+
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_detail(job_id):
+    """查询任务进度；DELETE删除已结束的任务及其暂存文件"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    job = get_owned_job(client, job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "任务不存在"}), 404
+
+    if request.method == 'DELETE':
+        if not job_manager.delete(job_id):
+            return jsonify({"status": "error", "message": "任务尚未结束，请先取消"}), 409
+        staging_file = job["params"].get("_staging_file") or job["params"].get("_output_file")
+        if staging_file:
+            shutil.rmtree(os.path.dirname(staging_file), ignore_errors=True)
+        return jsonify({"status": "success", "message": "任务已删除"})
+
+    return jsonify({"status": "success", "job": describe_job(job)})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消任务"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    if get_owned_job(client, job_id) is None:
+        return jsonify({"status": "error", "message": "任务不存在"}), 404
+
+    return jsonify({"status": "success", "job": describe_job(job_manager.cancel(job_id))})
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """重试失败或已取消的任务"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    if get_owned_job(client, job_id) is None:
+        return jsonify({"status": "error", "message": "任务不存在"}), 404
+
+    return jsonify({"status": "success", "job": describe_job(job_manager.retry(job_id))})
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """获取已完成的下载任务的文件"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    job = get_owned_job(client, job_id)
+    if job is None or job["type"] != 'download':
+        return jsonify({"status": "error", "message": "任务不存在"}), 404
+
+    output_file = job["params"]["_output_file"]
+    if job["state"] != 'succeeded' or not os.path.exists(output_file):
+        return jsonify({"status": "error", "message": "任务尚未完成"}), 409
+
+    return send_file(
+        output_file,
+        as_attachment=True,
+        download_name=os.path.basename(output_file),
+        mimetype='application/octet-stream'
+    )
+
+@app.route('/index/rebuild', methods=['POST'])
+def rebuild_index():
+    """提交重建元数据索引的后台任务，path指定遍历的根目录"""
+    session_id = request.headers.get('X-Session-ID')
+    data = request.get_json(silent=True) or {}
+    root = normalize_path(data.get('path') or request.args.get('path', '/'))
+
+    client = get_client(session_id)
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    try:
+        job = job_manager.submit('index', session_id, get_account(client), {"root": root})
+        return jsonify({"status": "success", "job": describe_job(job)}), 202
+    except Exception as e:
+        return error_response("提交索引任务异常", e)
+
+@app.route('/index/status', methods=['GET'])
+def index_status():
+    """查询当前账号的元数据索引状态"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    return jsonify(dict(metadata_index.status(get_account(client)), status="success"))
+
+@app.route('/search', methods=['GET'])
+def search_files():
+    """在本地元数据索引中按名称、扩展名、类型、大小和修改时间搜索"""
+    client = get_client(request.headers.get('X-Session-ID'))
+    if client is None:
+        return jsonify({"status": "error", "message": "未登录或会话已过期"}), 401
+
+    args = request.args
+    entry_type = args.get('type')
+    if entry_type not in (None, 'file', 'directory'):
+        return jsonify({"status": "error", "message": "type参数只能是file或directory"}), 400
+
+    try:
+        offset, limit = parse_pagination()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    limit = min(limit or 100, SEARCH_MAX_LIMIT)
+
+    under = args.get('path')
+    try:
+        items, total = metadata_index.search(
+            get_account(client),
+            q=args.get('q'),
+            ext=args.get('ext'),
+            entry_type=entry_type,
+            min_size=args.get('min_size', type=int),
+            max_size=args.get('max_size', type=int),
+            mtime_from=args.get('mtime_from', type=int),
+            mtime_to=args.get('mtime_to', type=int),
+            under=normalize_path(under) if under else None,
+            limit=limit,
+            offset=offset,
+        )
+    except Exception as e:
+        return error_response("搜索异常", e)
+
+    end = offset + len(items)
+    return jsonify({
+        "status": "success",
+        "items": items,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "next_cursor": encode_cursor(end) if end < total else None
+    })
 
 @app.route('/logout', methods=['POST'])
 def logout():
     """登出接口"""
     session_id = request.headers.get('X-Session-ID')
 
-    if session_id and session_id in client_instances:
-        # 删除客户端实例
-        del client_instances[session_id]
+    credentials = session_store.get(session_id) if session_id else None
+
+    if credentials and session_store.delete(session_id):
+        # 释放该账号在本worker中的客户端
+        client_pool.discard(credentials.get('bduss'))
         return jsonify({"status": "success", "message": "登出成功"})
 
     return jsonify({"status": "warning", "message": "会话不存在或已过期"})
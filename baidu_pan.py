@@ -1,14 +1,19 @@
 
 """
 百度网盘操作示例脚本
-功能：登录、列出文件和目录、上传、下载和删除文件
-使用方法：python test_fundrive_complete.py
+功能：登录、列出文件和目录、上传、下载和删除文件，以及本地目录与网盘目录的增量同步
+使用方法：
+    python baidu_pan.py                                    运行操作示例
+    python baidu_pan.py sync push <本地目录> <网盘目录>     把本地目录同步到网盘
+    python baidu_pan.py sync pull <本地目录> <网盘目录>     把网盘目录同步到本地
 """
 
 import os
 import sys
+import json
 import time
 import shutil
+import argparse
 
 # 设置HOME环境变量（如果不存在）
 if 'HOME' not in os.environ:
@@ -17,6 +22,17 @@ if 'HOME' not in os.environ:
 
 # 导入百度网盘API
 from fundrive.drives.baidu.drive import BaiDuDrive
+from download_proxy import build_download_headers
+from segmented_download import SegmentedDownloader
+from sync_engine import SyncEngine, SYNC_WORKERS
+from rapid_upload import create_rapid_uploader
+from upstream import UpstreamGuard
+from dlink_cache import DlinkCache
+from session_store import account_key
+from transport import transport
+
+# 下载链接在数小时内有效，同一进程内重复下载时不再重新获取
+dlink_cache = DlinkCache()
 
 def main():
     # 使用bduss参数初始化百度网盘客户端
@@ -28,6 +44,7 @@ def main():
         client = BaiDuDrive()
         login_result = client.login(bduss=bduss)
         if login_result:
+            transport.attach_client(client)
             print("登录成功!")
         else:
             print("登录失败!")
@@ -124,27 +141,21 @@ def main():
         )
         print(f"下载方式2结果: {download_result2}")
 
-        # 方式3：使用底层API
+        # 方式3：使用底层API，多连接分段下载
         download_path3 = os.path.join(download_dir, "method3", f"downloaded_{test_filename}")
         os.makedirs(os.path.dirname(download_path3), exist_ok=True)
         try:
-            download_link = client.drive.download_link(f"/{test_filename}")
-
-            # 使用requests库直接下载文件
-            import requests
-            headers = {
-                "User-Agent": "softxm;netdisk",
-                "Connection": "Keep-Alive",
-                "Cookie": f"BDUSS={client.drive.bduss};ptoken={client.drive.ptoken}",
-            }
-            response = requests.get(download_link, headers=headers, stream=True)
-            if response.status_code == 200:
-                with open(download_path3, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                print(f"下载方式3结果: 成功")
-            else:
-                print(f"下载方式3结果: 失败，状态码: {response.status_code}")
+            download_link = dlink_cache.resolve(client, f"/{test_filename}")
+
+            # 按字节范围切分后并发下载，失败的分段自动重试，中断后重新运行会从分段表继续
+            downloader = SegmentedDownloader(
+                download_link,
+                build_download_headers(client),
+                download_path3,
+                connections=4
+            )
+            downloader.run()
+            print(f"下载方式3结果: 成功")
         except Exception as e:
             print(f"下载方式3结果: 失败，错误: {e}")
 
@@ -207,7 +218,46 @@ def main():
         import traceback
         traceback.print_exc()
 
+def sync_main(argv):
+    """增量同步命令行入口"""
+    parser = argparse.ArgumentParser(prog="baidu_pan.py sync", description="本地目录与网盘目录增量同步")
+    parser.add_argument("direction", choices=["push", "pull"], help="push: 本地 -> 网盘；pull: 网盘 -> 本地")
+    parser.add_argument("local_dir", help="本地目录")
+    parser.add_argument("remote_dir", help="网盘目录")
+    parser.add_argument("--bduss", default=os.environ.get("BDUSS"), help="BDUSS，默认读取环境变量BDUSS")
+    parser.add_argument("--delete", action="store_true", help="删除目标端中源端已删除的文件")
+    parser.add_argument("--dry-run", action="store_true", help="只输出同步计划，不传输文件")
+    parser.add_argument("--workers", type=int, default=SYNC_WORKERS, help="同时传输的文件数量")
+    parser.add_argument("--rescan-remote", action="store_true", help="push时重新列出网盘目录并与清单核对")
+    args = parser.parse_args(argv)
+
+    if not args.bduss:
+        parser.error("缺少bduss，请通过--bduss或环境变量BDUSS提供")
+
+    client = BaiDuDrive()
+    if not client.login(bduss=args.bduss):
+        print("登录失败!")
+        return 1
+    transport.attach_client(client)
+    # 并发传输时同样需要限速和重试
+    client = UpstreamGuard().wrap(client, account_key(args.bduss))
+
+    engine = SyncEngine(
+        client, args.local_dir, args.remote_dir,
+        direction=args.direction,
+        rapid_uploader=create_rapid_uploader(),
+        dlink_cache=dlink_cache,
+        workers=args.workers,
+        delete=args.delete,
+        rescan_remote=args.rescan_remote,
+    )
+    summary = engine.run(dry_run=args.dry_run)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary.get("errors") else 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "sync":
+        sys.exit(sync_main(sys.argv[2:]))
     print("开始执行百度网盘操作示例脚本...")
     main()
     print("脚本执行完成!")
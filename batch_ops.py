@@ -0,0 +1,93 @@
+"""
+批量操作
+删除和查询元数据使用百度网盘原生的多文件接口，一次请求处理一批路径；
+没有原生批量接口的操作（获取下载链接）在共享线程池上有限并发地逐个调用。
+整批调用失败时退化为逐个调用，以便按路径报告部分失败
+"""
+
+import os
+
+from concurrency import fan_out
+
+# 原生批量接口每次请求携带的路径数量
+NATIVE_CHUNK_SIZE = int(os.environ.get('BATCH_NATIVE_CHUNK', 100))
+# 逐个调用时的并发数
+FAN_OUT_WORKERS = int(os.environ.get('BATCH_FAN_OUT', 8))
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def success(path, **extra):
+    return dict({"path": path, "status": "success"}, **extra)
+
+
+def failure(path, error):
+    return {"path": path, "status": "error", "error": str(error)}
+
+
+def describe_pcs_file(pcs_file):
+    """把PcsFile转换为接口返回的结构"""
+    return {
+        "name": os.path.basename(pcs_file.path),
+        "type": "directory" if pcs_file.is_dir else "file",
+        "size": pcs_file.size or 0,
+        "md5": pcs_file.md5,
+        "fs_id": pcs_file.fs_id,
+        "ctime": pcs_file.ctime,
+        "mtime": pcs_file.mtime,
+    }
+
+
+def batch_delete(client, paths):
+    """批量删除，返回每个路径的结果"""
+    results = []
+    for chunk in chunked(paths, NATIVE_CHUNK_SIZE):
+        try:
+            client.drive.remove(*chunk)
+            results.extend(success(path) for path in chunk)
+        except Exception:
+            # 整批失败时逐个删除，找出具体失败的路径
+            for path, _, error in fan_out(lambda p: client.drive.remove(p), chunk, FAN_OUT_WORKERS):
+                results.append(failure(path, error) if error else success(path))
+    return results
+
+
+def batch_stat(client, paths):
+    """批量查询元数据，返回每个路径的结果"""
+    results = []
+    for chunk in chunked(paths, NATIVE_CHUNK_SIZE):
+        try:
+            found = {pcs_file.path: pcs_file for pcs_file in client.drive.meta(*chunk)}
+        except Exception:
+            found = {}
+            for path, pcs_files, error in fan_out(lambda p: client.drive.meta(p), chunk, FAN_OUT_WORKERS):
+                if error:
+                    found[path] = error
+                elif pcs_files:
+                    found[path] = pcs_files[0]
+
+        for path in chunk:
+            item = found.get(path)
+            if item is None:
+                results.append(failure(path, "文件不存在"))
+            elif isinstance(item, Exception):
+                results.append(failure(path, item))
+            else:
+                results.append(success(path, info=describe_pcs_file(item)))
+    return results
+
+
+def batch_download_link(client, paths, resolve=None):
+    """批量获取下载链接，没有原生批量接口，有限并发地逐个获取；resolve(path)可替换获取方式（如走缓存）"""
+    results = []
+    for path, link, error in fan_out(resolve or client.drive.download_link, paths, FAN_OUT_WORKERS):
+        if error:
+            results.append(failure(path, error))
+        elif not link:
+            results.append(failure(path, "无法获取下载链接"))
+        else:
+            results.append(success(path, download_link=link))
+    return results
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的百度网盘后端
+提供与fundrive的BaiDuDrive相同的调用接口（列表、分片上传、秒传、下载链接、删除等），文件保存在内存中；
+下载链接指向本地的模拟CDN，支持Range请求。可以配置每次调用的延迟、CDN和上传的带宽上限以及随机错误，
+用于在没有BDUSS的情况下压测和对比baidu_drive_api的性能
+
+用法：
+    from fake_baidu import FakeBackend, FakeConfig
+    backend = FakeBackend(FakeConfig(latency=0.02, bandwidth=20 * 1024 * 1024)).start()
+    backend.populate('/bench', dirs=10, files_per_dir=20, file_size=256 * 1024)
+    baidu_drive_api.BaiDuDrive = backend.drive_class()
+"""
+
+import os
+import re
+import time
+import random
+import hashlib
+import posixpath
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote, unquote, urlsplit, parse_qs
+
+import requests
+
+# 百度网盘的错误码：请求过于频繁、文件不存在
+ERRNO_THROTTLED = 31034
+ERRNO_NOT_FOUND = -9
+
+
+class FakeConfig:
+    """模拟后端的行为参数"""
+
+    def __init__(self, latency=0.02, jitter=0.005, method_latency=None, bandwidth=0,
+                 throttle_rate=0.0, error_rate=0.0, cdn_error_rate=0.0, dlink_ttl=8 * 3600, seed=None):
+        # 每次接口调用的基础延迟和随机抖动（秒），method_latency按方法名覆盖基础延迟
+        self.latency = latency
+        self.jitter = jitter
+        self.method_latency = method_latency or {}
+        # 每个连接的下载和上传带宽上限（字节/秒），0表示不限
+        self.bandwidth = bandwidth
+        # 接口调用返回限流错误（errno 31034）和连接错误的概率
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        # CDN返回503的概率
+        self.cdn_error_rate = cdn_error_rate
+        # 下载链接的有效期（秒）
+        self.dlink_ttl = dlink_ttl
+        self.seed = seed
+
+
+class FakeBaiduError(Exception):
+    """带百度网盘错误码的异常，与fundrive抛出的错误一样可以被upstream识别"""
+
+    def __init__(self, error_code, message):
+        super().__init__(f"errno {error_code}: {message}")
+        self.error_code = error_code
+
+
+class FakePcsFile:
+    """与BaiDuPCS的PcsFile字段一致的文件信息"""
+
+    def __init__(self, path, is_dir, size, md5, fs_id, mtime):
+        self.path = path
+        self.name = posixpath.basename(path)
+        self.fid = path
+        self.is_dir = is_dir
+        self.is_file = not is_dir
+        self.size = size
+        self.md5 = md5
+        self.fs_id = fs_id
+        self.ctime = mtime
+        self.mtime = mtime
+
+
+class FakeStore:
+    """内存中的网盘文件树"""
+
+    def __init__(self):
+        self.files = {}
+        self.meta = {}
+        self.dirs = {'/': time.time()}
+        self.slices = {}
+        self.by_md5 = {}
+        self._next_fs_id = 1
+        self._lock = threading.Lock()
+
+    def _mkdirs(self, path):
+        while path not in self.dirs:
+            self.dirs[path] = time.time()
+            path = posixpath.dirname(path)
+
+    def write(self, path, data):
+        path = normalize(path)
+        md5 = hashlib.md5(data).hexdigest()
+        with self._lock:
+            self._mkdirs(posixpath.dirname(path))
+            self.files[path] = data
+            self.meta[path] = (self._next_fs_id, time.time(), md5)
+            self._next_fs_id += 1
+            self.by_md5[md5] = data
+        return self.stat(path)
+
+    def read(self, path):
+        with self._lock:
+            data = self.files.get(normalize(path))
+        if data is None:
+            raise FakeBaiduError(ERRNO_NOT_FOUND, f"文件不存在: {path}")
+        return data
+
+    def stat(self, path):
+        path = normalize(path)
+        with self._lock:
+            if path in self.files:
+                fs_id, mtime, md5 = self.meta[path]
+                return FakePcsFile(path, False, len(self.files[path]), md5, fs_id, int(mtime))
+            if path in self.dirs:
+                return FakePcsFile(path, True, 0, None, abs(hash(path)) % 10 ** 12, int(self.dirs[path]))
+        raise FakeBaiduError(ERRNO_NOT_FOUND, f"文件不存在: {path}")
+
+    def exists(self, path):
+        path = normalize(path)
+        with self._lock:
+            return path in self.files or path in self.dirs
+
+    def list(self, path):
+        path = normalize(path)
+        with self._lock:
+            if path not in self.dirs:
+                raise FakeBaiduError(ERRNO_NOT_FOUND, f"目录不存在: {path}")
+            children = [p for p in list(self.files) + list(self.dirs) if p != '/' and posixpath.dirname(p) == path]
+        return [self.stat(p) for p in sorted(children)]
+
+    def remove(self, path):
+        path = normalize(path)
+        prefix = path.rstrip('/') + '/'
+        with self._lock:
+            if path not in self.files and path not in self.dirs:
+                raise FakeBaiduError(ERRNO_NOT_FOUND, f"文件不存在: {path}")
+            for p in [p for p in self.files if p == path or p.startswith(prefix)]:
+                del self.files[p]
+                del self.meta[p]
+            for p in [p for p in self.dirs if p != '/' and (p == path or p.startswith(prefix))]:
+                del self.dirs[p]
+
+
+def normalize(path):
+    return posixpath.normpath('/' + (path or '/').strip('/'))
+
+
+class FakeBackend:
+    """模拟后端：文件树、行为参数和本地CDN"""
+
+    def __init__(self, config=None):
+        self.config = config or FakeConfig()
+        self.store = FakeStore()
+        self.random = random.Random(self.config.seed)
+        self.calls = {}
+        self.cdn_requests = 0
+        self.base_url = None
+        self._server = None
+        self._lock = threading.Lock()
+
+    # ---- 生命周期 ----
+
+    def start(self):
+        """启动本地CDN，返回自身"""
+        class Handler(CDNHandler):
+            pass
+        Handler.backend = self
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-cdn', daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def populate(self, root='/bench', dirs=10, files_per_dir=20, file_size=64 * 1024):
+        """生成测试目录树，返回所有文件路径"""
+        paths = []
+        block = os.urandom(min(file_size, 1024 * 1024)) or b''
+        for d in range(dirs):
+            for f in range(files_per_dir):
+                path = f"{root.rstrip('/')}/d{d:03d}/f{f:04d}.bin"
+                # 每个文件内容不同，避免全部命中秒传和内容缓存
+                data = (f"{path}\n".encode() + block * (file_size // max(len(block), 1) + 1))[:file_size]
+                self.store.write(path, data)
+                paths.append(path)
+        return paths
+
+    def drive_class(self):
+        """返回绑定到本后端的BaiDuDrive替代类"""
+        class BaiDuDrive(FakeBaiDuDrive):
+            pass
+        BaiDuDrive.backend = self
+        return BaiDuDrive
+
+    # ---- 行为模拟 ----
+
+    def simulate(self, method):
+        """模拟一次接口调用：计数、延迟和随机错误"""
+        config = self.config
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            roll = self.random.random()
+            delay = config.method_latency.get(method, config.latency) + self.random.uniform(0, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if roll < config.throttle_rate:
+            raise FakeBaiduError(ERRNO_THROTTLED, f"请求过于频繁: {method}")
+        if roll < config.throttle_rate + config.error_rate:
+            raise requests.ConnectionError(f"模拟连接错误: {method}")
+
+    def transfer_delay(self, size):
+        """按带宽上限模拟传输size字节所需的时间"""
+        if self.config.bandwidth > 0 and size:
+            time.sleep(size / self.config.bandwidth)
+
+    def dlink(self, path):
+        now = int(time.time())
+        return (f"{self.base_url}/file{quote(normalize(path))}"
+                f"?fid={self.store.stat(path).fs_id}&time={now}&expires={self.config.dlink_ttl}s&dstime={now}")
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "cdn_requests": self.cdn_requests}
+
+
+class FakeApi:
+    """对应client.drive（BaiduPCSApi）的接口"""
+
+    def __init__(self, backend, bduss, stoken=None, ptoken=None):
+        self.backend = backend
+        self.store = backend.store
+        self.bduss = bduss
+        self.stoken = stoken
+        self.ptoken = ptoken
+        # 与BaiduPCSApi一样持有HTTP会话，客户端池淘汰时会关闭它
+        self._baidupcs = type('FakeBaiduPCS', (), {})()
+        self._baidupcs._session = requests.Session()
+
+    def list(self, remotepath, **kwargs):
+        self.backend.simulate('list')
+        return self.store.list(remotepath)
+
+    def meta(self, *remotepaths):
+        self.backend.simulate('meta')
+        return [self.store.stat(path) for path in remotepaths]
+
+    def exists(self, remotepath):
+        self.backend.simulate('exists')
+        return self.store.exists(remotepath)
+
+    def remove(self, *remotepaths):
+        self.backend.simulate('remove')
+        for path in remotepaths:
+            self.store.stat(path)
+        for path in remotepaths:
+            self.store.remove(path)
+        return {"errno": 0}
+
+    def download_link(self, remotepath):
+        self.backend.simulate('download_link')
+        return self.backend.dlink(remotepath)
+
+    def upload_file(self, localpath, remotepath, ondup='overwrite', callback=None):
+        self.backend.simulate('upload_file')
+        data = localpath.read() if hasattr(localpath, 'read') else open(localpath, 'rb').read()
+        self.backend.transfer_delay(len(data))
+        return self.store.write(remotepath, data)
+
+    def upload_slice(self, data, callback=None):
+        self.backend.simulate('upload_slice')
+        data = data.read() if hasattr(data, 'read') else data
+        self.backend.transfer_delay(len(data))
+        md5 = hashlib.md5(data).hexdigest()
+        with self.store._lock:
+            self.store.slices[md5] = data
+        return md5
+
+    def combine_slices(self, slice_md5s, remotepath, **kwargs):
+        self.backend.simulate('combine_slices')
+        with self.store._lock:
+            missing = [md5 for md5 in slice_md5s if md5 not in self.store.slices]
+            data = b''.join(self.store.slices.get(md5, b'') for md5 in slice_md5s)
+        if missing:
+            raise FakeBaiduError(31363, f"分片不存在: {missing[0]}")
+        return self.store.write(remotepath, data)
+
+    def rapid_upload_file(self, slice_md5, content_md5, content_crc32, io_len, remotepath, **kwargs):
+        self.backend.simulate('rapid_upload_file')
+        with self.store._lock:
+            data = self.store.by_md5.get(content_md5)
+        if data is None or len(data) != io_len:
+            raise FakeBaiduError(31079, "秒传未找到文件")
+        return self.store.write(remotepath, data)
+
+
+class FakeBaiDuDrive:
+    """对应fundrive的BaiDuDrive，由FakeBackend.drive_class()绑定后端"""
+
+    backend = None
+
+    def __init__(self):
+        self.drive = None
+
+    def login(self, bduss=None, stoken=None, ptoken=None, *args, **kwargs):
+        self.backend.simulate('login')
+        if not bduss:
+            return False
+        self.drive = FakeApi(self.backend, bduss, stoken, ptoken)
+        return True
+
+    def _list(self, path):
+        return self.backend.store.list(path)
+
+    def get_file_list(self, fid, *args, **kwargs):
+        self.backend.simulate('get_file_list')
+        return [item for item in self._list(fid) if item.is_file]
+
+    def get_dir_list(self, fid, *args, **kwargs):
+        self.backend.simulate('get_dir_list')
+        return [item for item in self._list(fid) if item.is_dir]
+
+    def upload_file(self, filepath, fid, *args, **kwargs):
+        self.backend.simulate('upload_file')
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        self.backend.transfer_delay(len(data))
+        self.backend.store.write(fid, data)
+        return True
+
+    def download_file(self, fid, filepath=None, *args, **kwargs):
+        self.backend.simulate('download_file')
+        data = self.backend.store.read(fid)
+        self.backend.transfer_delay(len(data))
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        return True
+
+    def delete(self, fid, *args, **kwargs):
+        self.backend.simulate('delete')
+        self.backend.store.remove(fid)
+        return True
+
+
+class CDNHandler(BaseHTTPRequestHandler):
+    """模拟百度CDN：校验链接有效期，支持Range，按带宽上限分块发送"""
+
+    backend = None
+    protocol_version = 'HTTP/1.1'
+    chunk_size = 64 * 1024
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, headers=(), body=b''):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        backend = self.backend
+        with backend._lock:
+            backend.cdn_requests += 1
+            failed = backend.random.random() < backend.config.cdn_error_rate
+        if failed:
+            return self._reply(503)
+
+        url = urlsplit(self.path)
+        if not url.path.startswith('/file/'):
+            return self._reply(404)
+        query = parse_qs(url.query)
+        issued = int((query.get('time') or ['0'])[0])
+        ttl = int((query.get('expires') or ['0s'])[0].rstrip('s') or 0)
+        if time.time() > issued + ttl:
+            return self._reply(403)
+        try:
+            data = backend.store.read(unquote(url.path[len('/file'):]))
+        except FakeBaiduError:
+            return self._reply(404)
+
+        size = len(data)
+        start, end, status = 0, size - 1, 200
+        headers = [('Accept-Ranges', 'bytes'), ('Content-Type', 'application/octet-stream')]
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range') or '')
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size or start > end:
+                return self._reply(416, [('Content-Range', f'bytes */{size}')])
+            status = 206
+            headers.append(('Content-Range', f'bytes {start}-{end}/{size}'))
+
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        view = memoryview(data)[start:end + 1]
+        try:
+            for offset in range(0, len(view), self.chunk_size):
+                chunk = view[offset:offset + self.chunk_size]
+                self.wfile.write(chunk)
+                backend.transfer_delay(len(chunk))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+if __name__ == '__main__':
+    # 单独运行时启动CDN并下载一个示例文件，便于手工调试
+    backend = FakeBackend().start()
+    path = backend.populate(dirs=1, files_per_dir=1)[0]
+    client = backend.drive_class()()
+    client.login(bduss='fake')
+    link = client.drive.download_link(path)
+    print(link)
+    print(f"下载 {len(requests.get(link).content)} 字节")
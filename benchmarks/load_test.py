@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+压测脚本
+启动本地模拟的百度网盘后端，在本进程内用werkzeug的多线程服务器运行baidu_drive_api.app，
+按给定的并发数依次压测各接口，输出每个接口的吞吐量、p50/p99延迟和内存峰值，并与基准文件对比，
+p99或吞吐量相对基准的退化超过容差时以非0状态退出
+
+用法：
+    python benchmarks/load_test.py                       # 压测全部场景并与benchmarks/baseline.json对比
+    python benchmarks/load_test.py --scenarios list,download --concurrency 32
+    python benchmarks/load_test.py --latency 0.05 --bandwidth 10 --throttle-rate 0.05
+    python benchmarks/load_test.py --update-baseline     # 以本次结果更新基准文件
+
+内存为整个压测进程（服务端和压测客户端）的常驻内存，压测客户端不保留响应体
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# 压测目录树的规模
+TREE_ROOT = '/bench'
+TREE_DIRS = 20
+TREE_FILES_PER_DIR = 20
+# 每次批量查询的路径数
+BATCH_SIZE = 50
+
+# 与基准对比时参与比较的配置项，配置不同时结果没有可比性
+COMPARABLE_CONFIG = ('concurrency', 'requests', 'latency', 'jitter', 'bandwidth', 'file_size', 'upload_size',
+                     'throttle_rate', 'error_rate', 'cdn_error_rate', 'accounts')
+
+
+def rss_bytes():
+    """当前进程的常驻内存，无法读取时返回None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemorySampler:
+    """后台定期采样常驻内存，记录峰值"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.start_rss = rss_bytes()
+        self.peak = self.start_rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        value = rss_bytes()
+        if value is not None and (self.peak is None or value > self.peak):
+            self.peak = value
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def percentile(sorted_values, fraction):
+    """最近秩法的百分位数"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class BenchContext:
+    """压测场景共享的状态：服务地址、会话和测试文件"""
+
+    def __init__(self, base_url, session_ids, files, args):
+        self.base_url = base_url
+        self.session_ids = session_ids
+        self.files = files
+        self.args = args
+        self.delete_paths = []
+        self.upload_body = os.urandom(args.upload_size)
+        self._local = threading.local()
+
+    @property
+    def http(self):
+        # 每个压测线程各用一个连接会话
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def headers(self, i):
+        return {'X-Session-ID': self.session_ids[i % len(self.session_ids)]}
+
+    def url(self, path):
+        return self.base_url + path
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def drain(response):
+    """读完响应体并返回字节数，不保留内容"""
+    total = 0
+    for chunk in response.iter_content(64 * 1024):
+        total += len(chunk)
+    return total
+
+
+def scenario_health(ctx, i):
+    return len(check(ctx.http.get(ctx.url('/health'))).content)
+
+
+def scenario_list(ctx, i):
+    path = f"{TREE_ROOT}/d{i % TREE_DIRS:03d}"
+    return len(check(ctx.http.get(ctx.url('/list'), params={'path': path}, headers=ctx.headers(i))).content)
+
+
+def scenario_list_uncached(ctx, i):
+    path = f"{TREE_ROOT}/d{i % TREE_DIRS:03d}"
+    return len(check(ctx.http.get(ctx.url('/list'), params={'path': path, 'refresh': '1'},
+                                  headers=ctx.headers(i))).content)
+
+
+def scenario_stat(ctx, i):
+    start = (i * BATCH_SIZE) % len(ctx.files)
+    paths = (ctx.files + ctx.files)[start:start + BATCH_SIZE]
+    return len(check(ctx.http.post(ctx.url('/batch/stat'), json={'paths': paths}, headers=ctx.headers(i))).content)
+
+
+def scenario_download(ctx, i):
+    path = ctx.files[i % len(ctx.files)]
+    with check(ctx.http.get(ctx.url('/download'), params={'path': path}, headers=ctx.headers(i),
+                            stream=True)) as response:
+        return drain(response)
+
+
+def scenario_download_range(ctx, i):
+    path = ctx.files[i % len(ctx.files)]
+    headers = dict(ctx.headers(i), Range='bytes=0-65535')
+    with check(ctx.http.get(ctx.url('/download'), params={'path': path}, headers=headers,
+                            stream=True)) as response:
+        return drain(response)
+
+
+def scenario_upload_stream(ctx, i):
+    check(ctx.http.put(ctx.url('/upload_stream'), params={'path': f'{TREE_ROOT}/uploads',
+                                                         'filename': f'{uuid.uuid4().hex}.bin'},
+                       data=ctx.upload_body, headers=ctx.headers(i)))
+    return len(ctx.upload_body)
+
+
+def scenario_upload(ctx, i):
+    files = {'file': (f'{uuid.uuid4().hex}.bin', ctx.upload_body)}
+    check(ctx.http.post(ctx.url('/upload'), data={'path': f'{TREE_ROOT}/uploads'}, files=files,
+                        headers=ctx.headers(i)))
+    return len(ctx.upload_body)
+
+
+def scenario_delete(ctx, i):
+    return len(check(ctx.http.delete(ctx.url('/delete'), params={'path': ctx.delete_paths[i]},
+                                     headers=ctx.headers(i))).content)
+
+
+SCENARIOS = {
+    'health': scenario_health,
+    'list': scenario_list,
+    'list_uncached': scenario_list_uncached,
+    'stat': scenario_stat,
+    'download': scenario_download,
+    'download_range': scenario_download_range,
+    'upload_stream': scenario_upload_stream,
+    'upload': scenario_upload,
+    'delete': scenario_delete,
+}
+
+
+def run_scenario(ctx, name, fn):
+    """以args.concurrency个线程执行args.requests次请求，返回统计结果"""
+    args = ctx.args
+    latencies = []
+    errors = []
+    transferred = [0]
+    lock = threading.Lock()
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            size = fn(ctx, i)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            transferred[0] += size
+
+    with MemorySampler() as memory:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(one, range(args.requests)))
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    mb = 1024 * 1024
+    return {
+        "requests": args.requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0,
+        "throughput_mbps": round(transferred[0] / mb / wall, 2) if wall else 0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        "peak_rss_mb": round(memory.peak / mb, 1) if memory.peak else None,
+        "rss_growth_mb": round((memory.peak - memory.start_rss) / mb, 1) if memory.peak else None,
+    }
+
+
+def compare(results, baseline, config, tolerance):
+    """与基准对比，返回退化项列表"""
+    regressions = []
+    baseline_config = baseline.get("config", {})
+    mismatched = [key for key in COMPARABLE_CONFIG if baseline_config.get(key) != config.get(key)]
+    if mismatched:
+        print(f"注意：压测参数与基准不同（{', '.join(mismatched)}），对比结果仅供参考")
+    for name, result in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if result["p99_ms"] is not None and base.get("p99_ms"):
+            if result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+                regressions.append(f"{name}: p99 {result['p99_ms']}ms，基准 {base['p99_ms']}ms")
+        if base.get("throughput_rps") and result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: 吞吐量 {result['throughput_rps']}/s，基准 {base['throughput_rps']}/s")
+        if base.get("errors") == 0 and result["errors"]:
+            regressions.append(f"{name}: {result['errors']}个请求失败，首个错误: {result['first_error']}")
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='使用模拟后端压测baidu_drive_api')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='逗号分隔的场景名')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发请求数')
+    parser.add_argument('--requests', type=int, default=200, help='每个场景的请求数')
+    parser.add_argument('--accounts', type=int, default=4, help='登录的账号数，请求轮流使用')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟后端每次接口调用的延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.005, help='延迟的随机抖动（秒）')
+    parser.add_argument('--bandwidth', type=float, default=0, help='每个连接的带宽上限（MB/s），0为不限')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='接口调用返回限流错误的概率')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='接口调用返回连接错误的概率')
+    parser.add_argument('--cdn-error-rate', type=float, default=0.0, help='CDN返回503的概率')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='测试文件大小（字节）')
+    parser.add_argument('--upload-size', type=int, default=256 * 1024, help='上传场景的请求体大小（字节）')
+    parser.add_argument('--seed', type=int, default=1, help='模拟后端的随机种子')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基准文件路径')
+    parser.add_argument('--update-baseline', action='store_true', help='以本次结果更新基准文件')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='p99和吞吐量允许的退化比例')
+    parser.add_argument('--output', help='把结果以JSON写入该文件')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios.split(',') if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}，可选: {', '.join(SCENARIOS)}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 数据库、任务目录等都放到临时目录，不影响本机的服务数据
+    workdir = tempfile.mkdtemp(prefix='baidu-bench-')
+    os.environ['HOME'] = workdir
+    # 压测的是服务本身，默认放宽每个账号的上游限速；需要模拟生产限速时显式设置UPSTREAM_RATE
+    os.environ.setdefault('UPSTREAM_RATE', '100000')
+    os.environ.setdefault('UPSTREAM_BURST', '100000')
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, BENCH_DIR)
+
+    from werkzeug.serving import make_server
+    from fake_baidu import FakeBackend, FakeConfig
+    import baidu_drive_api
+    logging.getLogger('baidu_drive_api').setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    backend = FakeBackend(FakeConfig(
+        latency=args.latency, jitter=args.jitter, bandwidth=int(args.bandwidth * 1024 * 1024),
+        throttle_rate=args.throttle_rate, error_rate=args.error_rate,
+        cdn_error_rate=args.cdn_error_rate, seed=args.seed,
+    )).start()
+    files = backend.populate(TREE_ROOT, dirs=TREE_DIRS, files_per_dir=TREE_FILES_PER_DIR, file_size=args.file_size)
+    # 首次登录时直接使用模拟后端，不导入fundrive
+    baidu_drive_api.BaiDuDrive = backend.drive_class()
+
+    server = make_server('127.0.0.1', 0, baidu_drive_api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    session_ids = []
+    for index in range(args.accounts):
+        response = requests.post(base_url + '/login', json={'bduss': f'bench-account-{index:04d}',
+                                                            'session_id': f'bench-{index}'})
+        session_ids.append(check(response).json()['session_id'])
+
+    ctx = BenchContext(base_url, session_ids, files, args)
+    ctx.delete_paths = backend.populate(f'{TREE_ROOT}/trash', dirs=1, files_per_dir=args.requests, file_size=1024)
+
+    config = {key: getattr(args, key) for key in COMPARABLE_CONFIG}
+    results = {}
+    print(f"并发 {args.concurrency}，每个场景 {args.requests} 个请求，模拟延迟 {args.latency * 1000:.0f}ms")
+    print(f"{'场景':<16}{'吞吐(req/s)':>12}{'吞吐(MB/s)':>12}{'p50(ms)':>10}{'p99(ms)':>10}"
+          f"{'失败':>6}{'内存峰值(MB)':>14}")
+    for name in args.scenarios.split(','):
+        result = results[name] = run_scenario(ctx, name, SCENARIOS[name])
+        print(f"{name:<16}{result['throughput_rps']:>12}{result['throughput_mbps']:>12}"
+              f"{result['p50_ms'] if result['p50_ms'] is not None else '-':>10}"
+              f"{result['p99_ms'] if result['p99_ms'] is not None else '-':>10}"
+              f"{result['errors']:>6}{result['peak_rss_mb'] or '-':>14}")
+        if result['first_error']:
+            print(f"    首个错误: {result['first_error']}")
+
+    report = {"config": config, "scenarios": results, "backend": backend.stats()}
+    server.shutdown()
+    backend.stop()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({"config": config, "scenarios": results}, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"已更新基准文件 {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"基准文件 {args.baseline} 不存在，使用 --update-baseline 生成")
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, config, args.tolerance)
+    if regressions:
+        print("相对基准退化：")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("与基准相比没有明显退化")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
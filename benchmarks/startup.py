@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+启动耗时基准
+在全新的子进程中导入baidu_drive_api并请求一次/health，分别测量懒加载（LAZY_INIT=1，默认）
+和启动时导入fundrive（LAZY_INIT=0）两种模式，每种模式运行多次取中位数
+
+用法：
+    python benchmarks/startup.py [--runs 5]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中执行，输出各阶段耗时（秒）
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+import baidu_drive_api
+imported = time.perf_counter()
+baidu_drive_api.app.test_client().get('/health')
+ready = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "first_health": ready - started,
+    "drive_loaded": baidu_drive_api.BaiDuDrive is not None,
+}))
+'''
+
+
+def run_once(lazy):
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ)
+        env.update({
+            'HOME': home,
+            'LAZY_INIT': '1' if lazy else '0',
+            'PYTHONPATH': os.pathsep.join(filter(None, [REPO_ROOT, env.get('PYTHONPATH')])),
+        })
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', CHILD], cwd=home, env=env,
+                                capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"子进程启动失败:\n{result.stderr}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process"] = elapsed
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='测量baidu_drive_api的启动耗时')
+    parser.add_argument('--runs', type=int, default=5, help='每种模式运行的次数')
+    args = parser.parse_args(argv)
+
+    report = {}
+    for name, lazy in (('eager', False), ('lazy', True)):
+        runs = [run_once(lazy) for _ in range(args.runs)]
+        report[name] = {
+            key: round(statistics.median(run[key] for run in runs), 4)
+            for key in ('import', 'first_health', 'process')
+        }
+        report[name]["drive_loaded"] = runs[-1]["drive_loaded"]
+
+    for name, timings in report.items():
+        print(f"{name:>6}: 导入 {timings['import'] * 1000:8.1f} ms  "
+              f"首个/health {timings['first_health'] * 1000:8.1f} ms  "
+              f"进程总耗时 {timings['process'] * 1000:8.1f} ms  "
+              f"已导入BaiDuDrive={timings['drive_loaded']}")
+    saved = report['eager']['first_health'] - report['lazy']['first_health']
+    print(f"懒加载使首个/health提前 {saved * 1000:.1f} ms")
+    print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
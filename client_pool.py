@@ -0,0 +1,151 @@
+"""
+BaiDuDrive客户端池
+按账号（bduss）缓存已登录的客户端，限制最大数量并按空闲时间淘汰，淘汰时释放客户端持有的HTTP会话
+"""
+
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger('baidu_drive_api')
+
+
+def release_client(client):
+    """释放客户端的HTTP会话；挂载的共享连接池不会随之关闭，其中的连接继续供其他客户端使用"""
+    try:
+        session = client.drive._baidupcs._session
+    except AttributeError:
+        return
+    try:
+        session.close()
+    except Exception as e:
+        logger.warning(f"关闭客户端HTTP会话失败: {e}")
+
+
+class ClientPool:
+    """带容量上限、空闲过期和LRU淘汰的客户端池"""
+
+    def __init__(self, factory, max_size=64, idle_ttl=1800):
+        # factory(credentials)返回已登录的客户端，登录失败返回None
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._entries = OrderedDict()  # bduss -> [client, credentials, last_used]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, credentials):
+        """获取凭证对应的客户端，不存在、凭证变化或已过期时返回None"""
+        key = credentials.get('bduss')
+        released = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] != credentials:
+                # 同一账号更换了stoken/ptoken，旧客户端作废
+                released = self._entries.pop(key)[0]
+                entry = None
+            elif entry is not None and self._is_expired(entry, time.time()):
+                released = self._entries.pop(key)[0]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                entry[2] = time.time()
+                self._entries.move_to_end(key)
+
+        if released is not None:
+            release_client(released)
+        return entry[0] if entry is not None else None
+
+    def get_or_create(self, credentials):
+        """获取客户端，池中没有时调用factory登录并放入池中"""
+        client = self.get(credentials)
+        if client is not None:
+            return client
+
+        client = self.factory(credentials)
+        if client is None:
+            return None
+        return self.put(credentials, client)
+
+    def put(self, credentials, client):
+        """放入客户端；并发创建时保留先放入的那个，返回实际在池中的客户端"""
+        key = credentials.get('bduss')
+        released = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == credentials:
+                entry[2] = time.time()
+                self._entries.move_to_end(key)
+                released.append(client)
+                client = entry[0]
+            else:
+                if entry is not None:
+                    released.append(entry[0])
+                self._entries[key] = [client, dict(credentials), time.time()]
+                self._entries.move_to_end(key)
+                released.extend(self._evict_locked())
+
+        for item in released:
+            release_client(item)
+        return client
+
+    def discard(self, bduss):
+        """移除并释放某个账号的客户端"""
+        with self._lock:
+            entry = self._entries.pop(bduss, None)
+        if entry is not None:
+            release_client(entry[0])
+            return True
+        return False
+
+    def purge_expired(self):
+        """清理所有空闲过期的客户端"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if self._is_expired(entry, now)]
+            released = [self._entries.pop(key)[0] for key in expired]
+            self.expirations += len(released)
+        for client in released:
+            release_client(client)
+        return len(released)
+
+    def stats(self):
+        """客户端池统计信息"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "idle_ttl": self.idle_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def _is_expired(self, entry, now):
+        return bool(self.idle_ttl) and now - entry[2] > self.idle_ttl
+
+    def _evict_locked(self):
+        """先淘汰过期的，再按LRU淘汰超出容量的，返回需要释放的客户端"""
+        now = time.time()
+        released = []
+        for key in [k for k, entry in self._entries.items() if self._is_expired(entry, now)]:
+            released.append(self._entries.pop(key)[0])
+            self.expirations += 1
+        while len(self._entries) > self.max_size:
+            key, entry = self._entries.popitem(last=False)
+            released.append(entry[0])
+            self.evictions += 1
+            logger.info("客户端池已满，淘汰最久未使用的客户端")
+        return released
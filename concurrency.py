@@ -0,0 +1,90 @@
+"""
+并发工具
+提供进程内共享的线程池（上游调用、上传分片各自独立），以及合并相同并发请求的SingleFlight
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+_executors = {}
+_executor_lock = threading.Lock()
+
+
+def get_executor(name='upstream', max_workers=None):
+    """获取进程内按名称共享的线程池；默认是上游调用线程池，大小由UPSTREAM_WORKERS控制。
+    上传分片等耗时较长的批量传输使用单独名称的线程池，不占用列表、元数据等交互请求的线程"""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                if max_workers is None:
+                    max_workers = int(os.environ.get('UPSTREAM_WORKERS', 16))
+                executor = _executors[name] = ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix=name
+                )
+    return executor
+
+
+class SingleFlight:
+    """相同key的并发调用只执行一次，其余调用等待并共享同一个结果（或异常）"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+
+        return future.result()
+
+    def stats(self):
+        """执行次数与被合并的调用次数"""
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+            }
+
+
+def fan_out(fn, items, max_workers=8, executor=None):
+    """在共享线程池上对items逐个调用fn，同时最多运行max_workers个；
+    按输入顺序返回(item, 结果, 异常)列表，单个失败不影响其他项"""
+    executor = executor or get_executor()
+    slots = threading.BoundedSemaphore(max(1, max_workers))
+
+    def call(item):
+        try:
+            return item, fn(item), None
+        except Exception as e:
+            return item, None, e
+        finally:
+            slots.release()
+
+    futures = []
+    for item in items:
+        slots.acquire()
+        futures.append(executor.submit(call, item))
+    return [future.result() for future in futures]
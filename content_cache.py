@@ -0,0 +1,302 @@
+"""
+磁盘内容缓存
+按远程文件的MD5（没有MD5时按fs_id、修改时间和大小）把下载过的文件保存在本地磁盘，
+在总字节数上限内按LRU或LFU淘汰；文件先写入临时文件再原子替换，同一文件的并发填充只下载一次，
+填充进行中的其他请求等待填充完成后从缓存发送。
+每次使用前用网盘当前的元数据计算缓存键，远程文件变化后键随之变化，不会返回旧内容；
+也可以在转发下载数据的同时写入缓存（tee），避免为填充缓存再下载一次。
+通过本服务写入的路径记录在共享的索引中，同机的所有worker据此判断目录列表缓存中的元数据是否已经过时
+"""
+
+import os
+import re
+import time
+import uuid
+import posixpath
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from local_db import LocalDB
+from concurrency import SingleFlight
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 缓存目录和总字节数上限，上限为0时不启用缓存
+CONTENT_CACHE_DIR = os.environ.get(
+    'CONTENT_CACHE_DIR', os.path.join(os.environ.get('HOME', '/tmp'), '.fundrive', 'content_cache'))
+CONTENT_CACHE_MAX_BYTES = int(os.environ.get('CONTENT_CACHE_MAX_BYTES', 0))
+# 单个文件的大小上限，默认为总上限的四分之一
+CONTENT_CACHE_MAX_FILE = int(os.environ.get('CONTENT_CACHE_MAX_FILE', 0))
+# 淘汰策略：lru（最久未访问）或lfu（访问次数最少）
+CONTENT_CACHE_POLICY = os.environ.get('CONTENT_CACHE_POLICY', 'lru')
+# 后台填充缓存的并发数
+CONTENT_CACHE_FILL_WORKERS = int(os.environ.get('CONTENT_CACHE_FILL_WORKERS', 2))
+# 同一文件正在填充时，其他请求等待填充完成的最长时间（秒），超时后自行从网盘下载
+CONTENT_CACHE_FILL_WAIT = float(os.environ.get('CONTENT_CACHE_FILL_WAIT', 30))
+
+# 写入记录保留的时间（秒），需要大于目录列表缓存的有效期
+WRITE_LOG_SECONDS = 3600
+
+MD5_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+EVICTION_ORDER = {
+    'lru': 'last_access ASC',
+    'lfu': 'hits ASC, last_access ASC',
+}
+
+
+def cache_key(pcs_file):
+    """根据远程文件的元数据计算缓存键"""
+    md5 = (pcs_file.md5 or '').lower()
+    if MD5_PATTERN.match(md5):
+        return md5
+    return f"fs{pcs_file.fs_id}_{pcs_file.mtime}_{pcs_file.size}"
+
+
+class ContentCache:
+    """内容寻址的磁盘缓存，索引保存在SQLite中，同机的多个worker共享"""
+
+    def __init__(self, root, max_bytes, max_file_size=None, policy='lru', fill_workers=CONTENT_CACHE_FILL_WORKERS):
+        if policy not in EVICTION_ORDER:
+            raise ValueError(f"不支持的淘汰策略: {policy}")
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size or max_bytes // 4
+        self.policy = policy
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.db = LocalDB(os.path.join(root, 'index.db'), schema=(
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            'key TEXT PRIMARY KEY, '
+            'size INTEGER NOT NULL, '
+            'created_at REAL NOT NULL, '
+            'last_access REAL NOT NULL, '
+            'hits INTEGER NOT NULL DEFAULT 0)',
+            'CREATE TABLE IF NOT EXISTS writes ('
+            'account TEXT NOT NULL, '
+            'path TEXT NOT NULL, '
+            'written_at REAL NOT NULL, '
+            'PRIMARY KEY (account, path))',
+        ))
+        self._flight = SingleFlight()
+        self._fill_executor = ThreadPoolExecutor(max_workers=max(1, fill_workers), thread_name_prefix='cache-fill')
+        # 填充中的key -> 填充结束时设置的Event
+        self._filling = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.fill_errors = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.bytes_filled = 0
+
+    def blob_path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def cacheable(self, size):
+        return 0 < size <= self.max_file_size
+
+    def lookup(self, key, size):
+        """返回缓存文件的路径并更新访问记录，不存在或大小不符时返回None"""
+        path = self.blob_path(key)
+        conn = self.db.connect()
+        row = conn.execute('SELECT size FROM blobs WHERE key = ?', (key,)).fetchone()
+        if row is None or row[0] != size or not os.path.exists(path):
+            with self._lock:
+                self.misses += 1
+            if row is not None:
+                self._remove(conn, key)
+            return None
+
+        with conn:
+            conn.execute('UPDATE blobs SET last_access = ?, hits = hits + 1 WHERE key = ?', (time.time(), key))
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+        return path
+
+    def fill(self, key, size, fetch):
+        """下载并写入缓存，返回缓存文件路径；fetch(target)把文件下载到target，同一key的并发填充只执行一次"""
+        started = self.claim(key)
+        try:
+            return self._flight.do(key, self._fill, key, size, fetch)
+        finally:
+            if started:
+                self.release(key)
+
+    def fill_async(self, key, size, fetch):
+        """在后台填充缓存，已在填充中的key直接忽略"""
+        if not self.claim(key):
+            return
+
+        def run():
+            try:
+                self.fill(key, size, fetch)
+            except Exception as e:
+                logger.warning(f"后台填充缓存 {key} 失败: {e}")
+            finally:
+                self.release(key)
+
+        self._fill_executor.submit(run)
+
+    def tee(self, key, size, chunks, claimed=False):
+        """逐块转发chunks，同时写入临时文件；完整收到size字节后存入缓存，中途断开或出错时丢弃。
+        用于stream模式未命中时从转发给客户端的数据填充缓存，不再单独下载一次；
+        claimed为True表示调用方已经登记了该key的填充，否则在这里登记，同一key已在填充中时只转发"""
+        if not claimed and not self.claim(key):
+            yield from chunks
+            return
+
+        tmp_path = os.path.join(self.tmp_dir, f"{key}.{uuid.uuid4().hex}.tee")
+        received = 0
+        try:
+            with open(tmp_path, 'wb') as tmp:
+                for chunk in chunks:
+                    tmp.write(chunk)
+                    received += len(chunk)
+                    yield chunk
+            if received == size:
+                try:
+                    self._flight.do(key, self._fill, key, size, lambda target: os.replace(tmp_path, target))
+                except Exception as e:
+                    logger.warning(f"从转发的数据填充缓存 {key} 失败: {e}")
+        finally:
+            self.release(key)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def wait_fill(self, key, timeout=CONTENT_CACHE_FILL_WAIT):
+        """同一key正在填充（包括tee）时等待其结束，最多等待timeout秒；没有在填充或已结束时返回True"""
+        with self._lock:
+            event = self._filling.get(key)
+        return event is None or event.wait(timeout)
+
+    def claim(self, key):
+        """登记key正在填充，已在填充中时返回False；登记成功的调用方负责在结束时调用release"""
+        with self._lock:
+            if key in self._filling:
+                return False
+            self._filling[key] = threading.Event()
+            return True
+
+    def release(self, key):
+        with self._lock:
+            event = self._filling.pop(key, None)
+        if event is not None:
+            event.set()
+
+    # ---- 写入记录 ----
+
+    def record_write(self, account, path):
+        """记录通过本服务写入（上传、覆盖、删除）的路径，同机的其他worker也能看到"""
+        now = time.time()
+        conn = self.db.connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO writes (account, path, written_at) VALUES (?, ?, ?)',
+                         (account, path, now))
+            conn.execute('DELETE FROM writes WHERE written_at < ?', (now - WRITE_LOG_SECONDS,))
+
+    def written_since(self, account, path, since):
+        """path或其上级目录在since之后是否通过本服务写入过"""
+        paths = [path]
+        while path not in ('', '/'):
+            path = posixpath.dirname(path)
+            paths.append(path)
+        row = self.db.connect().execute(
+            f'SELECT 1 FROM writes WHERE account = ? AND written_at >= ? AND path IN ({",".join("?" * len(paths))})',
+            (account, since) + tuple(paths)
+        ).fetchone()
+        return row is not None
+
+    def _fill(self, key, size, fetch):
+        path = self.blob_path(key)
+        # 其他worker可能已经填充完成
+        conn = self.db.connect()
+        row = conn.execute('SELECT size FROM blobs WHERE key = ?', (key,)).fetchone()
+        if row is not None and row[0] == size and os.path.exists(path):
+            return path
+
+        tmp_path = os.path.join(self.tmp_dir, f"{key}.{uuid.uuid4().hex}")
+        try:
+            fetch(tmp_path)
+            actual = os.path.getsize(tmp_path)
+            if actual != size:
+                raise IOError(f"缓存文件大小不符: 期望{size}，实际{actual}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except Exception:
+            with self._lock:
+                self.fill_errors += 1
+            raise
+        finally:
+            for leftover in (tmp_path, tmp_path + '.segments.json'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        now = time.time()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO blobs (key, size, created_at, last_access, hits) VALUES (?, ?, ?, ?, 0)',
+                (key, size, now, now)
+            )
+        with self._lock:
+            self.fills += 1
+            self.bytes_filled += size
+        self._evict(conn, keep=key)
+        return path
+
+    def _evict(self, conn, keep=None):
+        """总大小超过上限时按淘汰策略删除缓存文件"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute(f'SELECT key, size FROM blobs ORDER BY {EVICTION_ORDER[self.policy]}').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(conn, key)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def _remove(self, conn, key):
+        with conn:
+            conn.execute('DELETE FROM blobs WHERE key = ?', (key,))
+        try:
+            # 正在发送中的文件已经打开，删除不会影响发送
+            os.remove(self.blob_path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        """缓存统计信息"""
+        conn = self.db.connect()
+        entries, used = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes_used": used,
+                "max_bytes": self.max_bytes,
+                "policy": self.policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "fills": self.fills,
+                "fill_errors": self.fill_errors,
+                "evictions": self.evictions,
+                "bytes_saved": self.bytes_saved,
+                "bytes_filled": self.bytes_filled,
+            }
+
+
+def create_content_cache():
+    """根据环境变量创建内容缓存，CONTENT_CACHE_MAX_BYTES为0时不启用，返回None"""
+    if CONTENT_CACHE_MAX_BYTES <= 0:
+        return None
+    return ContentCache(CONTENT_CACHE_DIR, CONTENT_CACHE_MAX_BYTES,
+                        max_file_size=CONTENT_CACHE_MAX_FILE, policy=CONTENT_CACHE_POLICY)
@@ -0,0 +1,189 @@
+"""
+下载链接缓存
+百度网盘的下载链接（dlink）在数小时内有效，按账号和路径缓存，过期时间从链接本身的参数中解析；
+删除或覆盖文件时主动失效，访问频繁的链接在过期前由后台提前刷新，下载时不再需要先调用一次接口
+"""
+
+import os
+import re
+import time
+import threading
+import logging
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+from concurrency import get_executor, SingleFlight
+from list_cache import normalize_path
+from session_store import account_key
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 缓存的链接数量上限
+DLINK_CACHE_SIZE = int(os.environ.get('DLINK_CACHE_SIZE', 4096))
+# 无法从链接中解析出过期时间时使用的有效期（秒）
+DLINK_DEFAULT_TTL = int(os.environ.get('DLINK_DEFAULT_TTL', 3600))
+# 提前多少秒视为过期，避免链接在转发过程中失效
+DLINK_EXPIRY_MARGIN = int(os.environ.get('DLINK_EXPIRY_MARGIN', 300))
+# 距离过期不足多少秒时，对热点链接在后台提前刷新
+DLINK_REFRESH_AHEAD = int(os.environ.get('DLINK_REFRESH_AHEAD', 900))
+# 命中多少次后视为热点链接
+DLINK_HOT_HITS = int(os.environ.get('DLINK_HOT_HITS', 3))
+
+DURATION_PATTERN = re.compile(r'^(\d+)([smhd]?)$')
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_expiry(url, now=None):
+    """从下载链接的参数中解析过期的时间戳，无法解析时返回None
+
+    dlink形如 ...?fid=...&time=1700000000&expires=8h&dstime=1700000000...，
+    expires可以是时长（8h、3600）或绝对时间戳，签发时间取dstime或time，没有时以当前时间计
+    """
+    now = now or time.time()
+    try:
+        query = parse_qs(urlsplit(url).query)
+    except ValueError:
+        return None
+
+    expires = (query.get('expires') or [None])[0]
+    if not expires:
+        return None
+    match = DURATION_PATTERN.match(expires.strip().lower())
+    if not match:
+        return None
+    value, unit = int(match.group(1)), match.group(2)
+    if not unit and value > 1000000000:
+        return float(value)
+
+    issued = now
+    for name in ('dstime', 'time'):
+        raw = (query.get(name) or [''])[0]
+        if raw.isdigit() and int(raw) > 1000000000:
+            issued = float(raw)
+            break
+    return issued + value * DURATION_UNITS[unit]
+
+
+class DlinkCache:
+    """按账号和路径缓存下载链接，带过期时间、LRU容量上限和热点提前刷新"""
+
+    def __init__(self, max_size=DLINK_CACHE_SIZE, default_ttl=DLINK_DEFAULT_TTL, margin=DLINK_EXPIRY_MARGIN,
+                 refresh_ahead=DLINK_REFRESH_AHEAD, hot_hits=DLINK_HOT_HITS):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self.refresh_ahead = refresh_ahead
+        self.hot_hits = hot_hits
+        # (account, path) -> {"link", "expires_at", "fs_id", "hits", "refreshing"}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.refreshes = 0
+        self.invalidations = 0
+
+    def resolve(self, client, path, fs_id=None):
+        """获取path的下载链接，缓存未命中或已过期时调用client.drive.download_link
+
+        fs_id与缓存中的记录不一致时（文件已被替换）视为未命中
+        """
+        account = account_key(client.drive.bduss)
+        key = (account, normalize_path(path))
+        now = time.time()
+        refresh = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (now >= entry["expires_at"] or (fs_id and entry["fs_id"] and fs_id != entry["fs_id"])):
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is not None:
+                if fs_id and not entry["fs_id"]:
+                    entry["fs_id"] = fs_id
+                self.hits += 1
+                entry["hits"] += 1
+                self._entries.move_to_end(key)
+                if (not entry["refreshing"] and entry["hits"] >= self.hot_hits
+                        and entry["expires_at"] - now < self.refresh_ahead):
+                    entry["refreshing"] = refresh = True
+                link = entry["link"]
+            else:
+                self.misses += 1
+
+        if entry is None:
+            # 同一链接的并发请求只调用一次接口
+            return self._flight.do(key, self._fetch, client, key, fs_id)
+        if refresh:
+            get_executor().submit(self._refresh, client, key, fs_id)
+        return link
+
+    def _fetch(self, client, key, fs_id):
+        link = client.drive.download_link(key[1])
+        if link:
+            self._store(key, link, fs_id)
+        return link
+
+    def _refresh(self, client, key, fs_id):
+        try:
+            self._fetch(client, key, fs_id)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            logger.warning(f"提前刷新下载链接 {key[1]} 失败: {e}")
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry["refreshing"] = False
+
+    def _store(self, key, link, fs_id=None):
+        now = time.time()
+        expires_at = parse_expiry(link, now) or now + self.default_ttl
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = {
+                "link": link,
+                "expires_at": expires_at - self.margin,
+                "fs_id": fs_id or (previous["fs_id"] if previous else None),
+                # 刷新后保留热度，使热点链接持续被提前刷新
+                "hits": previous["hits"] if previous else 0,
+                "refreshing": False,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def expires_at(self, client, path):
+        """缓存中链接的有效截止时间，没有缓存时返回None"""
+        key = (account_key(client.drive.bduss), normalize_path(path))
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry["expires_at"] if entry else None
+
+    def invalidate(self, account, path):
+        """文件被删除或覆盖时使其链接失效；如果是目录，连同其下所有文件一起失效"""
+        path = normalize_path(path)
+        prefix = path.rstrip('/') + '/'
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if key[0] == account and (key[1] == path or key[1].startswith(prefix))
+            ]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "refreshes": self.refreshes,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,96 @@
+"""
+流式下载代理
+解析文件的下载链接后，把百度CDN的响应体分块转发给客户端，不落盘、内存占用固定，
+并透传Range请求以支持视频拖动和断点续传
+"""
+
+import os
+import logging
+from urllib.parse import quote
+
+from flask import Response
+
+from transport import stream_get
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 每次转发的块大小
+CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 64 * 1024))
+
+# 需要从上游透传给客户端的响应头
+PASSTHROUGH_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified')
+
+
+def build_download_headers(client):
+    """访问下载链接所需的请求头，与fundrive的download_file保持一致；
+    要求上游不压缩响应体，透传的Content-Length和Content-Range才与转发的字节一致"""
+    return {
+        "User-Agent": "softxm;netdisk",
+        "Connection": "Keep-Alive",
+        "Accept-Encoding": "identity",
+        "Cookie": f"BDUSS={client.drive.bduss};ptoken={client.drive.ptoken}",
+    }
+
+
+def passthrough_headers(upstream_headers, decoded=True):
+    """需要透传给客户端的上游响应头。上游仍然压缩了响应体时：decoded为True表示转发的是解压后的数据，
+    不透传压缩后的Content-Length；否则原样转发压缩数据，同时透传Content-Encoding"""
+    headers = {k: upstream_headers[k] for k in PASSTHROUGH_HEADERS if k in upstream_headers}
+    encoding = upstream_headers.get('Content-Encoding', 'identity').strip().lower()
+    if encoding != 'identity':
+        if decoded:
+            headers.pop('Content-Length', None)
+        else:
+            headers['Content-Encoding'] = upstream_headers['Content-Encoding']
+    return headers
+
+
+def content_disposition(filename):
+    """生成兼容中文文件名的Content-Disposition"""
+    try:
+        filename.encode('ascii')
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+
+def open_upstream(url, headers, range_header=None, session=None, timeout=(10, 60)):
+    """以流式方式请求下载链接，range_header为客户端传入的Range请求头；默认使用进程内共享的连接池"""
+    headers = dict(headers)
+    if range_header:
+        headers['Range'] = range_header
+    if session is None:
+        return stream_get(url, headers, timeout=timeout)
+    return session.get(url, headers=headers, stream=True, timeout=timeout)
+
+
+def iter_upstream(upstream, chunk_size=CHUNK_SIZE):
+    """逐块读取上游响应体，结束或客户端断开时关闭上游连接"""
+    try:
+        for chunk in upstream.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+    finally:
+        upstream.close()
+
+
+def stream_response(upstream, filename, chunk_size=CHUNK_SIZE, tee=None):
+    """把上游响应包装为Flask流式响应，保留206/416等状态码和Range相关响应头；
+    tee(chunks)返回转发前经过的迭代器，用于在转发的同时保存数据"""
+    headers = passthrough_headers(upstream.headers)
+    headers.setdefault('Accept-Ranges', 'bytes')
+    headers['Content-Disposition'] = content_disposition(filename)
+
+    body = iter_upstream(upstream, chunk_size)
+    if tee is not None:
+        body = tee(body)
+
+    response = Response(
+        body,
+        status=upstream.status_code,
+        headers=headers,
+        mimetype='application/octet-stream',
+        direct_passthrough=True
+    )
+    response.call_on_close(upstream.close)
+    return response
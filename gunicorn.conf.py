@@ -0,0 +1,30 @@
+"""
+gunicorn配置，gunicorn启动时自动读取当前目录下的本文件
+默认预加载应用：Flask应用和共享状态在主进程中只导入一次，worker通过fork继承，重启或新增worker时不再重复导入；
+后台任务线程在fork之后由每个worker各自启动
+"""
+
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# 预加载时主进程同时导入fundrive，worker首次登录不必再导入，但worker要等导入完成后才启动
+PRELOAD_DRIVE = os.environ.get('PRELOAD_DRIVE', '0') == '1'
+
+if preload_app:
+    # 主进程中不启动后台线程，fork之后由post_fork启动
+    os.environ['DEFER_BACKGROUND_START'] = '1'
+
+
+def when_ready(server):
+    if preload_app and PRELOAD_DRIVE:
+        import baidu_drive_api
+        try:
+            baidu_drive_api.load_drive_class()
+        except Exception as e:
+            server.log.warning(f"预加载BaiDuDrive失败，将在首次登录时重试: {e}")
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import baidu_drive_api
+        baidu_drive_api.start_background()
@@ -17,6 +17,10 @@ pip install --no-cache-dir numpy==1.24.3 pandas==1.5.3
 echo "安装其他依赖..."
 pip install --no-cache-dir python-dateutil>=2.8.2 pytz>=2021.3 six>=1.16.0
 
+# 安装ASGI模式（SERVER_MODE=asgi）的依赖，默认的同步模式不会用到
+echo "安装ASGI模式依赖..."
+pip install --no-cache-dir a2wsgi>=1.7.0 httpx>=0.23.0 uvicorn>=0.20.0
+
 # 安装fundrive依赖链
 echo "安装fundrive依赖链..."
 pip install --no-cache-dir git+https://github.com/farfarfun/funbuild.git
@@ -0,0 +1,392 @@
+"""
+后台传输任务
+上传、下载等大文件传输以任务方式在后台执行，请求立即返回任务ID；
+任务状态保存在本地SQLite中，由各个worker进程认领执行，服务重启后未完成的任务会重新排队
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+import logging
+
+from local_db import LocalDB, default_db_path
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+CANCELLING = 'cancelling'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# 进度写入数据库的最小间隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+
+class JobCancelled(Exception):
+    """任务被取消"""
+
+
+class JobContext:
+    """传给任务执行函数的上下文，用于汇报进度和检查取消"""
+
+    def __init__(self, manager, job):
+        self.manager = manager
+        self.job = job
+        self.cancel_event = threading.Event()
+        self._last_flush = 0
+        self._lock = threading.Lock()
+
+    @property
+    def params(self):
+        return self.job["params"]
+
+    def progress(self, bytes_done, bytes_total=None):
+        """汇报已传输字节数，可以在任意线程中调用；任务被取消时抛出JobCancelled"""
+        self.report(bytes_done, bytes_total)
+        self.check_cancelled()
+
+    def report(self, bytes_done, bytes_total=None):
+        """汇报已传输字节数，不抛出异常；任务被取消时只设置cancel_event"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_flush < PROGRESS_INTERVAL:
+                flush = False
+            else:
+                self._last_flush = now
+                flush = True
+        if flush:
+            try:
+                state = self.manager.update_progress(self.job["id"], bytes_done, bytes_total)
+            except Exception as e:
+                logger.warning(f"写入任务进度失败: {e}")
+                return
+            if state == CANCELLING:
+                self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled("任务已取消")
+
+
+class ProgressReader:
+    """包装可读流，每次读取后汇报累计读取的字节数"""
+
+    def __init__(self, stream, callback):
+        self.stream = stream
+        self.callback = callback
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        self.callback(self.bytes_read)
+        return data
+
+    def seekable(self):
+        return False
+
+
+class JobManager:
+    """持久化的后台任务队列，带全局并发上限和每个账号的并发上限"""
+
+    def __init__(self, path, workers=2, per_account=1, stale_seconds=120, poll_interval=1.0):
+        self.db = LocalDB(path, schema=(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, '
+            'type TEXT NOT NULL, '
+            'state TEXT NOT NULL, '
+            'session_id TEXT NOT NULL, '
+            'account TEXT NOT NULL, '
+            'params TEXT NOT NULL, '
+            'result TEXT, '
+            'error TEXT, '
+            'bytes_done INTEGER NOT NULL DEFAULT 0, '
+            'bytes_total INTEGER, '
+            'attempts INTEGER NOT NULL DEFAULT 0, '
+            'owner TEXT, '
+            'created_at REAL NOT NULL, '
+            'started_at REAL, '
+            'finished_at REAL, '
+            'updated_at REAL NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_jobs_account ON jobs (account, state)',
+        ))
+        self.workers = workers
+        self.per_account = per_account
+        self.stale_seconds = stale_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers = {}
+        self._contexts = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._started_pid = None
+
+    def register(self, job_type, handler):
+        """注册任务执行函数handler(context)，返回值作为任务结果保存"""
+        self.handlers[job_type] = handler
+
+    def start(self):
+        """启动工作线程；gunicorn fork之后每个worker进程各自启动一次"""
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self.owner = f"{socket.gethostname()}:{os.getpid()}"
+            self._threads = []
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # ---- 任务增删改查 ----
+
+    def submit(self, job_type, session_id, account, params, bytes_total=None):
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn = self.db.connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO jobs (id, type, state, session_id, account, params, bytes_total, '
+                'created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, job_type, QUEUED, session_id, account, json.dumps(params), bytes_total, now, now)
+            )
+        self.start()
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        row = self.db.connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, account, limit=100):
+        rows = self.db.connect().execute(
+            'SELECT * FROM jobs WHERE account = ? ORDER BY created_at DESC LIMIT ?', (account, limit)
+        ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接取消，运行中的标记为cancelling，由执行线程在下次汇报进度时停止"""
+        conn = self.db.connect()
+        now = time.time()
+        with conn:
+            conn.execute(
+                'UPDATE jobs SET state = ?, finished_at = ?, updated_at = ? WHERE id = ? AND state = ?',
+                (CANCELLED, now, now, job_id, QUEUED)
+            )
+            conn.execute(
+                'UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND state = ?',
+                (CANCELLING, now, job_id, RUNNING)
+            )
+        with self._lock:
+            context = self._contexts.get(job_id)
+        if context is not None:
+            context.cancel_event.set()
+        return self.get(job_id)
+
+    def retry(self, job_id):
+        """把失败或已取消的任务重新排队"""
+        conn = self.db.connect()
+        now = time.time()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET state = ?, error = NULL, result = NULL, owner = NULL, '
+                'started_at = NULL, finished_at = NULL, updated_at = ? WHERE id = ? AND state IN (?, ?)',
+                (QUEUED, now, job_id, FAILED, CANCELLED)
+            )
+        if cursor.rowcount:
+            self.start()
+            self._wakeup.set()
+        return self.get(job_id)
+
+    def delete(self, job_id):
+        conn = self.db.connect()
+        with conn:
+            cursor = conn.execute('DELETE FROM jobs WHERE id = ? AND state IN (?, ?, ?)',
+                                  (job_id,) + FINISHED_STATES)
+        return cursor.rowcount > 0
+
+    def update_progress(self, job_id, bytes_done, bytes_total=None):
+        """写入进度并返回任务当前状态"""
+        conn = self.db.connect()
+        with conn:
+            conn.execute(
+                'UPDATE jobs SET bytes_done = ?, bytes_total = COALESCE(?, bytes_total), updated_at = ? '
+                'WHERE id = ?',
+                (bytes_done, bytes_total, time.time(), job_id)
+            )
+        row = conn.execute('SELECT state FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row else CANCELLING
+
+    def stats(self):
+        rows = self.db.connect().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return dict(rows)
+
+    # ---- 调度与执行 ----
+
+    def _recover_stale(self, conn):
+        """把所属进程已退出（长时间没有心跳）的运行中任务重新排队"""
+        now = time.time()
+        deadline = now - self.stale_seconds
+        with conn:
+            conn.execute(
+                'UPDATE jobs SET state = ?, owner = NULL WHERE state = ? AND updated_at < ?',
+                (QUEUED, RUNNING, deadline)
+            )
+            conn.execute(
+                'UPDATE jobs SET state = ?, finished_at = ? WHERE state = ? AND updated_at < ?',
+                (CANCELLED, now, CANCELLING, deadline)
+            )
+
+    def _heartbeat_loop(self):
+        """定期刷新本进程正在执行的任务的心跳，避免被其他进程当作失效任务重新认领"""
+        conn = self.db.connect()
+        while True:
+            time.sleep(max(self.stale_seconds / 4, 1))
+            with self._lock:
+                job_ids = list(self._contexts)
+            if not job_ids:
+                continue
+            try:
+                with conn:
+                    conn.executemany('UPDATE jobs SET updated_at = ? WHERE id = ?',
+                                     [(time.time(), job_id) for job_id in job_ids])
+            except Exception as e:
+                logger.warning(f"刷新任务心跳失败: {e}")
+
+    def _claim(self, conn):
+        """认领一个排队中的任务，账号已达到并发上限的任务跳过"""
+        rows = conn.execute(
+            'SELECT id, account FROM jobs WHERE state = ? ORDER BY created_at LIMIT 50', (QUEUED,)
+        ).fetchall()
+        for job_id, account in rows:
+            now = time.time()
+            with conn:
+                cursor = conn.execute(
+                    'UPDATE jobs SET state = ?, owner = ?, attempts = attempts + 1, started_at = ?, '
+                    'updated_at = ? WHERE id = ? AND state = ? AND '
+                    '(SELECT COUNT(*) FROM jobs WHERE account = ? AND state IN (?, ?)) < ?',
+                    (RUNNING, self.owner, now, now, job_id, QUEUED,
+                     account, RUNNING, CANCELLING, self.per_account)
+                )
+            if cursor.rowcount:
+                return self.get(job_id)
+        return None
+
+    def _worker_loop(self):
+        conn = self.db.connect()
+        while True:
+            try:
+                self._recover_stale(conn)
+                job = self._claim(conn)
+            except Exception as e:
+                logger.warning(f"任务调度异常: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        context = JobContext(self, job)
+        with self._lock:
+            self._contexts[job["id"]] = context
+
+        state, result, error = SUCCEEDED, None, None
+        try:
+            handler = self.handlers.get(job["type"])
+            if handler is None:
+                raise ValueError(f"未知的任务类型: {job['type']}")
+            result = handler(context)
+        except JobCancelled:
+            state = CANCELLED
+        except Exception as e:
+            if context.cancel_event.is_set():
+                state = CANCELLED
+            else:
+                state, error = FAILED, str(e)
+                logger.warning(f"任务 {job['id']} 执行失败: {e}")
+        finally:
+            with self._lock:
+                self._contexts.pop(job["id"], None)
+
+        now = time.time()
+        conn = self.db.connect()
+        with conn:
+            if state == SUCCEEDED:
+                conn.execute(
+                    'UPDATE jobs SET state = ?, result = ?, bytes_done = COALESCE(bytes_total, bytes_done), '
+                    'finished_at = ?, updated_at = ? WHERE id = ?',
+                    (state, json.dumps(result), now, now, job["id"])
+                )
+            else:
+                conn.execute(
+                    'UPDATE jobs SET state = ?, error = ?, finished_at = ?, updated_at = ? WHERE id = ?',
+                    (state, error, now, now, job["id"])
+                )
+
+    def _row_to_job(self, row):
+        columns = ('id', 'type', 'state', 'session_id', 'account', 'params', 'result', 'error',
+                   'bytes_done', 'bytes_total', 'attempts', 'owner', 'created_at', 'started_at',
+                   'finished_at', 'updated_at')
+        job = dict(zip(columns, row))
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+
+def describe_job(job):
+    """任务对外展示的信息，包含吞吐量和预计剩余时间"""
+    started_at = job["started_at"]
+    end = job["finished_at"] or time.time()
+    elapsed = end - started_at if started_at else 0
+    throughput = job["bytes_done"] / elapsed if elapsed > 0 else 0
+    eta = None
+    if job["state"] == RUNNING and job["bytes_total"] and throughput > 0:
+        eta = max(job["bytes_total"] - job["bytes_done"], 0) / throughput
+
+    params = {k: v for k, v in job["params"].items() if not k.startswith('_')}
+    return {
+        "job_id": job["id"],
+        "type": job["type"],
+        "state": job["state"],
+        "params": params,
+        "bytes_done": job["bytes_done"],
+        "bytes_total": job["bytes_total"],
+        "throughput": round(throughput, 2),
+        "eta_seconds": round(eta, 1) if eta is not None else None,
+        "attempts": job["attempts"],
+        "error": job["error"],
+        "result": job["result"],
+        "created_at": job["created_at"],
+        "started_at": started_at,
+        "finished_at": job["finished_at"],
+    }
+
+
+def create_job_manager():
+    """根据环境变量创建任务管理器
+
+    JOBS_DB_PATH: 任务数据库路径
+    JOB_WORKERS: 每个进程同时执行的任务数
+    JOB_PER_ACCOUNT: 每个账号同时执行的任务数
+    """
+    return JobManager(
+        default_db_path('JOBS_DB_PATH', 'jobs.db'),
+        workers=int(os.environ.get('JOB_WORKERS', 2)),
+        per_account=int(os.environ.get('JOB_PER_ACCOUNT', 1)),
+    )
@@ -0,0 +1,128 @@
+"""
+目录列表缓存
+按账号缓存/list的结果，带TTL和LRU容量上限，上传、删除时主动失效；
+每次失效递增账号的代数，失效前已开始的获取完成后不再写入缓存，不会把写入前的列表重新放回缓存；
+缓存在每个worker内独立，跨worker的一致性由TTL兜底
+"""
+
+import time
+import json
+import hashlib
+import posixpath
+import threading
+from collections import OrderedDict
+
+
+def normalize_path(path):
+    """规范化远程路径，'/dir/'与'/dir'视为同一目录"""
+    # normpath会保留开头的'//'，这里统一为单个'/'
+    return '/' + posixpath.normpath('/' + (path or '/').strip()).lstrip('/')
+
+
+def compute_etag(items):
+    """根据列表内容计算ETag"""
+    body = json.dumps(items, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.md5(body).hexdigest()
+
+
+class ListingCache:
+    """带TTL和LRU淘汰的目录列表缓存"""
+
+    def __init__(self, ttl=10, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        # (account, path) -> {"items", "etag", "last_modified", "cached_at"}
+        self._entries = OrderedDict()
+        # account -> 失效代数
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    def get(self, account, path):
+        """获取未过期的缓存项，不存在或已过期时返回None"""
+        key = (account, normalize_path(path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self.ttl or time.time() - entry["cached_at"] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def peek(self, account, path):
+        """同get，但不计入命中统计，用于其他缓存借用目录列表中的信息"""
+        key = (account, normalize_path(path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self.ttl or time.time() - entry["cached_at"] > self.ttl:
+                return None
+            return entry
+
+    def generation(self, account):
+        """账号当前的失效代数，开始获取目录列表前读取，获取完成后传给set"""
+        with self._lock:
+            return self._generations.get(account, 0)
+
+    def set(self, account, path, items, generation=None, fetched_at=None):
+        """写入缓存并返回缓存项；内容未变化时保留原来的Last-Modified。
+        generation与账号当前的代数不同（获取期间发生过失效）时只返回缓存项，不写入缓存；
+        fetched_at为开始获取的时间，作为缓存项的cached_at"""
+        key = (account, normalize_path(path))
+        etag = compute_etag(items)
+        now = time.time()
+        with self._lock:
+            previous = self._entries.get(key)
+            last_modified = previous["last_modified"] if previous and previous["etag"] == etag else now
+            entry = {
+                "items": items,
+                "etag": etag,
+                "last_modified": last_modified,
+                "cached_at": fetched_at or now,
+            }
+            if generation is not None and generation != self._generations.get(account, 0):
+                self.stale_fills += 1
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, account, path, recursive=False):
+        """使某个目录的缓存失效，recursive为True时连同所有子目录一起失效；
+        同时递增账号的失效代数，正在进行的获取完成后不再写入缓存"""
+        path = normalize_path(path)
+        prefix = path.rstrip('/') + '/'
+        with self._lock:
+            self._generations[account] = self._generations.get(account, 0) + 1
+            keys = [
+                key for key in self._entries
+                if key[0] == account and (key[1] == path or (recursive and key[1].startswith(prefix)))
+            ]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def invalidate_parent(self, account, path):
+        """文件或目录发生变化时，使其所在目录以及它自身（如果是目录）的缓存失效"""
+        path = normalize_path(path)
+        count = self.invalidate(account, posixpath.dirname(path))
+        return count + self.invalidate(account, path, recursive=True)
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "stale_fills": self.stale_fills,
+            }
@@ -0,0 +1,36 @@
+"""
+本地SQLite数据库工具
+sqlite连接不能跨线程使用，也不能在fork之后继续使用，这里为每个进程的每个线程各自维护一个连接
+"""
+
+import os
+import sqlite3
+import threading
+
+
+def default_db_path(env_name, filename):
+    """数据库文件路径，优先使用环境变量，默认放在$HOME/.fundrive目录下"""
+    return os.environ.get(env_name, os.path.join(os.environ.get('HOME', '/tmp'), '.fundrive', filename))
+
+
+class LocalDB:
+    """按线程复用连接的SQLite数据库"""
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self.connect()
+        with conn:
+            for statement in schema:
+                conn.execute(statement)
+
+    def connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # gunicorn预加载应用后fork出的worker会继承主进程的连接，需要重新打开
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
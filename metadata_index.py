@@ -0,0 +1,208 @@
+"""
+本地元数据索引
+按账号把网盘中的文件和目录信息保存到SQLite中，名称通过FTS5 trigram全文索引支持子串搜索；
+索引由全量遍历建立，之后通过本服务的上传、删除操作增量更新，搜索时不再调用百度网盘接口
+"""
+
+import time
+import sqlite3
+import posixpath
+import logging
+
+from local_db import LocalDB, default_db_path
+
+logger = logging.getLogger('baidu_drive_api')
+
+# trigram分词要求查询词至少3个字符，更短的查询退化为LIKE
+TRIGRAM_MIN_LENGTH = 3
+
+
+def file_ext(name):
+    """小写的扩展名，不含点；没有扩展名时返回空字符串"""
+    return posixpath.splitext(name)[1].lstrip('.').lower()
+
+
+class MetadataIndex:
+    """基于SQLite的文件元数据索引"""
+
+    def __init__(self, path):
+        self.db = LocalDB(path, schema=(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'account TEXT NOT NULL, '
+            'path TEXT NOT NULL, '
+            'parent TEXT NOT NULL, '
+            'name TEXT NOT NULL, '
+            'ext TEXT NOT NULL, '
+            'type TEXT NOT NULL, '
+            'size INTEGER NOT NULL DEFAULT 0, '
+            'mtime INTEGER, '
+            'indexed_at REAL NOT NULL, '
+            'PRIMARY KEY (account, path))',
+            'CREATE INDEX IF NOT EXISTS idx_entries_ext ON entries (account, ext)',
+            'CREATE INDEX IF NOT EXISTS idx_entries_size ON entries (account, size)',
+            'CREATE INDEX IF NOT EXISTS idx_entries_mtime ON entries (account, mtime)',
+            'CREATE TABLE IF NOT EXISTS crawls ('
+            'account TEXT NOT NULL, '
+            'root TEXT NOT NULL, '
+            'entries INTEGER NOT NULL, '
+            'errors INTEGER NOT NULL, '
+            'started_at REAL NOT NULL, '
+            'finished_at REAL NOT NULL, '
+            'PRIMARY KEY (account, root))',
+        ))
+        self.fts = self._create_fts()
+
+    def _create_fts(self):
+        """创建名称的全文索引，sqlite不支持FTS5 trigram时只使用LIKE"""
+        conn = self.db.connect()
+        try:
+            with conn:
+                conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5("
+                    "name, content='entries', content_rowid='rowid', tokenize='trigram')"
+                )
+                conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN "
+                    "INSERT INTO entries_fts (rowid, name) VALUES (new.rowid, new.name); END"
+                )
+                conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN "
+                    "INSERT INTO entries_fts (entries_fts, rowid, name) VALUES ('delete', old.rowid, old.name); END"
+                )
+                conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE ON entries BEGIN "
+                    "INSERT INTO entries_fts (entries_fts, rowid, name) VALUES ('delete', old.rowid, old.name); "
+                    "INSERT INTO entries_fts (rowid, name) VALUES (new.rowid, new.name); END"
+                )
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"sqlite不支持FTS5 trigram，名称搜索使用LIKE: {e}")
+            return False
+
+    # ---- 写入 ----
+
+    def upsert(self, account, items, indexed_at=None):
+        """写入或更新条目，items为/list返回结构中的条目"""
+        indexed_at = indexed_at or time.time()
+        rows = []
+        for item in items:
+            path = item["path"]
+            name = item.get("name") or posixpath.basename(path)
+            rows.append((
+                account, path, posixpath.dirname(path) or '/', name,
+                file_ext(name) if item.get("type") == "file" else '',
+                item.get("type", "file"), item.get("size") or 0, item.get("mtime"), indexed_at
+            ))
+        conn = self.db.connect()
+        with conn:
+            conn.executemany(
+                'INSERT INTO entries (account, path, parent, name, ext, type, size, mtime, indexed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (account, path) DO UPDATE SET parent = excluded.parent, name = excluded.name, '
+                'ext = excluded.ext, type = excluded.type, size = excluded.size, mtime = excluded.mtime, '
+                'indexed_at = excluded.indexed_at',
+                rows
+            )
+        return len(rows)
+
+    def remove(self, account, path):
+        """删除条目；如果是目录，连同其下所有条目一起删除"""
+        prefix = path.rstrip('/') + '/'
+        conn = self.db.connect()
+        with conn:
+            cursor = conn.execute(
+                'DELETE FROM entries WHERE account = ? AND (path = ? OR substr(path, 1, ?) = ?)',
+                (account, path, len(prefix), prefix)
+            )
+        return cursor.rowcount
+
+    def finish_crawl(self, account, root, started_at, entries, errors):
+        """全量遍历结束：删除本次遍历没有见到的旧条目，并记录遍历信息"""
+        prefix = root.rstrip('/') + '/'
+        conn = self.db.connect()
+        with conn:
+            if not errors:
+                # 有目录遍历失败时保留旧条目，避免误删
+                conn.execute(
+                    'DELETE FROM entries WHERE account = ? AND indexed_at < ? AND substr(path, 1, ?) = ?',
+                    (account, started_at, len(prefix), prefix)
+                )
+            conn.execute(
+                'INSERT OR REPLACE INTO crawls (account, root, entries, errors, started_at, finished_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (account, root, entries, errors, started_at, time.time())
+            )
+
+    # ---- 查询 ----
+
+    def search(self, account, q=None, ext=None, entry_type=None, min_size=None, max_size=None,
+               mtime_from=None, mtime_to=None, under=None, limit=100, offset=0):
+        """按名称子串、扩展名、类型、大小范围、修改时间和所在目录搜索，返回(条目列表, 总数)"""
+        conditions = ['e.account = ?']
+        params = [account]
+        join = ''
+
+        if q:
+            if self.fts and len(q) >= TRIGRAM_MIN_LENGTH:
+                join = 'JOIN entries_fts f ON f.rowid = e.rowid'
+                conditions.append('entries_fts MATCH ?')
+                params.append('"' + q.replace('"', '""') + '"')
+            else:
+                conditions.append("e.name LIKE ? ESCAPE '\\'")
+                params.append('%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if ext:
+            exts = [e.strip().lstrip('.').lower() for e in ext.split(',') if e.strip()]
+            conditions.append(f"e.ext IN ({','.join('?' * len(exts))})")
+            params.extend(exts)
+        if entry_type:
+            conditions.append('e.type = ?')
+            params.append(entry_type)
+        if min_size is not None:
+            conditions.append('e.size >= ?')
+            params.append(min_size)
+        if max_size is not None:
+            conditions.append('e.size <= ?')
+            params.append(max_size)
+        if mtime_from is not None:
+            conditions.append('e.mtime >= ?')
+            params.append(mtime_from)
+        if mtime_to is not None:
+            conditions.append('e.mtime <= ?')
+            params.append(mtime_to)
+        if under and under != '/':
+            prefix = under.rstrip('/') + '/'
+            conditions.append('substr(e.path, 1, ?) = ?')
+            params.extend([len(prefix), prefix])
+
+        where = ' AND '.join(conditions)
+        conn = self.db.connect()
+        total = conn.execute(f'SELECT COUNT(*) FROM entries e {join} WHERE {where}', params).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT e.path, e.name, e.type, e.size, e.mtime FROM entries e {join} WHERE {where} '
+            'ORDER BY e.path LIMIT ? OFFSET ?',
+            params + [limit, offset]
+        ).fetchall()
+        items = [
+            {"path": path, "name": name, "type": entry_type, "size": size, "mtime": mtime}
+            for path, name, entry_type, size, mtime in rows
+        ]
+        return items, total
+
+    def status(self, account):
+        """索引条目数量和最近的遍历记录"""
+        conn = self.db.connect()
+        count = conn.execute('SELECT COUNT(*) FROM entries WHERE account = ?', (account,)).fetchone()[0]
+        crawls = [
+            {"root": root, "entries": entries, "errors": errors,
+             "started_at": started_at, "finished_at": finished_at}
+            for root, entries, errors, started_at, finished_at in conn.execute(
+                'SELECT root, entries, errors, started_at, finished_at FROM crawls WHERE account = ? '
+                'ORDER BY finished_at DESC', (account,)
+            )
+        ]
+        return {"entries": count, "fts": self.fts, "crawls": crawls}
+
+
+def create_metadata_index():
+    """根据环境变量创建元数据索引，METADATA_INDEX_PATH指定索引文件"""
+    return MetadataIndex(default_db_path('METADATA_INDEX_PATH', 'metadata_index.db'))
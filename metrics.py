@@ -0,0 +1,279 @@
+"""
+运行指标
+进程内的计数器、仪表和直方图，由/metrics以Prometheus文本格式输出；
+同时按请求累计上游调用耗时，用于生成Server-Timing响应头，区分每个请求花在百度网盘接口上的时间和本地处理时间
+"""
+
+import time
+import threading
+
+# 请求耗时直方图的分桶（秒）
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# 上游调用耗时直方图的分桶（秒）
+UPSTREAM_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 120)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """只增不减的计数器，按标签值分别计数"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Gauge(Counter):
+    """可增可减的仪表"""
+
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class CallbackGauge:
+    """抓取时才计算的仪表，callback返回数值，或 {标签值元组: 数值}"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labels = tuple(labels)
+
+    def samples(self):
+        value = self.callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for label_values, sample in sorted(value.items()):
+            yield self.name, format_labels(self.labels, label_values), sample
+
+
+class Histogram:
+    """累计分桶的直方图，按标签值分别统计"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # 标签值 -> [各分桶计数, 总和, 总数]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels, label_values, [('le', format_value(bound))])
+                yield self.name + '_bucket', labels, cumulative
+            labels = format_labels(self.labels, label_values)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+
+class Registry:
+    """指标注册表，render()输出Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                lines.append(f"# {metric.name} 采集失败: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_latency = registry.register(Histogram(
+    'baidu_api_request_duration_seconds', '请求处理耗时（含响应体传输）', ('route', 'method')))
+requests_total = registry.register(Counter(
+    'baidu_api_requests_total', '请求数', ('route', 'method', 'status')))
+upstream_latency = registry.register(Histogram(
+    'baidu_api_upstream_duration_seconds', '单次BaiDuDrive调用耗时', ('method',), buckets=UPSTREAM_BUCKETS))
+upstream_errors = registry.register(Counter(
+    'baidu_api_upstream_errors_total', 'BaiDuDrive调用失败次数', ('method', 'kind')))
+bytes_in = registry.register(Counter(
+    'baidu_api_bytes_in_total', '接收的请求体字节数', ('route',)))
+bytes_out = registry.register(Counter(
+    'baidu_api_bytes_out_total', '发送的响应体字节数', ('route',)))
+transfers_in_flight = registry.register(Gauge(
+    'baidu_api_transfers_in_flight', '进行中的上传、下载和导出', ('route',)))
+
+
+# ---- 按请求累计的上游耗时 ----
+
+_local = threading.local()
+
+
+class RequestTiming:
+    """一个请求内上游调用的累计耗时；上游调用可能在线程池中执行，用锁保护"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.upstream = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.upstream += seconds
+            self.calls += 1
+
+    def server_timing(self):
+        """Server-Timing响应头：上游耗时、本地耗时和总耗时（毫秒）；并发的上游调用按累计时间计算"""
+        total = time.perf_counter() - self.started
+        with self._lock:
+            upstream, calls = self.upstream, self.calls
+        local = max(0.0, total - upstream)
+        return (f'upstream;dur={upstream * 1000:.1f};desc="{calls} calls", '
+                f'local;dur={local * 1000:.1f}, total;dur={total * 1000:.1f}')
+
+
+def begin_request():
+    timing = _local.timing = RequestTiming()
+    return timing
+
+
+def end_request():
+    _local.timing = None
+
+
+def current_timing():
+    """当前线程正在处理的请求的RequestTiming，不在请求中时返回None"""
+    return getattr(_local, 'timing', None)
+
+
+def run_with_timing(timing, fn, *args):
+    """在当前线程中以timing作为请求上下文执行fn，用于在线程池中代请求发起上游调用"""
+    previous = current_timing()
+    _local.timing = timing
+    try:
+        return fn(*args)
+    finally:
+        _local.timing = previous
+
+
+def observe_upstream(name, seconds, error, timing=None):
+    """记录一次上游调用，error为None表示成功，否则为错误类别"""
+    upstream_latency.observe(seconds, name)
+    if error is not None:
+        upstream_errors.inc(name, error)
+    if timing is not None:
+        timing.add(seconds)
+
+
+# ---- 请求和响应体字节计数 ----
+
+class CountingStream:
+    """包装wsgi.input，统计实际读取的字节数"""
+
+    def __init__(self, stream, route):
+        self._stream = stream
+        self._route = route
+
+    def _count(self, data):
+        if data:
+            bytes_in.inc(self._route, amount=len(data))
+        return data
+
+    def read(self, *args):
+        return self._count(self._stream.read(*args))
+
+    def readline(self, *args):
+        return self._count(self._stream.readline(*args))
+
+    def readlines(self, *args):
+        return [self._count(line) for line in self._stream.readlines(*args)]
+
+    def __iter__(self):
+        for line in self._stream:
+            yield self._count(line)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def count_chunks(chunks, route):
+    """包装流式响应体，统计实际发送的字节数"""
+    try:
+        for chunk in chunks:
+            if chunk:
+                bytes_out.inc(route, amount=len(chunk))
+            yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
@@ -0,0 +1,217 @@
+"""
+秒传
+一次读取同时计算整个文件的MD5、前256KB的MD5、CRC32和长度，先尝试百度网盘的秒传接口，
+未命中时才真正传输文件内容；本地记录 内容哈希 -> 远程路径 的索引，重复上传的文件不再消耗上行带宽
+"""
+
+import os
+import time
+import zlib
+import hashlib
+import threading
+import logging
+
+from local_db import LocalDB, default_db_path
+from upstream import UpstreamUnavailable, error_code
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 秒传接口要求的前置分片大小
+RAPID_SLICE_SIZE = 256 * 1024
+# 小于该大小的文件百度网盘不支持秒传，直接上传
+RAPID_UPLOAD_MIN_SIZE = int(os.environ.get('RAPID_UPLOAD_MIN_SIZE', RAPID_SLICE_SIZE))
+
+# 百度网盘表示秒传未命中的错误码：网盘中没有该MD5的文件（31079、404），或校验值与文件不符（31023）
+RAPID_MISS_ERRNOS = {31079, 404, 31023}
+
+
+class ContentHasher:
+    """流式计算秒传所需的各项哈希"""
+
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self._slice_md5 = hashlib.md5()
+        self._crc32 = 0
+        self.size = 0
+
+    def update(self, data):
+        if self.size < RAPID_SLICE_SIZE:
+            self._slice_md5.update(data[:RAPID_SLICE_SIZE - self.size])
+        self._md5.update(data)
+        self._crc32 = zlib.crc32(data, self._crc32)
+        self.size += len(data)
+
+    def digest(self):
+        return {
+            "md5": self._md5.hexdigest(),
+            "slice_md5": self._slice_md5.hexdigest(),
+            "crc32": self._crc32,
+            "size": self.size,
+        }
+
+
+class HashingFile:
+    """包装可写的文件对象，写入时同时计算哈希；
+    werkzeug把multipart请求体中的文件写入临时文件时顺带算出秒传所需的哈希，之后不必再把文件读一遍"""
+
+    def __init__(self, file):
+        self.file = file
+        self.hasher = ContentHasher()
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.file.write(data)
+
+    def hashes(self):
+        return self.hasher.digest()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+
+def hash_stream(stream, block_size=1024 * 1024):
+    """读取整个流并返回哈希信息，调用方需要自行把流重新定位到开头"""
+    hasher = ContentHasher()
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        hasher.update(data)
+    return hasher.digest()
+
+
+def hashes_from_headers(headers):
+    """从X-Content-MD5/X-Slice-MD5/X-Content-Length请求头中读取客户端预先算好的哈希"""
+    md5 = headers.get('X-Content-MD5')
+    slice_md5 = headers.get('X-Slice-MD5')
+    size = headers.get('X-Content-Length')
+    if not (md5 and slice_md5 and size and size.isdigit()):
+        return None
+    crc32 = headers.get('X-Content-CRC32', '0')
+    return {
+        "md5": md5.lower(),
+        "slice_md5": slice_md5.lower(),
+        "crc32": int(crc32) if crc32.isdigit() else 0,
+        "size": int(size),
+    }
+
+
+class HashIndex:
+    """本地的 内容哈希 -> 远程路径 索引"""
+
+    def __init__(self, path):
+        self.db = LocalDB(path, schema=(
+            'CREATE TABLE IF NOT EXISTS remote_hashes ('
+            'account TEXT NOT NULL, '
+            'remote_path TEXT NOT NULL, '
+            'md5 TEXT NOT NULL, '
+            'slice_md5 TEXT NOT NULL, '
+            'crc32 INTEGER NOT NULL, '
+            'size INTEGER NOT NULL, '
+            'updated_at REAL NOT NULL, '
+            'PRIMARY KEY (account, remote_path))',
+            'CREATE INDEX IF NOT EXISTS idx_remote_hashes_md5 ON remote_hashes (account, md5, size)',
+        ))
+
+    def lookup(self, account, hashes):
+        """查找内容相同的远程文件路径"""
+        rows = self.db.connect().execute(
+            'SELECT remote_path FROM remote_hashes WHERE account = ? AND md5 = ? AND size = ?',
+            (account, hashes["md5"], hashes["size"])
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def record(self, account, remote_path, hashes):
+        conn = self.db.connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO remote_hashes '
+                '(account, remote_path, md5, slice_md5, crc32, size, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (account, remote_path, hashes["md5"], hashes["slice_md5"],
+                 hashes["crc32"], hashes["size"], time.time())
+            )
+
+    def forget(self, account, remote_path):
+        """远程文件被删除时移除索引，目录被删除时连同其下所有文件一起移除"""
+        conn = self.db.connect()
+        prefix = remote_path.rstrip('/') + '/'
+        with conn:
+            conn.execute(
+                'DELETE FROM remote_hashes WHERE account = ? AND (remote_path = ? OR substr(remote_path, 1, ?) = ?)',
+                (account, remote_path, len(prefix), prefix)
+            )
+
+
+class RapidUploader:
+    """秒传尝试与命中率统计"""
+
+    def __init__(self, index):
+        self.index = index
+        self.attempts = 0
+        self.index_hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def try_upload(self, client, account, hashes, remote_path):
+        """尝试秒传，成功返回结果字典，未命中返回None；
+        限流、连接错误等临时错误不算未命中，也不清理索引，返回None由调用方改为完整上传，上游不可用时直接抛出"""
+        known_paths = self.index.lookup(account, hashes)
+        if not known_paths and hashes["size"] < RAPID_UPLOAD_MIN_SIZE:
+            return None
+
+        with self._lock:
+            self.attempts += 1
+        try:
+            client.drive.rapid_upload_file(
+                hashes["slice_md5"], hashes["md5"], hashes["crc32"], hashes["size"], remote_path
+            )
+        except UpstreamUnavailable:
+            with self._lock:
+                self.errors += 1
+            raise
+        except Exception as e:
+            if error_code(e) not in RAPID_MISS_ERRNOS:
+                logger.warning(f"秒传 {remote_path} 失败，改为完整上传: {e}")
+                with self._lock:
+                    self.errors += 1
+                return None
+            logger.info(f"秒传未命中 {remote_path}: {e}")
+            with self._lock:
+                self.misses += 1
+            # 索引中的远程文件可能已在其他客户端被删除
+            for path in known_paths:
+                self.index.forget(account, path)
+            return None
+
+        with self._lock:
+            if known_paths:
+                self.index_hits += 1
+            else:
+                self.remote_hits += 1
+        self.index.record(account, remote_path, hashes)
+        return dict(hashes, rapid_upload=True)
+
+    def stats(self):
+        """秒传统计，hit_ratio为命中次数占命中与未命中次数之和的比例，出错的尝试不计入"""
+        with self._lock:
+            hits = self.index_hits + self.remote_hits
+            decided = hits + self.misses
+            return {
+                "attempts": self.attempts,
+                "index_hits": self.index_hits,
+                "remote_hits": self.remote_hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_ratio": round(hits / decided, 4) if decided else 0.0,
+            }
+
+
+def create_rapid_uploader():
+    """根据环境变量创建秒传器，HASH_INDEX_PATH指定本地索引文件"""
+    return RapidUploader(HashIndex(default_db_path('HASH_INDEX_PATH', 'hash_index.db')))
@@ -0,0 +1,255 @@
+"""
+可续传上传（tus协议风格）
+客户端先创建上传会话，再按偏移量分多次PATCH文件内容，连接中断后查询已提交的偏移量，从断点继续发送；
+收到的数据按分片大小切分，每凑满一个分片就上传到百度网盘并记录分片MD5，不足一个分片的部分暂存在本地磁盘，
+全部数据到齐后合并分片。会话状态保存在本地SQLite中，服务重启或请求落到同一台机器的其他worker上都可以继续
+"""
+
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import logging
+
+from local_db import LocalDB, default_db_path
+from upload_pipeline import SLICE_SIZE, upload_slice
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 上传会话状态
+UPLOADING = 'uploading'
+COMPLETED = 'completed'
+
+# 写入锁的租约时间（秒），写入过程中定期续期；持有锁的进程异常退出后租约到期即可被其他请求接管
+LOCK_SECONDS = 60
+# 每次从请求体读取的字节数
+READ_SIZE = 64 * 1024
+
+
+class UploadLocked(Exception):
+    """上传会话正被其他请求写入"""
+
+
+class ResumableUploads:
+    """持久化的可续传上传会话；已上传分片的MD5记录在数据库中，未凑满分片的数据暂存在root下"""
+
+    def __init__(self, path, root, ttl=86400, slice_size=SLICE_SIZE):
+        self.db = LocalDB(path, schema=(
+            'CREATE TABLE IF NOT EXISTS uploads ('
+            'id TEXT PRIMARY KEY, '
+            'state TEXT NOT NULL, '
+            'account TEXT NOT NULL, '
+            'remote_path TEXT NOT NULL, '
+            'length INTEGER NOT NULL, '
+            'slice_size INTEGER NOT NULL, '
+            'slices TEXT NOT NULL, '
+            'result TEXT, '
+            'owner TEXT, '
+            'locked_until REAL, '
+            'created_at REAL NOT NULL, '
+            'updated_at REAL NOT NULL, '
+            'expires_at REAL NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS idx_uploads_expires ON uploads (expires_at)',
+        ))
+        self.root = root
+        self.ttl = ttl
+        self.slice_size = slice_size
+        self.hostname = socket.gethostname()
+
+    # ---- 会话增删查 ----
+
+    def create(self, account, remote_path, length):
+        self.purge_expired()
+        now = time.time()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_dir(upload_id), exist_ok=True)
+        conn = self.db.connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO uploads (id, state, account, remote_path, length, slice_size, slices, '
+                'created_at, updated_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (upload_id, UPLOADING, account, remote_path, length, self.slice_size, '[]',
+                 now, now, now + self.ttl)
+            )
+        return self.get(upload_id)
+
+    def get(self, upload_id):
+        row = self.db.connect().execute('SELECT * FROM uploads WHERE id = ?', (upload_id,)).fetchone()
+        if row is None:
+            return None
+        upload = self._row_to_upload(row)
+        if upload["expires_at"] < time.time():
+            return None
+        return upload
+
+    def delete(self, upload_id):
+        conn = self.db.connect()
+        with conn:
+            conn.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+
+    def purge_expired(self):
+        """删除已过期的会话及其暂存数据；百度网盘上未合并的分片会由网盘自行清理"""
+        conn = self.db.connect()
+        rows = conn.execute('SELECT id FROM uploads WHERE expires_at < ?', (time.time(),)).fetchall()
+        for (upload_id,) in rows:
+            self.delete(upload_id)
+        return len(rows)
+
+    def offset(self, upload):
+        """已提交的字节数：已上传的分片加上本地暂存的数据"""
+        if upload["state"] == COMPLETED:
+            return upload["length"]
+        return len(upload["slices"]) * upload["slice_size"] + self._part_size(upload)
+
+    def stats(self):
+        rows = self.db.connect().execute(
+            'SELECT state, COUNT(*) FROM uploads WHERE expires_at >= ? GROUP BY state', (time.time(),)
+        ).fetchall()
+        return dict(rows)
+
+    # ---- 写入锁 ----
+
+    def acquire(self, upload_id):
+        """获取会话的写入锁，返回锁标识；已被其他请求持有时抛出UploadLocked"""
+        token = f"{self.hostname}:{os.getpid()}:{uuid.uuid4().hex}"
+        now = time.time()
+        conn = self.db.connect()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE uploads SET owner = ?, locked_until = ? WHERE id = ? AND '
+                '(owner IS NULL OR locked_until < ?)',
+                (token, now + LOCK_SECONDS, upload_id, now)
+            )
+        if not cursor.rowcount:
+            raise UploadLocked("上传会话正被其他请求写入，请稍后重试")
+        return token
+
+    def release(self, upload_id, token):
+        conn = self.db.connect()
+        with conn:
+            conn.execute('UPDATE uploads SET owner = NULL, locked_until = NULL WHERE id = ? AND owner = ?',
+                         (upload_id, token))
+
+    def _touch(self, upload, token, **fields):
+        """续期写入锁和会话有效期，同时写入fields；锁已被接管时抛出UploadLocked"""
+        now = time.time()
+        assignments = ''.join(f'{name} = ?, ' for name in fields)
+        conn = self.db.connect()
+        with conn:
+            cursor = conn.execute(
+                f'UPDATE uploads SET {assignments}locked_until = ?, updated_at = ?, expires_at = ? '
+                'WHERE id = ? AND owner = ?',
+                tuple(fields.values()) + (now + LOCK_SECONDS, now, now + self.ttl, upload["id"], token)
+            )
+        if not cursor.rowcount:
+            raise UploadLocked("写入锁已过期并被其他请求接管")
+        upload["expires_at"] = now + self.ttl
+
+    # ---- 写入与合并 ----
+
+    def write(self, client, upload, token, stream):
+        """把stream中的数据追加到会话，凑满的分片立即上传，返回新的偏移量；调用方需持有写入锁。
+        追加数据前确认锁仍由自己持有，租约过期被接管后不会再写入暂存文件"""
+        self._touch(upload, token)
+        # 上次写入时凑满但上传失败的分片先补传
+        if self._part_size(upload) >= upload["slice_size"]:
+            self._commit_slice(client, upload, token)
+
+        offset = self.offset(upload)
+        last_touch = time.monotonic()
+        while offset < upload["length"]:
+            part_path = self._part_path(upload)
+            room = min(upload["slice_size"] - self._part_size(upload), upload["length"] - offset)
+            ended = False
+            with open(part_path, 'ab') as part:
+                while room > 0:
+                    data = stream.read(min(room, READ_SIZE))
+                    if not data:
+                        ended = True
+                        break
+                    if time.monotonic() - last_touch > LOCK_SECONDS / 4:
+                        # 读取可能阻塞了很久，续期成功（锁没有被接管）后才写入
+                        part.flush()
+                        self._touch(upload, token)
+                        last_touch = time.monotonic()
+                    part.write(data)
+                    room -= len(data)
+                    offset += len(data)
+            if ended:
+                break
+            if self._part_size(upload) >= upload["slice_size"]:
+                self._commit_slice(client, upload, token)
+                last_touch = time.monotonic()
+
+        self._touch(upload, token)
+        return offset
+
+    def finish(self, client, upload, token):
+        """数据到齐后上传最后一个分片并合并，返回上传结果"""
+        if self._part_size(upload) > 0:
+            self._commit_slice(client, upload, token)
+
+        if upload["slices"]:
+            client.drive.combine_slices(upload["slices"], upload["remote_path"])
+        else:
+            # 空文件无法合并分片，直接整体上传
+            client.drive.upload_file(io.BytesIO(b''), upload["remote_path"])
+
+        result = {"size": upload["length"], "slices": len(upload["slices"])}
+        self._touch(upload, token, state=COMPLETED, result=json.dumps(result))
+        upload["state"], upload["result"] = COMPLETED, result
+        shutil.rmtree(self._upload_dir(upload["id"]), ignore_errors=True)
+        return result
+
+    def _commit_slice(self, client, upload, token):
+        """上传当前暂存的分片，记录MD5后删除暂存文件"""
+        part_path = self._part_path(upload)
+        with open(part_path, 'rb') as part:
+            block = part.read()
+        slice_md5 = upload_slice(client, block)
+        slices = upload["slices"] + [slice_md5]
+        # 先记录分片再删除暂存文件；两步之间进程退出时，旧分片的暂存文件按序号不再计入偏移量
+        self._touch(upload, token, slices=json.dumps(slices))
+        upload["slices"] = slices
+        os.remove(part_path)
+
+    # ---- 暂存文件 ----
+
+    def _upload_dir(self, upload_id):
+        return os.path.join(self.root, upload_id)
+
+    def _part_path(self, upload):
+        """当前分片的暂存文件，按分片序号命名"""
+        return os.path.join(self._upload_dir(upload["id"]), f"{len(upload['slices'])}.part")
+
+    def _part_size(self, upload):
+        try:
+            return os.path.getsize(self._part_path(upload))
+        except OSError:
+            return 0
+
+    def _row_to_upload(self, row):
+        columns = ('id', 'state', 'account', 'remote_path', 'length', 'slice_size', 'slices', 'result',
+                   'owner', 'locked_until', 'created_at', 'updated_at', 'expires_at')
+        upload = dict(zip(columns, row))
+        upload["slices"] = json.loads(upload["slices"])
+        upload["result"] = json.loads(upload["result"]) if upload["result"] else None
+        return upload
+
+
+def create_resumable_uploads():
+    """根据环境变量创建可续传上传会话存储
+
+    RESUMABLE_DB_PATH: 会话数据库路径
+    RESUMABLE_DIR: 未凑满分片的数据的暂存目录
+    RESUMABLE_TTL: 会话在最后一次写入后保留的时间（秒）
+    """
+    return ResumableUploads(
+        default_db_path('RESUMABLE_DB_PATH', 'resumable_uploads.db'),
+        os.environ.get('RESUMABLE_DIR', os.path.join(os.environ.get('HOME', '/tmp'), '.fundrive', 'resumable')),
+        ttl=int(os.environ.get('RESUMABLE_TTL', 86400)),
+    )
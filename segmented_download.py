@@ -0,0 +1,235 @@
+"""
+多连接分段下载
+把大文件按字节范围切分成多个分段，通过连接池并发下载并写入预分配的输出文件；
+失败的分段会重试，已完成的分段记录在分段表文件中，中断后可以继续下载；
+分段表同时记录远程文件的标识，远程文件被替换后不会把新旧内容拼接在一起
+"""
+
+import os
+import json
+import random
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from download_proxy import build_download_headers
+from transport import transport
+
+logger = logging.getLogger('baidu_drive_api')
+
+DEFAULT_CONNECTIONS = int(os.environ.get('DOWNLOAD_CONNECTIONS', 4))
+DEFAULT_SEGMENT_SIZE = int(os.environ.get('DOWNLOAD_SEGMENT_SIZE', 4 * 1024 * 1024))
+
+
+class SegmentedDownloadError(Exception):
+    """分段下载失败"""
+
+
+class SegmentedDownloadCancelled(SegmentedDownloadError):
+    """分段下载被取消，不再重试"""
+
+
+class SegmentedDownloader:
+    """多连接分段下载器"""
+
+    def __init__(self, url, headers, filepath, connections=DEFAULT_CONNECTIONS,
+                 segment_size=DEFAULT_SEGMENT_SIZE, retries=3, session=None,
+                 chunk_size=256 * 1024, timeout=(10, 60), on_progress=None, cancel_event=None, identity=None):
+        self.url = url
+        self.headers = dict(headers)
+        self.filepath = filepath
+        self.connections = max(1, connections)
+        self.segment_size = max(1, segment_size)
+        self.retries = retries
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        # on_progress(bytes_done, total_size)在下载线程中调用；cancel_event被设置后停止下载
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event
+        self.session = session or self._create_session()
+        # 分段表：记录文件大小、分段大小、远程文件标识和已完成的分段，用于断点续传
+        self.map_path = f"{filepath}.segments.json"
+        # identity为调用方给出的远程文件标识（见file_identity），validator为CDN返回的ETag或Last-Modified
+        self.identity = identity
+        self.validator = None
+        self.total_size = None
+        self.done = set()
+        self.bytes_done = 0
+        # 某个分段最终失败后通知其余分段尽快停止
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _create_session(self):
+        # 各分段的连接来自进程内共享的连接池，下载结束后留给后续请求复用
+        return transport.create_session()
+
+    def probe(self):
+        """请求第一个字节，获取文件大小并确认服务端支持Range"""
+        headers = dict(self.headers, Range='bytes=0-0')
+        with self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            self.validator = resp.headers.get('ETag') or resp.headers.get('Last-Modified')
+            if resp.status_code in (206, 416):
+                # 空文件没有第一个字节，服务端返回416和Content-Range: bytes */0
+                content_range = resp.headers.get('Content-Range', '')
+                total = content_range.rsplit('/', 1)[-1]
+                if total.isdigit():
+                    return int(total), True
+            if resp.status_code == 200:
+                length = resp.headers.get('Content-Length')
+                return (int(length) if length and length.isdigit() else None), False
+            raise SegmentedDownloadError(f"获取文件大小失败，状态码: {resp.status_code}")
+
+    def segments(self):
+        """所有分段的(序号, 起始位置, 结束位置)"""
+        return [
+            (index, start, min(start + self.segment_size, self.total_size) - 1)
+            for index, start in enumerate(range(0, self.total_size, self.segment_size))
+        ]
+
+    def _load_map(self):
+        """读取分段表，文件大小、分段大小或远程文件标识不一致时丢弃"""
+        if not os.path.exists(self.map_path) or not os.path.exists(self.filepath):
+            return set()
+        try:
+            with open(self.map_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if data.get('total_size') != self.total_size or data.get('segment_size') != self.segment_size:
+            return set()
+        if data.get('identity') != self.identity or data.get('validator') != self.validator:
+            # 远程文件已被替换（大小可能相同），已下载的分段属于旧文件
+            logger.info(f"远程文件已变化，丢弃 {self.filepath} 的分段表")
+            return set()
+        return set(data.get('done', []))
+
+    def _save_map(self):
+        tmp_path = f"{self.map_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "total_size": self.total_size,
+                "segment_size": self.segment_size,
+                "identity": self.identity,
+                "validator": self.validator,
+                "done": sorted(self.done),
+            }, f)
+        os.replace(tmp_path, self.map_path)
+
+    def _preallocate(self):
+        mode = 'r+b' if os.path.exists(self.filepath) else 'wb'
+        with open(self.filepath, mode) as f:
+            f.truncate(self.total_size)
+
+    def _check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise SegmentedDownloadCancelled("下载已取消")
+        if self._stop.is_set():
+            raise SegmentedDownloadCancelled("其他分段下载失败")
+
+    def _report(self, size):
+        with self._lock:
+            self.bytes_done += size
+            bytes_done = self.bytes_done
+        if self.on_progress is not None:
+            self.on_progress(bytes_done, self.total_size)
+
+    def _fetch_segment(self, index, start, end):
+        """下载单个分段，失败时按指数退避重试"""
+        expected = end - start + 1
+        for attempt in range(self.retries + 1):
+            received = 0
+            try:
+                self._check_cancelled()
+                headers = dict(self.headers, Range=f'bytes={start}-{end}')
+                with self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout) as resp:
+                    if resp.status_code != 206:
+                        raise SegmentedDownloadError(f"分段{index}请求失败，状态码: {resp.status_code}")
+                    with open(self.filepath, 'r+b') as f:
+                        f.seek(start)
+                        for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                            if not chunk:
+                                continue
+                            self._check_cancelled()
+                            chunk = chunk[:expected - received]
+                            f.write(chunk)
+                            received += len(chunk)
+                            self._report(len(chunk))
+                            if received >= expected:
+                                break
+                if received != expected:
+                    raise SegmentedDownloadError(f"分段{index}长度不符: {received}/{expected}")
+
+                with self._lock:
+                    self.done.add(index)
+                    self._save_map()
+                return index
+            except Exception as e:
+                with self._lock:
+                    self.bytes_done -= received
+                if attempt >= self.retries or isinstance(e, SegmentedDownloadCancelled):
+                    raise
+                delay = min(2 ** attempt, 30) * (0.5 + random.random())
+                logger.warning(f"分段{index}下载失败，{delay:.1f}秒后重试: {e}")
+                self._stop.wait(delay)
+
+    def _download_single(self):
+        """服务端不支持Range时退化为单连接下载"""
+        with self.session.get(self.url, headers=self.headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code != 200:
+                raise SegmentedDownloadError(f"下载失败，状态码: {resp.status_code}")
+            with open(self.filepath, 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        self._check_cancelled()
+                        f.write(chunk)
+                        self._report(len(chunk))
+        return self.filepath
+
+    def run(self):
+        """执行下载，返回输出文件路径"""
+        self.total_size, ranged = self.probe()
+        if self.total_size == 0:
+            with open(self.filepath, 'wb'):
+                pass
+            return self.filepath
+        if not ranged or not self.total_size:
+            return self._download_single()
+
+        self.done = self._load_map()
+        if not self.done:
+            self._preallocate()
+        segments = [s for s in self.segments() if s[0] not in self.done]
+        self.bytes_done = self.total_size - sum(end - start + 1 for _, start, end in segments)
+        if self.done:
+            logger.info(f"继续下载 {self.filepath}，已完成 {len(self.done)} 个分段")
+
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            futures = [executor.submit(self._fetch_segment, *segment) for segment in segments]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                # 取消还未开始的分段，正在下载的分段在下一个数据块时停止，已完成的分段保留在分段表中
+                self._stop.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+        if os.path.exists(self.map_path):
+            os.remove(self.map_path)
+        return self.filepath
+
+
+def file_identity(fs_id, md5):
+    """远程文件的标识，覆盖上传后fs_id和MD5随之改变"""
+    return f"{fs_id}:{md5 or ''}"
+
+
+def segmented_download(client, remote_path, filepath, download_link=None, **kwargs):
+    """通过BaiDuDrive客户端解析下载链接并分段下载到filepath，已有缓存的链接时通过download_link传入；
+    需要跨进程继续下载时通过identity传入远程文件的标识"""
+    download_link = download_link or client.drive.download_link(remote_path)
+    if not download_link:
+        raise SegmentedDownloadError(f"无法获取下载链接: {remote_path}")
+    downloader = SegmentedDownloader(download_link, build_download_headers(client), filepath, **kwargs)
+    return downloader.run()
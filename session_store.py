@@ -0,0 +1,205 @@
+"""
+会话存储后端
+只保存最小的登录凭证（bduss/stoken/ptoken），各个worker按需在本地重建BaiDuDrive客户端，
+从而让多个gunicorn worker、多个容器可以共享同一份登录状态
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+
+from local_db import LocalDB, default_db_path
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 需要持久化的凭证字段
+CREDENTIAL_FIELDS = ('bduss', 'stoken', 'ptoken')
+
+
+def account_key(bduss):
+    """由bduss生成账号标识，用于各类按账号划分的缓存，避免在内存和日志中直接使用bduss"""
+    return hashlib.sha1((bduss or '').encode('utf-8')).hexdigest()[:16]
+
+
+def pick_credentials(data):
+    """从字典中提取凭证字段，忽略空值"""
+    return {k: data[k] for k in CREDENTIAL_FIELDS if data.get(k)}
+
+
+class BaseSessionStore:
+    """会话存储基类"""
+
+    def __init__(self, ttl=0):
+        # ttl为0表示会话永不过期
+        self.ttl = ttl
+
+    def get(self, session_id):
+        """获取会话凭证，不存在或已过期时返回None"""
+        raise NotImplementedError
+
+    def set(self, session_id, credentials):
+        """保存会话凭证"""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """删除会话，返回会话是否存在"""
+        raise NotImplementedError
+
+    def count(self):
+        """当前有效会话数量"""
+        raise NotImplementedError
+
+    def _expires_at(self):
+        return time.time() + self.ttl if self.ttl else 0
+
+
+class MemorySessionStore(BaseSessionStore):
+    """进程内存储，仅适用于单worker部署"""
+
+    def __init__(self, ttl=0):
+        super().__init__(ttl)
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._data.get(session_id)
+            if entry is None:
+                return None
+            credentials, expires_at = entry
+            if expires_at and expires_at < time.time():
+                del self._data[session_id]
+                return None
+            return dict(credentials)
+
+    def set(self, session_id, credentials):
+        with self._lock:
+            self._data[session_id] = (pick_credentials(credentials), self._expires_at())
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._data.pop(session_id, None) is not None
+
+    def count(self):
+        now = time.time()
+        with self._lock:
+            return sum(1 for _, expires_at in self._data.values()
+                       if not expires_at or expires_at >= now)
+
+
+class SQLiteSessionStore(BaseSessionStore):
+    """本地SQLite文件存储，同一台机器上的多个worker共享"""
+
+    def __init__(self, path, ttl=0):
+        super().__init__(ttl)
+        self.db = LocalDB(path, schema=(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'session_id TEXT PRIMARY KEY, '
+            'credentials TEXT NOT NULL, '
+            'expires_at REAL NOT NULL)',
+        ))
+
+    def get(self, session_id):
+        conn = self.db.connect()
+        row = conn.execute(
+            'SELECT credentials, expires_at FROM sessions WHERE session_id = ?',
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        credentials, expires_at = row
+        if expires_at and expires_at < time.time():
+            with conn:
+                conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+            return None
+        return json.loads(credentials)
+
+    def set(self, session_id, credentials):
+        conn = self.db.connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (session_id, credentials, expires_at) '
+                'VALUES (?, ?, ?)',
+                (session_id, json.dumps(pick_credentials(credentials)), self._expires_at())
+            )
+
+    def delete(self, session_id):
+        conn = self.db.connect()
+        with conn:
+            cursor = conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+        return cursor.rowcount > 0
+
+    def count(self):
+        row = self.db.connect().execute(
+            'SELECT COUNT(*) FROM sessions WHERE expires_at = 0 OR expires_at >= ?',
+            (time.time(),)
+        ).fetchone()
+        return row[0]
+
+
+class RedisSessionStore(BaseSessionStore):
+    """Redis兼容存储，多个容器共享；redis参数可以传入任何实现了get/set/delete的客户端"""
+
+    def __init__(self, redis=None, url=None, prefix='baidu_drive_api:session:', ttl=0):
+        super().__init__(ttl)
+        if redis is None:
+            try:
+                import redis as redis_lib
+            except ImportError:
+                raise RuntimeError("使用Redis会话存储需要先安装redis包: pip install redis")
+            redis = redis_lib.Redis.from_url(url or 'redis://localhost:6379/0')
+        self.redis = redis
+        self.prefix = prefix
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def get(self, session_id):
+        value = self.redis.get(self._key(session_id))
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return json.loads(value)
+
+    def set(self, session_id, credentials):
+        value = json.dumps(pick_credentials(credentials))
+        if self.ttl:
+            self.redis.set(self._key(session_id), value, ex=int(self.ttl))
+        else:
+            self.redis.set(self._key(session_id), value)
+
+    def delete(self, session_id):
+        return bool(self.redis.delete(self._key(session_id)))
+
+    def count(self):
+        if not hasattr(self.redis, 'scan_iter'):
+            return -1
+        return sum(1 for _ in self.redis.scan_iter(match=f"{self.prefix}*"))
+
+
+def create_session_store(backend=None):
+    """根据环境变量创建会话存储
+
+    SESSION_BACKEND: memory / sqlite / redis，默认sqlite
+    SESSION_DB_PATH: sqlite文件路径
+    SESSION_REDIS_URL: redis连接地址
+    SESSION_TTL: 会话有效期（秒），0表示永不过期
+    """
+    backend = (backend or os.environ.get('SESSION_BACKEND', 'sqlite')).lower()
+    ttl = int(os.environ.get('SESSION_TTL', 0))
+
+    if backend == 'memory':
+        store = MemorySessionStore(ttl=ttl)
+    elif backend == 'sqlite':
+        store = SQLiteSessionStore(default_db_path('SESSION_DB_PATH', 'sessions.db'), ttl=ttl)
+    elif backend == 'redis':
+        store = RedisSessionStore(url=os.environ.get('SESSION_REDIS_URL'), ttl=ttl)
+    else:
+        raise ValueError(f"未知的会话存储后端: {backend}")
+
+    logger.info(f"会话存储后端: {backend}")
+    return store
@@ -0,0 +1,351 @@
+"""
+本地目录与网盘目录的增量同步
+每对同步目录在本地SQLite清单中记录上次同步时每个文件的大小、本地修改时间、远程修改时间和MD5；
+再次同步时只用stat与清单比较，大小和修改时间都没变的文件不会重新计算哈希，
+push方向也不再列出网盘目录。只传输有变化的文件，并发执行，每个文件完成后立即写入清单，
+中断后重新运行会跳过已完成的文件，下载到一半的大文件从分段表继续
+"""
+
+import os
+import time
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from local_db import LocalDB, default_db_path
+from session_store import account_key
+from concurrency import fan_out
+from tree_walk import walk
+from batch_ops import batch_delete
+from upload_pipeline import UploadPipeline
+from rapid_upload import hash_stream
+from segmented_download import segmented_download, file_identity
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 同时传输的文件数量
+SYNC_WORKERS = int(os.environ.get('SYNC_WORKERS', 4))
+
+# 下载过程中的临时文件后缀，扫描本地目录时忽略
+PART_SUFFIX = '.sync-part'
+IGNORED_SUFFIXES = (PART_SUFFIX, PART_SUFFIX + '.segments.json')
+
+PUSH = 'push'
+PULL = 'pull'
+
+# 同步计划中的动作
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+DELETE_REMOTE = 'delete_remote'
+DELETE_LOCAL = 'delete_local'
+RECORD = 'record'           # 两边内容相同，只更新清单
+CONFLICT = 'conflict'       # 两边都有修改，跳过
+
+
+class SyncManifest:
+    """上次同步状态的清单，按同步目录对分别保存"""
+
+    def __init__(self, path):
+        self.db = LocalDB(path, schema=(
+            'CREATE TABLE IF NOT EXISTS manifest ('
+            'pair TEXT NOT NULL, '
+            'rel_path TEXT NOT NULL, '
+            'size INTEGER NOT NULL, '
+            'local_mtime_ns INTEGER, '
+            'remote_mtime INTEGER, '
+            'md5 TEXT, '
+            'synced_at REAL NOT NULL, '
+            'PRIMARY KEY (pair, rel_path))',
+        ))
+
+    def load(self, pair):
+        """读取某个同步目录对的全部记录，rel_path -> 记录"""
+        conn = self.db.connect()
+        rows = conn.execute(
+            'SELECT rel_path, size, local_mtime_ns, remote_mtime, md5 FROM manifest WHERE pair = ?', (pair,)
+        )
+        return {
+            rel_path: {"size": size, "local_mtime_ns": local_mtime_ns, "remote_mtime": remote_mtime, "md5": md5}
+            for rel_path, size, local_mtime_ns, remote_mtime, md5 in rows
+        }
+
+    def get(self, pair, rel_path):
+        """读取单个文件的记录，不存在时返回None"""
+        conn = self.db.connect()
+        row = conn.execute(
+            'SELECT size, local_mtime_ns, remote_mtime, md5 FROM manifest WHERE pair = ? AND rel_path = ?',
+            (pair, rel_path)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"size": row[0], "local_mtime_ns": row[1], "remote_mtime": row[2], "md5": row[3]}
+
+    def record(self, pair, rel_path, size, local_mtime_ns, remote_mtime, md5):
+        conn = self.db.connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO manifest (pair, rel_path, size, local_mtime_ns, remote_mtime, md5, synced_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (pair, rel_path, size, local_mtime_ns, remote_mtime, md5, time.time())
+            )
+
+    def forget(self, pair, rel_path):
+        conn = self.db.connect()
+        with conn:
+            conn.execute('DELETE FROM manifest WHERE pair = ? AND rel_path = ?', (pair, rel_path))
+
+
+def scan_local(root):
+    """递归扫描本地目录，只调用stat，返回 相对路径 -> (大小, 修改时间ns)"""
+    result = {}
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(root, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = posixpath.join(rel_dir, entry.name) if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(rel_path)
+                elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(IGNORED_SUFFIXES):
+                    st = entry.stat(follow_symlinks=False)
+                    result[rel_path] = (st.st_size, st.st_mtime_ns)
+    return result
+
+
+def scan_remote(client, root, concurrency):
+    """有限并发地遍历网盘目录，返回 相对路径 -> {"size", "mtime", "md5", "fs_id"}"""
+    def list_dir(path):
+        return [
+            {"path": f.path, "type": "directory" if f.is_dir else "file",
+             "size": f.size or 0, "mtime": f.mtime, "md5": f.md5, "fs_id": f.fs_id}
+            for f in client.drive.list(path)
+        ]
+
+    # 目标目录还不存在时视为空目录
+    if root != '/' and not client.drive.exists(root):
+        return {}
+
+    result = {}
+    prefix = root.rstrip('/') + '/'
+    for kind, item, detail in walk(list_dir, root, concurrency=concurrency):
+        if kind == "error":
+            # 目录列表不完整时无法判断哪些文件被删除，直接失败
+            raise RuntimeError(f"列出网盘目录 {item} 失败: {detail}")
+        if item["type"] == "file" and item["path"].startswith(prefix):
+            result[item["path"][len(prefix):]] = item
+    return result
+
+
+class SyncEngine:
+    """把local_root与remote_root按direction方向同步
+
+    push: 以本地为准，上传新增和修改的文件，delete为True时删除网盘上本地已删除的文件
+    pull: 以网盘为准，下载新增和修改的文件，delete为True时删除本地对应网盘已删除的文件
+    """
+
+    def __init__(self, client, local_root, remote_root, direction=PUSH, manifest=None,
+                 rapid_uploader=None, dlink_cache=None, workers=SYNC_WORKERS, delete=False, rescan_remote=False):
+        if direction not in (PUSH, PULL):
+            raise ValueError(f"不支持的同步方向: {direction}")
+        self.client = client
+        self.local_root = os.path.abspath(local_root)
+        self.remote_root = '/' + remote_root.strip('/') if remote_root.strip('/') else '/'
+        self.direction = direction
+        self.manifest = manifest or create_sync_manifest()
+        self.rapid_uploader = rapid_uploader
+        self.dlink_cache = dlink_cache
+        self.workers = max(1, workers)
+        self.delete = delete
+        self.rescan_remote = rescan_remote
+        self.account = account_key(client.drive.bduss)
+        self.pair = f"{self.account}:{self.local_root}:{self.remote_root}"
+
+    def remote_path(self, rel_path):
+        return f"{self.remote_root.rstrip('/')}/{rel_path}"
+
+    def local_path(self, rel_path):
+        return os.path.join(self.local_root, *rel_path.split('/'))
+
+    # ---- 计算差异 ----
+
+    def plan(self):
+        """计算同步计划，返回动作列表，每项为 {"action", "path", "size"}"""
+        os.makedirs(self.local_root, exist_ok=True)
+        known = self.manifest.load(self.pair)
+        local = scan_local(self.local_root)
+        if self.direction == PUSH:
+            return self._plan_push(known, local)
+        return self._plan_pull(known, local, scan_remote(self.client, self.remote_root, self.workers))
+
+    def _plan_push(self, known, local):
+        actions = []
+        # 首次同步或显式要求时列出网盘目录，已存在且内容相同的文件只记录到清单
+        remote = scan_remote(self.client, self.remote_root, self.workers) if not known or self.rescan_remote else None
+
+        for rel_path, (size, mtime_ns) in sorted(local.items()):
+            entry = known.get(rel_path)
+            if entry and entry["size"] == size and entry["local_mtime_ns"] == mtime_ns:
+                continue
+            if remote is not None and rel_path in remote and remote[rel_path]["size"] == size:
+                actions.append({"action": RECORD, "path": rel_path, "size": size, "remote": remote[rel_path]})
+            else:
+                actions.append({"action": UPLOAD, "path": rel_path, "size": size})
+
+        if self.delete:
+            deleted = set(known) - set(local)
+            if remote is not None:
+                deleted |= set(remote) - set(local)
+            actions.extend({"action": DELETE_REMOTE, "path": p, "size": 0} for p in sorted(deleted))
+        return actions
+
+    def _plan_pull(self, known, local, remote):
+        actions = []
+        for rel_path, item in sorted(remote.items()):
+            entry = known.get(rel_path)
+            # 由push写入的记录没有远程修改时间，只比较大小和MD5
+            remote_changed = not entry or (entry["size"], entry["md5"]) != (item["size"], item["md5"]) or (
+                entry["remote_mtime"] is not None and entry["remote_mtime"] != item["mtime"])
+            local_stat = local.get(rel_path)
+            local_changed = not entry or local_stat is None or (entry["size"], entry["local_mtime_ns"]) != local_stat
+
+            if not remote_changed and not local_changed:
+                continue
+            if remote_changed and local_changed and entry and local_stat is not None:
+                actions.append({"action": CONFLICT, "path": rel_path, "size": item["size"]})
+            elif not entry and local_stat is not None and local_stat[0] == item["size"]:
+                # 首次同步时本地已有大小相同的文件，比较MD5后再决定是否下载
+                actions.append({"action": RECORD, "path": rel_path, "size": item["size"], "remote": item})
+            else:
+                actions.append({"action": DOWNLOAD, "path": rel_path, "size": item["size"], "remote": item})
+
+        if self.delete:
+            deleted = (set(known) & set(local)) - set(remote)
+            actions.extend({"action": DELETE_LOCAL, "path": p, "size": 0} for p in sorted(deleted))
+        return actions
+
+    # ---- 执行 ----
+
+    def run(self, dry_run=False):
+        """计算并执行同步计划，返回汇总信息；dry_run为True时只返回计划"""
+        started_at = time.time()
+        actions = self.plan()
+        summary = {
+            "direction": self.direction,
+            "local_root": self.local_root,
+            "remote_root": self.remote_root,
+            "planned": {},
+            "dry_run": dry_run,
+        }
+        for action in actions:
+            summary["planned"][action["action"]] = summary["planned"].get(action["action"], 0) + 1
+        if dry_run:
+            summary["actions"] = [{k: v for k, v in a.items() if k != "remote"} for a in actions]
+            return summary
+
+        transfers = [a for a in actions if a["action"] in (UPLOAD, DOWNLOAD, RECORD, DELETE_LOCAL)]
+        remote_deletes = [a["path"] for a in actions if a["action"] == DELETE_REMOTE]
+
+        errors = []
+        bytes_transferred = 0
+        # 文件级任务使用本次同步的线程池，分片上传在UploadPipeline的upload线程池上进行，避免互相等待
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sync') as executor:
+            for action, result, error in fan_out(self._apply, transfers, self.workers, executor):
+                if error:
+                    logger.warning(f"同步 {action['path']} 失败: {error}")
+                    errors.append({"path": action["path"], "action": action["action"], "error": str(error)})
+                elif result:
+                    bytes_transferred += result
+
+        if remote_deletes:
+            results = batch_delete(self.client, [self.remote_path(p) for p in remote_deletes])
+            for rel_path, item in zip(remote_deletes, results):
+                if item["status"] == "success":
+                    self.manifest.forget(self.pair, rel_path)
+                else:
+                    errors.append({"path": rel_path, "action": DELETE_REMOTE, "error": item["error"]})
+
+        summary.update({
+            "conflicts": [a["path"] for a in actions if a["action"] == CONFLICT],
+            "errors": errors,
+            "bytes_transferred": bytes_transferred,
+            "elapsed": round(time.time() - started_at, 3),
+        })
+        return summary
+
+    def _apply(self, action):
+        """执行单个动作，返回传输的字节数"""
+        kind = action["action"]
+        if kind == UPLOAD:
+            return self._upload(action["path"])
+        if kind == DOWNLOAD:
+            return self._download(action["path"], action["remote"])
+        if kind == RECORD:
+            return self._record_or_transfer(action)
+        if kind == DELETE_LOCAL:
+            os.remove(self.local_path(action["path"]))
+            self.manifest.forget(self.pair, action["path"])
+        return 0
+
+    def _record_local(self, rel_path, md5, remote_mtime=None):
+        st = os.stat(self.local_path(rel_path))
+        self.manifest.record(self.pair, rel_path, st.st_size, st.st_mtime_ns, remote_mtime, md5)
+
+    def _upload(self, rel_path):
+        local_path = self.local_path(rel_path)
+        remote_path = self.remote_path(rel_path)
+        known = self.manifest.get(self.pair, rel_path)
+        with open(local_path, 'rb') as f:
+            hashes = hash_stream(f)
+            f.seek(0)
+            if known and known["md5"] == hashes["md5"] and known["size"] == hashes["size"]:
+                # 只有修改时间变化，内容相同
+                self._record_local(rel_path, hashes["md5"], known["remote_mtime"])
+                return 0
+            if self.rapid_uploader is not None:
+                if self.rapid_uploader.try_upload(self.client, self.account, hashes, remote_path) is not None:
+                    self._record_local(rel_path, hashes["md5"])
+                    return 0
+            # 哈希已经算过，上传时不再重复计算
+            result = UploadPipeline(self.client, remote_path).upload(f, hashes=hashes)
+        if self.rapid_uploader is not None:
+            self.rapid_uploader.index.record(self.account, remote_path, result)
+        self._record_local(rel_path, result["md5"])
+        return result["size"]
+
+    def _download(self, rel_path, remote):
+        local_path = self.local_path(rel_path)
+        part_path = local_path + PART_SUFFIX
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        # 先下载到临时文件，完成后再替换，中断时已有的本地文件保持不变
+        if remote["size"]:
+            remote_path = self.remote_path(rel_path)
+            link = (self.dlink_cache.resolve(self.client, remote_path, fs_id=remote.get("fs_id"))
+                    if self.dlink_cache else None)
+            # 上次同步中断留下的分段表只在远程文件未被替换时继续使用
+            segmented_download(self.client, remote_path, part_path, download_link=link,
+                               identity=file_identity(remote.get("fs_id"), remote["md5"]))
+        else:
+            # 空文件无法按字节范围探测大小，直接创建
+            open(part_path, 'wb').close()
+        if remote["mtime"]:
+            os.utime(part_path, (remote["mtime"], remote["mtime"]))
+        os.replace(part_path, local_path)
+        self._record_local(rel_path, remote["md5"], remote["mtime"])
+        return remote["size"]
+
+    def _record_or_transfer(self, action):
+        """首次同步时两边都有大小相同的文件：MD5相同只记录清单，否则按方向传输"""
+        rel_path, remote = action["path"], action["remote"]
+        with open(self.local_path(rel_path), 'rb') as f:
+            md5 = hash_stream(f)["md5"]
+        if remote["md5"] and md5 == remote["md5"]:
+            self._record_local(rel_path, md5, remote["mtime"])
+            return 0
+        if self.direction == PUSH:
+            return self._upload(rel_path)
+        return self._download(rel_path, remote)
+
+
+def create_sync_manifest():
+    """根据环境变量创建同步清单，SYNC_MANIFEST_PATH指定清单文件"""
+    return SyncManifest(default_db_path('SYNC_MANIFEST_PATH', 'sync_manifest.db'))
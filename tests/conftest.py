@@ -0,0 +1,53 @@
+"""
+测试公共配置
+模块都平铺在仓库根目录，模拟的百度网盘后端在benchmarks目录下，这里把两者加入导入路径；
+服务的数据库和暂存目录默认在$HOME/.fundrive下，测试进程改用临时的HOME，不写入真实的用户目录
+"""
+
+import os
+import sys
+import uuid
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='baidu-drive-api-tests-')
+
+
+class Service:
+    """连接到模拟后端的Flask测试客户端，请求自动带上会话ID"""
+
+    def __init__(self, api, backend, session_id):
+        self.api = api
+        self.backend = backend
+        self.session_id = session_id
+        self.client = api.app.test_client()
+
+    def request(self, method, url, headers=None, **kwargs):
+        headers = dict(headers or {}, **{'X-Session-ID': self.session_id})
+        return self.client.open(url, method=method, headers=headers, **kwargs)
+
+    def drive_client(self):
+        """当前会话经过上游保护层的BaiDuDrive客户端"""
+        return self.api.get_client(self.session_id)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """启动模拟后端并以新账号登录；每个测试使用不同的bduss，客户端池中不会复用其他测试的客户端"""
+    import baidu_drive_api as api
+    from fake_baidu import FakeBackend, FakeConfig
+
+    backend = FakeBackend(FakeConfig(latency=0, jitter=0)).start()
+    monkeypatch.setattr(api, 'BaiDuDrive', backend.drive_class())
+    bduss = f"test-{uuid.uuid4().hex}"
+    response = api.app.test_client().post('/login', json={'bduss': bduss, 'session_id': bduss})
+    assert response.status_code == 200, response.get_json()
+    yield Service(api, backend, bduss)
+    backend.stop()
@@ -0,0 +1,109 @@
+"""
+磁盘内容缓存：从转发给客户端的数据填充缓存、并发填充的等待和共享的写入记录
+"""
+
+import os
+import time
+import threading
+
+import pytest
+
+from content_cache import ContentCache
+
+CONTENT = os.urandom(256 * 1024)
+KEY = 'd41d8cd98f00b204e9800998ecf8427e'
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ContentCache(str(tmp_path / 'cache'), 1 << 20, max_file_size=1 << 20)
+
+
+def chunks(data, size=64 * 1024):
+    return (data[offset:offset + size] for offset in range(0, len(data), size))
+
+
+def test_tee_fills_cache_from_forwarded_body(cache):
+    assert b''.join(cache.tee(KEY, len(CONTENT), chunks(CONTENT))) == CONTENT
+
+    path = cache.lookup(KEY, len(CONTENT))
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert cache.stats()["fills"] == 1
+    assert os.listdir(cache.tmp_dir) == []
+
+
+def test_tee_discards_partial_body_on_disconnect(cache):
+    body = cache.tee(KEY, len(CONTENT), chunks(CONTENT))
+    next(body)
+    # 客户端断开，WSGI服务器关闭响应体
+    body.close()
+
+    assert cache.lookup(KEY, len(CONTENT)) is None
+    assert os.listdir(cache.tmp_dir) == []
+
+
+def test_tee_does_not_cache_short_body(cache):
+    assert b''.join(cache.tee(KEY, len(CONTENT) + 1, chunks(CONTENT))) == CONTENT
+    assert cache.lookup(KEY, len(CONTENT) + 1) is None
+    assert os.listdir(cache.tmp_dir) == []
+
+
+def test_tee_propagates_upstream_errors(cache):
+    def broken():
+        yield CONTENT[:1024]
+        raise IOError("上游连接中断")
+
+    with pytest.raises(IOError):
+        b''.join(cache.tee(KEY, len(CONTENT), broken()))
+    assert cache.lookup(KEY, len(CONTENT)) is None
+    assert os.listdir(cache.tmp_dir) == []
+
+
+def test_concurrent_tee_of_same_key_writes_once(cache):
+    first = cache.tee(KEY, len(CONTENT), chunks(CONTENT))
+    next(first)
+    # 同一文件已在填充中，第二个请求只转发
+    assert b''.join(cache.tee(KEY, len(CONTENT), chunks(CONTENT))) == CONTENT
+    assert len(os.listdir(cache.tmp_dir)) == 1
+
+    b''.join(first)
+    assert cache.lookup(KEY, len(CONTENT)) is not None
+
+
+def test_wait_fill_returns_after_tee_finishes(cache):
+    body = cache.tee(KEY, len(CONTENT), chunks(CONTENT))
+    next(body)
+    assert cache.wait_fill(KEY, timeout=0.01) is False
+
+    waiter = threading.Thread(target=lambda: b''.join(body))
+    waiter.start()
+    assert cache.wait_fill(KEY, timeout=5) is True
+    waiter.join(5)
+    assert cache.lookup(KEY, len(CONTENT)) is not None
+
+
+def test_claimed_tee_releases_on_disconnect(cache):
+    assert cache.claim(KEY)
+    assert not cache.claim(KEY)
+    body = cache.tee(KEY, len(CONTENT), chunks(CONTENT), claimed=True)
+    next(body)
+    body.close()
+    assert cache.wait_fill(KEY, timeout=0)
+    assert cache.claim(KEY)
+
+
+def test_writes_are_visible_to_other_workers(cache):
+    other = ContentCache(cache.root, cache.max_bytes)
+    listed_at = time.time()
+    assert not cache.written_since('acct', '/d/a.bin', listed_at)
+
+    other.record_write('acct', '/d/a.bin')
+    assert cache.written_since('acct', '/d/a.bin', listed_at)
+    assert not cache.written_since('acct', '/d/b.bin', listed_at)
+    assert not cache.written_since('other', '/d/a.bin', listed_at)
+    assert not cache.written_since('acct', '/d/a.bin', time.time() + 1)
+
+    # 删除上级目录同样使列表中的条目过时
+    other.record_write('acct', '/e')
+    assert cache.written_since('acct', '/e/f/g.bin', listed_at)
@@ -0,0 +1,156 @@
+"""
+流式下载代理：Range透传、Content-Range/Content-Length、上游压缩和客户端断开
+"""
+
+import gzip
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from flask import Flask, request
+
+from download_proxy import build_download_headers, open_upstream, stream_response
+from fake_baidu import FakeBackend, FakeConfig
+
+CONTENT = bytes(range(256)) * 1024
+
+
+@pytest.fixture(scope='module')
+def backend():
+    backend = FakeBackend(FakeConfig(latency=0, jitter=0)).start()
+    backend.store.write('/proxy/data.bin', CONTENT)
+    yield backend
+    backend.stop()
+
+
+@pytest.fixture(scope='module')
+def client(backend):
+    drive = backend.drive_class()()
+    assert drive.login(bduss='proxy-account', ptoken='ptoken')
+    return drive
+
+
+@pytest.fixture
+def app(backend, client):
+    """与/download的stream模式相同：打开下载链接并转发，透传客户端的Range请求头"""
+    app = Flask(__name__)
+
+    @app.route('/download')
+    def download():
+        upstream = open_upstream(request.args['url'], build_download_headers(client),
+                                 range_header=request.headers.get('Range'))
+        return stream_response(upstream, 'data.bin')
+
+    return app.test_client()
+
+
+def get(app, url, **headers):
+    return app.get('/download', query_string={'url': url}, headers=headers)
+
+
+def test_full_download(app, backend):
+    response = get(app, backend.dlink('/proxy/data.bin'))
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['Content-Length'] == str(len(CONTENT))
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="data.bin"'
+
+
+@pytest.mark.parametrize('range_header, start, end', [
+    ('bytes=100-199', 100, 199),
+    ('bytes=1000-', 1000, len(CONTENT) - 1),
+    ('bytes=-10', len(CONTENT) - 10, len(CONTENT) - 1),
+])
+def test_range_passes_through_as_206(app, backend, range_header, start, end):
+    response = get(app, backend.dlink('/proxy/data.bin'), Range=range_header)
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {start}-{end}/{len(CONTENT)}'
+    assert response.headers['Content-Length'] == str(end - start + 1)
+    assert response.data == CONTENT[start:end + 1]
+
+
+def test_unsatisfiable_range_passes_through_as_416(app, backend):
+    response = get(app, backend.dlink('/proxy/data.bin'), Range=f'bytes={len(CONTENT)}-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+class CompressingHandler(BaseHTTPRequestHandler):
+    """按请求的Accept-Encoding决定是否gzip压缩的上游，记录收到的Accept-Encoding"""
+
+    protocol_version = 'HTTP/1.1'
+    seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        accept = self.headers.get('Accept-Encoding', '')
+        self.seen.append(accept)
+        force = self.path.endswith('force-gzip')
+        body = CONTENT
+        self.send_response(200)
+        if 'gzip' in accept or force:
+            body = gzip.compress(CONTENT)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope='module')
+def compressing_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CompressingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_uncompressed_body(app, compressing_url):
+    response = get(app, compressing_url + '/file')
+    assert CompressingHandler.seen[-1] == 'identity'
+    assert response.data == CONTENT
+    assert response.headers['Content-Length'] == str(len(CONTENT))
+
+
+def test_compressed_upstream_does_not_leak_compressed_length(app, compressing_url):
+    # 上游无视Accept-Encoding仍然压缩时，转发解压后的数据，不能带上压缩后的长度
+    response = get(app, compressing_url + '/force-gzip')
+    assert response.data == CONTENT
+    assert response.headers.get('Content-Length') in (None, str(len(CONTENT)))
+
+
+class StubUpstream:
+    """可以观察是否被关闭的上游响应"""
+
+    status_code = 200
+    headers = {'Content-Length': str(len(CONTENT))}
+
+    def __init__(self):
+        self.closed = False
+        self.chunks_read = 0
+
+    def iter_content(self, chunk_size=None):
+        for offset in range(0, len(CONTENT), chunk_size):
+            self.chunks_read += 1
+            yield CONTENT[offset:offset + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+def test_client_disconnect_closes_upstream():
+    upstream = StubUpstream()
+    app = Flask(__name__)
+    app.add_url_rule('/download', 'download', lambda: stream_response(upstream, 'data.bin', chunk_size=1024))
+
+    response = app.test_client().get('/download', buffered=False)
+    body = iter(response.response)
+    assert next(body) == CONTENT[:1024]
+    # 客户端读到一半断开，WSGI服务器关闭响应
+    response.close()
+
+    assert upstream.closed
+    assert upstream.chunks_read < len(CONTENT) // 1024
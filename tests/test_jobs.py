@@ -0,0 +1,161 @@
+"""
+后台任务：通过接口提交、查询、取消和删除任务，失败的记录和重试，进程退出后未完成任务的恢复
+"""
+
+import io
+import os
+import time
+
+import pytest
+
+import jobs
+from jobs import JobManager
+
+CONTENT = os.urandom(1024 * 1024)
+
+
+@pytest.fixture
+def manager(service, tmp_path, monkeypatch):
+    """使用独立数据库的任务管理器，执行函数与服务注册的相同"""
+    manager = make_manager(service, str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(service.api, 'job_manager', manager)
+    monkeypatch.setattr(service.api, 'JOBS_DIR', str(tmp_path / 'staging'))
+    return manager
+
+
+def make_manager(service, path, **kwargs):
+    manager = JobManager(path, poll_interval=0.05, **kwargs)
+    manager.handlers = dict(service.api.job_manager.handlers)
+    return manager
+
+
+def wait_job(manager, job_id, states=jobs.FINISHED_STATES, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job["state"] in states:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"任务 {job_id} 未在{timeout}秒内结束: {manager.get(job_id)['state']}")
+
+
+def test_download_job_lifecycle(service, manager):
+    service.backend.store.write('/jobs/big.bin', CONTENT)
+    response = service.request('POST', '/jobs/download', json={'path': '/jobs/big.bin'})
+    assert response.status_code == 202
+    job_id = response.get_json()["job"]["job_id"]
+
+    job = wait_job(manager, job_id)
+    assert job["state"] == jobs.SUCCEEDED
+    assert job["result"] == {"size": len(CONTENT)}
+
+    detail = service.request('GET', f'/jobs/{job_id}').get_json()["job"]
+    assert detail["bytes_done"] == detail["bytes_total"] == len(CONTENT)
+    assert detail["attempts"] == 1
+    # 暂存路径等内部参数不对外展示
+    assert detail["params"] == {"remote_path": "/jobs/big.bin"}
+    assert [j["job_id"] for j in service.request('GET', '/jobs').get_json()["jobs"]] == [job_id]
+
+    result = service.request('GET', f'/jobs/{job_id}/result')
+    assert result.status_code == 200
+    assert result.data == CONTENT
+    result.close()
+
+    output_dir = os.path.dirname(job["params"]["_output_file"])
+    assert service.request('DELETE', f'/jobs/{job_id}').status_code == 200
+    assert not os.path.exists(output_dir)
+    assert service.request('GET', f'/jobs/{job_id}').status_code == 404
+
+
+def test_upload_job_lifecycle(service, manager):
+    response = service.request('POST', '/jobs/upload', data={
+        'path': '/jobs',
+        'file': (io.BytesIO(CONTENT), 'up.bin'),
+    })
+    assert response.status_code == 202
+    job_id = response.get_json()["job"]["job_id"]
+    staging_file = manager.get(job_id)["params"]["_staging_file"]
+
+    job = wait_job(manager, job_id)
+    assert job["state"] == jobs.SUCCEEDED, job["error"]
+    assert job["bytes_done"] == len(CONTENT)
+    assert service.backend.store.read('/jobs/up.bin') == CONTENT
+    # 上传完成后删除暂存文件
+    assert not os.path.exists(staging_file)
+
+
+def test_failure_is_recorded_and_retry_succeeds(service, manager):
+    response = service.request('POST', '/jobs/download', json={'path': '/jobs/missing.bin'})
+    job_id = response.get_json()["job"]["job_id"]
+
+    job = wait_job(manager, job_id)
+    assert job["state"] == jobs.FAILED
+    assert job["error"]
+    assert job["finished_at"] is not None
+    assert service.request('GET', f'/jobs/{job_id}/result').status_code == 409
+
+    service.backend.store.write('/jobs/missing.bin', CONTENT)
+    response = service.request('POST', f'/jobs/{job_id}/retry')
+    assert response.get_json()["job"]["error"] is None
+
+    job = wait_job(manager, job_id)
+    assert job["state"] == jobs.SUCCEEDED
+    assert job["attempts"] == 2
+    assert service.request('GET', f'/jobs/{job_id}/result').data == CONTENT
+
+
+def test_cancel_running_job(service, manager):
+    service.backend.store.write('/jobs/big.bin', CONTENT)
+    # 限制带宽，保证取消时任务仍在下载
+    service.backend.config.bandwidth = 256 * 1024
+    job_id = service.request('POST', '/jobs/download', json={'path': '/jobs/big.bin'}).get_json()["job"]["job_id"]
+    wait_job(manager, job_id, states=(jobs.RUNNING,))
+
+    assert service.request('POST', f'/jobs/{job_id}/cancel').get_json()["job"]["state"] == jobs.CANCELLING
+    assert wait_job(manager, job_id)["state"] == jobs.CANCELLED
+    # 已取消的任务不能获取结果，可以删除
+    assert service.request('GET', f'/jobs/{job_id}/result').status_code == 409
+    assert service.request('DELETE', f'/jobs/{job_id}').status_code == 200
+
+
+def test_running_job_of_exited_process_is_recovered(service, manager, monkeypatch):
+    service.backend.store.write('/jobs/big.bin', CONTENT)
+    # 模拟已退出的worker进程：认领了任务但不再执行，也不再刷新心跳
+    dead = make_manager(service, manager.db.path)
+    monkeypatch.setattr(dead, 'start', lambda: None)
+    dead.owner = 'dead-host:1'
+    staging_dir = os.path.join(service.api.JOBS_DIR, 'recovered')
+    job = dead.submit('download', service.session_id, service.api.get_account(service.drive_client()), {
+        "remote_path": '/jobs/big.bin',
+        "_output_file": os.path.join(staging_dir, 'big.bin'),
+    })
+    assert dead._claim(dead.db.connect())["owner"] == 'dead-host:1'
+    conn = dead.db.connect()
+    with conn:
+        conn.execute('UPDATE jobs SET updated_at = ? WHERE id = ?', (time.time() - 600, job["id"]))
+
+    # 重启后的进程把失效的任务重新排队并执行
+    restarted = make_manager(service, manager.db.path, stale_seconds=60)
+    restarted.start()
+    job = wait_job(restarted, job["id"])
+    assert job["state"] == jobs.SUCCEEDED
+    assert job["attempts"] == 2
+    assert job["owner"] == restarted.owner
+    with open(job["params"]["_output_file"], 'rb') as f:
+        assert f.read() == CONTENT
+
+
+def test_stale_cancelling_job_is_finished_as_cancelled(service, manager):
+    dead = make_manager(service, manager.db.path)
+    conn = dead.db.connect()
+    now = time.time()
+    with conn:
+        conn.execute(
+            'INSERT INTO jobs (id, type, state, session_id, account, params, owner, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ('stale', 'download', jobs.CANCELLING, service.session_id, 'acct', '{}', 'dead-host:1', now - 600, now - 600)
+        )
+    JobManager(manager.db.path, stale_seconds=60)._recover_stale(conn)
+    job = dead.get('stale')
+    assert job["state"] == jobs.CANCELLED
+    assert job["finished_at"] is not None
@@ -0,0 +1,68 @@
+"""
+目录列表缓存：失效之前开始的获取完成后不写入缓存
+"""
+
+import threading
+
+from list_cache import ListingCache
+
+ACCOUNT = 'acct'
+BEFORE = [{"name": "a.txt", "type": "file"}]
+AFTER = BEFORE + [{"name": "b.txt", "type": "file"}]
+
+
+def test_fill_started_before_invalidation_is_not_cached():
+    cache = ListingCache(ttl=60)
+    generation = cache.generation(ACCOUNT)
+    # 获取进行中，上传完成并使目录失效
+    cache.invalidate_parent(ACCOUNT, '/d/b.txt')
+
+    entry = cache.set(ACCOUNT, '/d', BEFORE, generation=generation)
+    assert entry["items"] == BEFORE
+    assert cache.get(ACCOUNT, '/d') is None
+    assert cache.stats()["stale_fills"] == 1
+
+    cache.set(ACCOUNT, '/d', AFTER, generation=cache.generation(ACCOUNT))
+    assert cache.get(ACCOUNT, '/d')["items"] == AFTER
+
+
+def test_invalidation_of_other_account_does_not_discard_fill():
+    cache = ListingCache(ttl=60)
+    generation = cache.generation(ACCOUNT)
+    cache.invalidate('other', '/d')
+    cache.set(ACCOUNT, '/d', BEFORE, generation=generation)
+    assert cache.get(ACCOUNT, '/d')["items"] == BEFORE
+
+
+def test_cached_at_is_fetch_start():
+    cache = ListingCache(ttl=60)
+    entry = cache.set(ACCOUNT, '/d', BEFORE, fetched_at=1000.0)
+    assert entry["cached_at"] == 1000.0
+
+
+def test_upload_during_listing_is_visible_to_next_list(service, monkeypatch):
+    service.backend.store.write('/d/a.txt', b'a')
+    api = service.api
+    fetching, resume = threading.Event(), threading.Event()
+    real_fetch_listing = api.fetch_listing
+
+    def slow_fetch_listing(client, path):
+        items = real_fetch_listing(client, path)
+        fetching.set()
+        resume.wait(5)
+        return items
+
+    monkeypatch.setattr(api, 'fetch_listing', slow_fetch_listing)
+    listing = threading.Thread(target=lambda: service.request('GET', '/list', query_string={'path': '/d'}))
+    listing.start()
+    assert fetching.wait(5)
+
+    # 列表已从网盘取回但还未写入缓存时，另一个请求上传了新文件
+    response = service.request('PUT', '/upload_stream', query_string={'path': '/d', 'filename': 'b.txt'}, data=b'b')
+    assert response.status_code == 200, response.get_json()
+    resume.set()
+    listing.join(5)
+
+    monkeypatch.setattr(api, 'fetch_listing', real_fetch_listing)
+    names = [item["name"] for item in service.request('GET', '/list', query_string={'path': '/d'}).get_json()["items"]]
+    assert sorted(names) == ['a.txt', 'b.txt']
@@ -0,0 +1,77 @@
+"""
+秒传：只有网盘明确未找到文件时才算未命中并清理本地索引
+"""
+
+import io
+import os
+
+import pytest
+import requests
+
+from rapid_upload import RapidUploader, HashIndex, hash_stream
+from upstream import UpstreamUnavailable
+from fake_baidu import FakeBackend, FakeConfig, FakeBaiduError, ERRNO_THROTTLED
+
+CONTENT = os.urandom(512 * 1024)
+ACCOUNT = 'acct'
+
+
+class Drive:
+    def __init__(self, error):
+        self.error = error
+
+    def rapid_upload_file(self, *args):
+        raise self.error
+
+
+class Client:
+    def __init__(self, drive):
+        self.drive = drive
+
+
+@pytest.fixture
+def uploader(tmp_path):
+    uploader = RapidUploader(HashIndex(str(tmp_path / 'hash_index.db')))
+    uploader.index.record(ACCOUNT, '/r/r.bin', hash_stream(io.BytesIO(CONTENT)))
+    return uploader
+
+
+def try_upload(uploader, error):
+    return uploader.try_upload(Client(Drive(error)), ACCOUNT, hash_stream(io.BytesIO(CONTENT)), '/r/copy.bin')
+
+
+@pytest.mark.parametrize('error', [
+    FakeBaiduError(ERRNO_THROTTLED, "请求过于频繁"),
+    requests.ConnectionError("连接被重置"),
+])
+def test_transient_errors_keep_index(uploader, error):
+    assert try_upload(uploader, error) is None
+    assert uploader.index.lookup(ACCOUNT, hash_stream(io.BytesIO(CONTENT))) == ['/r/r.bin']
+    stats = uploader.stats()
+    assert stats["misses"] == 0
+    assert stats["errors"] == 1
+
+
+def test_unavailable_upstream_is_raised(uploader):
+    with pytest.raises(UpstreamUnavailable):
+        try_upload(uploader, UpstreamUnavailable("熔断中", retry_after=5))
+    assert uploader.index.lookup(ACCOUNT, hash_stream(io.BytesIO(CONTENT))) == ['/r/r.bin']
+
+
+def test_not_found_is_a_miss_and_forgets_index(uploader):
+    assert try_upload(uploader, FakeBaiduError(31079, "秒传未找到文件")) is None
+    assert uploader.index.lookup(ACCOUNT, hash_stream(io.BytesIO(CONTENT))) == []
+    assert uploader.stats()["misses"] == 1
+
+
+def test_hit_against_fake_backend(tmp_path):
+    backend = FakeBackend(FakeConfig(latency=0, jitter=0))
+    backend.store.write('/r/r.bin', CONTENT)
+    client = backend.drive_class()()
+    assert client.login(bduss=ACCOUNT)
+    uploader = RapidUploader(HashIndex(str(tmp_path / 'hash_index.db')))
+
+    result = uploader.try_upload(client, ACCOUNT, hash_stream(io.BytesIO(CONTENT)), '/r/copy.bin')
+    assert result["rapid_upload"] is True
+    assert backend.store.read('/r/copy.bin') == CONTENT
+    assert uploader.stats()["hit_ratio"] == 1.0
@@ -0,0 +1,176 @@
+"""
+可续传上传（tus）：跨分片的PATCH/HEAD、偏移量冲突、写入锁、断点续传、租约过期接管和空文件
+"""
+
+import io
+import os
+
+import pytest
+from werkzeug.exceptions import ClientDisconnected
+
+import resumable_upload
+from resumable_upload import ResumableUploads, UploadLocked, LOCK_SECONDS
+
+SLICE_SIZE = 1024
+CONTENT = os.urandom(3000)
+
+
+@pytest.fixture
+def uploads(service, tmp_path, monkeypatch):
+    uploads = ResumableUploads(str(tmp_path / 'resumable.db'), str(tmp_path / 'parts'), slice_size=SLICE_SIZE)
+    monkeypatch.setattr(service.api, 'resumable_uploads', uploads)
+    return uploads
+
+
+def create(service, length, filename='big.bin'):
+    response = service.request('POST', '/uploads', query_string={'path': '/tus', 'filename': filename},
+                               headers={'Upload-Length': str(length), 'Tus-Resumable': '1.0.0'})
+    assert response.status_code == 201, response.get_json()
+    return response.headers['Location']
+
+
+def patch(service, location, offset, data, **kwargs):
+    return service.request('PATCH', location, data=data, headers={
+        'Tus-Resumable': '1.0.0',
+        'Content-Type': 'application/offset+octet-stream',
+        'Upload-Offset': str(offset),
+    }, **kwargs)
+
+
+def head_offset(service, location):
+    response = service.request('HEAD', location)
+    assert response.status_code == 200
+    return int(response.headers['Upload-Offset'])
+
+
+class DisconnectingStream(io.BytesIO):
+    """读到limit字节后模拟客户端断开"""
+
+    def __init__(self, data, limit):
+        super().__init__(data)
+        self.limit = limit
+
+    def read(self, size=-1):
+        if self.tell() >= self.limit:
+            raise ClientDisconnected()
+        if size is None or size < 0:
+            size = self.limit - self.tell()
+        return super().read(min(size, self.limit - self.tell()))
+
+
+def test_patch_and_head_across_slice_boundaries(service, uploads):
+    location = create(service, len(CONTENT))
+    assert head_offset(service, location) == 0
+
+    # 不足一个分片的数据只暂存在本地
+    assert patch(service, location, 0, CONTENT[:700]).status_code == 204
+    assert head_offset(service, location) == 700
+    assert 'upload_slice' not in service.backend.stats()["calls"]
+
+    # 跨过分片边界，凑满的分片立即上传
+    response = patch(service, location, 700, CONTENT[700:1700])
+    assert response.status_code == 204
+    assert response.headers['Upload-Offset'] == '1700'
+    assert service.backend.stats()["calls"]["upload_slice"] == 1
+
+    assert patch(service, location, 1700, CONTENT[1700:]).status_code == 204
+    assert service.backend.store.read('/tus/big.bin') == CONTENT
+    assert service.backend.stats()["calls"]["upload_slice"] == 3
+
+    detail = service.request('GET', location).get_json()["upload"]
+    assert detail["state"] == resumable_upload.COMPLETED
+    assert detail["offset"] == len(CONTENT)
+    assert detail["slices"] == 3
+
+
+def test_offset_mismatch_returns_409(service, uploads):
+    location = create(service, len(CONTENT))
+    assert patch(service, location, 0, CONTENT[:500]).status_code == 204
+
+    response = patch(service, location, 400, CONTENT[400:900])
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '500'
+    assert head_offset(service, location) == 500
+
+
+def test_concurrent_writer_returns_423(service, uploads):
+    location = create(service, len(CONTENT))
+    upload_id = location.rsplit('/', 1)[1]
+    token = uploads.acquire(upload_id)
+
+    response = patch(service, location, 0, CONTENT[:500])
+    assert response.status_code == 423
+    assert response.headers['Retry-After'] == str(LOCK_SECONDS // 4)
+    assert head_offset(service, location) == 0
+
+    uploads.release(upload_id, token)
+    assert patch(service, location, 0, CONTENT[:500]).status_code == 204
+
+
+def test_resume_after_mid_slice_disconnect(service, uploads, monkeypatch):
+    monkeypatch.setattr(resumable_upload, 'READ_SIZE', 100)
+    location = create(service, len(CONTENT))
+    # 请求声明了完整长度，读到1500字节时连接断开
+    response = patch(service, location, 0, None, input_stream=DisconnectingStream(CONTENT, 1500),
+                     content_length=len(CONTENT))
+    assert response.status_code == 400
+
+    # 第一个分片已上传，第二个分片已收到的部分暂存在本地，都计入偏移量（断开时不完整的最后一次读取被丢弃）
+    offset = head_offset(service, location)
+    assert SLICE_SIZE < offset <= 1500
+    assert service.backend.stats()["calls"]["upload_slice"] == 1
+
+    assert patch(service, location, offset, CONTENT[offset:]).status_code == 204
+    assert service.backend.store.read('/tus/big.bin') == CONTENT
+
+
+def test_failed_slice_upload_is_retried_on_next_patch(service, uploads, monkeypatch):
+    calls = []
+    real_upload_slice = resumable_upload.upload_slice
+
+    def flaky_upload_slice(client, block):
+        calls.append(len(block))
+        if len(calls) == 1:
+            raise IOError("分片上传失败")
+        return real_upload_slice(client, block)
+
+    monkeypatch.setattr(resumable_upload, 'upload_slice', flaky_upload_slice)
+    location = create(service, len(CONTENT))
+    assert patch(service, location, 0, CONTENT[:1200]).status_code == 500
+
+    # 凑满的分片仍暂存在本地，偏移量停在分片边界，下一次写入先补传该分片
+    assert head_offset(service, location) == SLICE_SIZE
+    assert patch(service, location, SLICE_SIZE, CONTENT[SLICE_SIZE:]).status_code == 204
+    assert calls == [SLICE_SIZE, SLICE_SIZE, SLICE_SIZE, len(CONTENT) - 2 * SLICE_SIZE]
+    assert service.backend.store.read('/tus/big.bin') == CONTENT
+
+
+def test_expired_lease_is_taken_over(service, uploads, monkeypatch):
+    location = create(service, len(CONTENT))
+    upload_id = location.rsplit('/', 1)[1]
+    stale_token = uploads.acquire(upload_id)
+    with pytest.raises(UploadLocked):
+        uploads.acquire(upload_id)
+
+    # 持有锁的请求异常退出，租约到期后可以被其他请求接管
+    now = resumable_upload.time.time()
+    monkeypatch.setattr(resumable_upload.time, 'time', lambda: now + LOCK_SECONDS + 1)
+    assert patch(service, location, 0, CONTENT[:500]).status_code == 204
+
+    # 原来的持有者恢复后不能再写入
+    upload = uploads.get(upload_id)
+    with pytest.raises(UploadLocked):
+        uploads.write(service.drive_client(), upload, stale_token, io.BytesIO(CONTENT[500:600]))
+    assert head_offset(service, location) == 500
+
+
+def test_zero_length_upload_completes_on_create(service, uploads):
+    location = create(service, 0, filename='empty.bin')
+
+    assert head_offset(service, location) == 0
+    detail = service.request('GET', location).get_json()["upload"]
+    assert detail["state"] == resumable_upload.COMPLETED
+    assert service.backend.store.read('/tus/empty.bin') == b''
+
+    # 已完成的上传不再接受数据
+    assert patch(service, location, 0, b'').status_code == 204
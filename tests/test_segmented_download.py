@@ -0,0 +1,88 @@
+"""
+分段下载：中断后从分段表继续，远程文件被替换（大小相同）时丢弃分段表
+"""
+
+import json
+import os
+import threading
+
+import pytest
+
+from segmented_download import SegmentedDownloader, SegmentedDownloadCancelled, file_identity
+from download_proxy import build_download_headers
+from fake_baidu import FakeBackend, FakeConfig
+
+SEGMENT_SIZE = 64 * 1024
+SEGMENTS = 8
+CONTENT = os.urandom(SEGMENT_SIZE * SEGMENTS)
+PATH = '/seg/big.bin'
+
+
+@pytest.fixture
+def backend():
+    backend = FakeBackend(FakeConfig(latency=0, jitter=0)).start()
+    backend.store.write(PATH, CONTENT)
+    yield backend
+    backend.stop()
+
+
+@pytest.fixture
+def client(backend):
+    client = backend.drive_class()()
+    assert client.login(bduss='segmented')
+    return client
+
+
+def identity_of(backend):
+    pcs_file = backend.store.stat(PATH)
+    return file_identity(pcs_file.fs_id, pcs_file.md5)
+
+
+def downloader(backend, client, filepath, **kwargs):
+    return SegmentedDownloader(backend.dlink(PATH), build_download_headers(client), filepath,
+                               connections=1, segment_size=SEGMENT_SIZE, chunk_size=16 * 1024,
+                               identity=identity_of(backend), **kwargs)
+
+
+def interrupt(backend, client, filepath, after=3 * SEGMENT_SIZE):
+    """单连接下载，收到after字节后取消，留下分段表"""
+    cancel = threading.Event()
+
+    def on_progress(done, total):
+        if done >= after:
+            cancel.set()
+
+    with pytest.raises(SegmentedDownloadCancelled):
+        downloader(backend, client, filepath, on_progress=on_progress, cancel_event=cancel).run()
+    with open(f"{filepath}.segments.json", encoding='utf-8') as f:
+        done = json.load(f)["done"]
+    assert 0 < len(done) < SEGMENTS
+    return done
+
+
+def test_resume_fetches_only_missing_segments(backend, client, tmp_path):
+    filepath = str(tmp_path / 'big.bin')
+    done = interrupt(backend, client, filepath)
+
+    before = backend.stats()["cdn_requests"]
+    downloader(backend, client, filepath).run()
+    # 一次探测请求加上未完成的分段
+    assert backend.stats()["cdn_requests"] - before == 1 + SEGMENTS - len(done)
+    with open(filepath, 'rb') as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(f"{filepath}.segments.json")
+
+
+def test_replaced_file_of_same_size_discards_segment_map(backend, client, tmp_path):
+    filepath = str(tmp_path / 'big.bin')
+    interrupt(backend, client, filepath)
+
+    replaced = os.urandom(len(CONTENT))
+    backend.store.write(PATH, replaced)
+    before = backend.stats()["cdn_requests"]
+    downloader(backend, client, filepath).run()
+
+    # 所有分段重新下载，不会拼接新旧内容
+    assert backend.stats()["cdn_requests"] - before == 1 + SEGMENTS
+    with open(filepath, 'rb') as f:
+        assert f.read() == replaced
@@ -0,0 +1,191 @@
+"""
+会话存储后端：内存、SQLite（多个worker进程共享）和Redis兼容客户端
+"""
+
+import multiprocessing
+import os
+
+import pytest
+
+import session_store
+from session_store import (MemorySessionStore, SQLiteSessionStore, RedisSessionStore, create_session_store,
+                           account_key, pick_credentials)
+
+CREDENTIALS = {"bduss": "bduss-value", "stoken": "stoken-value", "ptoken": "ptoken-value"}
+
+
+class FakeRedis:
+    """只实现会话存储用到的get/set/delete/scan_iter，ex参数按clock计算过期"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def _alive(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= self.clock():
+            del self.data[key]
+            return None
+        return value
+
+    def get(self, key):
+        value = self._alive(key)
+        return value.encode('utf-8') if value is not None else None
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, self.clock() + ex if ex else None)
+
+    def delete(self, key):
+        return 1 if self._alive(key) is not None and self.data.pop(key) else 0
+
+    def scan_iter(self, match):
+        prefix = match.rstrip('*')
+        return [key for key in list(self.data) if key.startswith(prefix) and self._alive(key) is not None]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def make_store(request, tmp_path, clock):
+    def make(ttl=0):
+        if request.param == 'memory':
+            return MemorySessionStore(ttl=ttl)
+        if request.param == 'sqlite':
+            return SQLiteSessionStore(str(tmp_path / 'sessions.db'), ttl=ttl)
+        return RedisSessionStore(redis=FakeRedis(clock), ttl=ttl)
+    return make
+
+
+def test_set_get_delete(make_store):
+    store = make_store()
+    assert store.get('missing') is None
+
+    store.set('s1', dict(CREDENTIALS, password='not-stored', stoken=''))
+    assert store.get('s1') == {"bduss": "bduss-value", "ptoken": "ptoken-value"}
+    assert store.count() == 1
+
+    assert store.delete('s1') is True
+    assert store.delete('s1') is False
+    assert store.get('s1') is None
+    assert store.count() == 0
+
+
+def test_set_replaces_existing_session(make_store):
+    store = make_store()
+    store.set('s1', CREDENTIALS)
+    store.set('s1', {"bduss": "other"})
+    assert store.get('s1') == {"bduss": "other"}
+    assert store.count() == 1
+
+
+def test_sessions_expire_after_ttl(make_store, clock):
+    store = make_store(ttl=60)
+    store.set('s1', CREDENTIALS)
+    clock.now += 59
+    assert store.get('s1') == CREDENTIALS
+
+    clock.now += 2
+    assert store.get('s1') is None
+    assert store.count() == 0
+
+
+def test_sessions_without_ttl_never_expire(make_store, clock):
+    store = make_store(ttl=0)
+    store.set('s1', CREDENTIALS)
+    clock.now += 10 * 365 * 86400
+    assert store.get('s1') == CREDENTIALS
+
+
+def _worker_login(path, session_id, queue):
+    """模拟另一个worker进程：登录后写入会话，再读取父进程写入的会话"""
+    store = SQLiteSessionStore(path)
+    store.set(session_id, {"bduss": f"bduss-of-{session_id}"})
+    queue.put(store.get('from-parent'))
+
+
+def _worker_read(store, session_id, queue):
+    """fork前创建的存储在子进程中继续使用（gunicorn预加载应用的情形）"""
+    queue.put(store.get(session_id))
+
+
+@pytest.fixture
+def fork_context():
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip("需要fork启动方式")
+    return multiprocessing.get_context('fork')
+
+
+def test_sqlite_store_is_shared_between_worker_processes(tmp_path, fork_context):
+    path = str(tmp_path / 'sessions.db')
+    store = SQLiteSessionStore(path)
+    store.set('from-parent', CREDENTIALS)
+
+    queue = fork_context.Queue()
+    worker = fork_context.Process(target=_worker_login, args=(path, 'from-worker', queue))
+    worker.start()
+    seen_by_worker = queue.get(timeout=10)
+    worker.join(10)
+
+    assert worker.exitcode == 0
+    assert seen_by_worker == CREDENTIALS
+    # 其他worker上的登录立即可见
+    assert store.get('from-worker') == {"bduss": "bduss-of-from-worker"}
+
+
+def test_sqlite_store_survives_fork_and_sees_logout(tmp_path, fork_context):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+    store.set('s1', CREDENTIALS)
+    # 父进程已经打开过连接，子进程需要重新打开
+    assert store.get('s1') == CREDENTIALS
+
+    queue = fork_context.Queue()
+    worker = fork_context.Process(target=_worker_read, args=(store, 's1', queue))
+    worker.start()
+    assert queue.get(timeout=10) == CREDENTIALS
+    worker.join(10)
+
+    store.delete('s1')
+    worker = fork_context.Process(target=_worker_read, args=(store, 's1', queue))
+    worker.start()
+    assert queue.get(timeout=10) is None
+    worker.join(10)
+
+
+def test_create_session_store_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv('SESSION_DB_PATH', str(tmp_path / 'env.db'))
+    monkeypatch.setenv('SESSION_TTL', '30')
+    store = create_session_store()
+    assert isinstance(store, SQLiteSessionStore)
+    assert store.ttl == 30
+    assert os.path.exists(tmp_path / 'env.db')
+
+    assert isinstance(create_session_store('memory'), MemorySessionStore)
+    with pytest.raises(ValueError):
+        create_session_store('unknown')
+
+
+def test_account_key_hides_bduss():
+    key = account_key('secret-bduss')
+    assert key == account_key('secret-bduss')
+    assert key != account_key('other-bduss')
+    assert 'secret' not in key and len(key) == 16
+
+
+def test_pick_credentials_drops_unknown_and_empty_fields():
+    assert pick_credentials({"bduss": "b", "stoken": None, "extra": "x"}) == {"bduss": "b"}
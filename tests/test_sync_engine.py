@@ -0,0 +1,158 @@
+"""
+增量同步：push/pull方向的新增和修改、清单跳过未变化的文件、冲突和删除的传播
+"""
+
+import os
+
+import pytest
+
+import upload_pipeline
+import sync_engine
+from sync_engine import SyncEngine, SyncManifest, PUSH, PULL, UPLOAD, DOWNLOAD, DELETE_REMOTE, DELETE_LOCAL
+from fake_baidu import FakeBackend, FakeConfig
+
+REMOTE_ROOT = '/sync'
+
+
+@pytest.fixture
+def backend():
+    backend = FakeBackend(FakeConfig(latency=0, jitter=0)).start()
+    yield backend
+    backend.stop()
+
+
+@pytest.fixture
+def client(backend):
+    client = backend.drive_class()()
+    assert client.login(bduss='sync')
+    return client
+
+
+@pytest.fixture
+def make_engine(client, tmp_path):
+    manifest = SyncManifest(str(tmp_path / 'manifest.db'))
+
+    def make(direction, **kwargs):
+        return SyncEngine(client, str(tmp_path / 'local'), REMOTE_ROOT, direction=direction,
+                          manifest=manifest, workers=2, **kwargs)
+    return make
+
+
+def write_local(tmp_path, rel_path, data):
+    path = tmp_path / 'local' / rel_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def read_local(tmp_path, rel_path):
+    return (tmp_path / 'local' / rel_path).read_bytes()
+
+
+def calls(backend, method):
+    return backend.stats()["calls"].get(method, 0)
+
+
+def test_push_uploads_only_changed_files(backend, make_engine, tmp_path, monkeypatch):
+    write_local(tmp_path, 'a.txt', b'alpha')
+    write_local(tmp_path, 'dir/b.bin', os.urandom(5000))
+
+    # 上传时使用同步前计算的哈希，不再边读边算
+    monkeypatch.setattr(upload_pipeline, 'ContentHasher', None)
+    summary = make_engine(PUSH).run()
+    assert summary["planned"] == {UPLOAD: 2}
+    assert summary["errors"] == []
+    assert backend.store.read('/sync/a.txt') == b'alpha'
+    assert backend.store.read('/sync/dir/b.bin') == read_local(tmp_path, 'dir/b.bin')
+
+    # 清单中大小和修改时间都没变的文件直接跳过，也不再列出网盘目录
+    lists = calls(backend, 'list')
+    summary = make_engine(PUSH).run()
+    assert summary["planned"] == {}
+    assert calls(backend, 'list') == lists
+
+    write_local(tmp_path, 'a.txt', b'alpha, modified')
+    summary = make_engine(PUSH).run()
+    assert summary["planned"] == {UPLOAD: 1}
+    assert summary["bytes_transferred"] == len(b'alpha, modified')
+    assert backend.store.read('/sync/a.txt') == b'alpha, modified'
+
+
+def test_first_push_records_identical_remote_files(backend, make_engine, tmp_path):
+    backend.store.write('/sync/same.txt', b'same content')
+    write_local(tmp_path, 'same.txt', b'same content')
+
+    summary = make_engine(PUSH).run()
+    assert summary["planned"] == {sync_engine.RECORD: 1}
+    assert summary["bytes_transferred"] == 0
+    assert calls(backend, 'upload_slice') == calls(backend, 'upload_file') == 0
+
+
+def test_push_propagates_deletes_only_when_enabled(backend, make_engine, tmp_path):
+    write_local(tmp_path, 'keep.txt', b'keep')
+    gone = write_local(tmp_path, 'gone.txt', b'gone')
+    make_engine(PUSH).run()
+    gone.unlink()
+
+    assert make_engine(PUSH).run()["planned"] == {}
+    assert backend.store.exists('/sync/gone.txt')
+
+    summary = make_engine(PUSH, delete=True).run()
+    assert summary["planned"] == {DELETE_REMOTE: 1}
+    assert summary["errors"] == []
+    assert not backend.store.exists('/sync/gone.txt')
+    assert backend.store.exists('/sync/keep.txt')
+    # 删除后清单中不再有该文件，之后的同步不会重复删除
+    assert make_engine(PUSH, delete=True).run()["planned"] == {}
+
+
+def test_pull_downloads_new_and_changed_files(backend, make_engine, tmp_path):
+    backend.store.write('/sync/a.txt', b'alpha')
+    backend.store.write('/sync/dir/b.bin', os.urandom(300 * 1024))
+    backend.store.write('/sync/empty.txt', b'')
+
+    summary = make_engine(PULL).run()
+    assert summary["planned"] == {DOWNLOAD: 3}
+    assert summary["errors"] == []
+    assert read_local(tmp_path, 'dir/b.bin') == backend.store.read('/sync/dir/b.bin')
+    assert read_local(tmp_path, 'empty.txt') == b''
+    # 下载的临时文件已替换为目标文件
+    assert not [name for name in os.listdir(tmp_path / 'local') if name.endswith(sync_engine.PART_SUFFIX)]
+
+    assert make_engine(PULL).run()["planned"] == {}
+
+    backend.store.write('/sync/a.txt', b'alpha, changed remotely')
+    summary = make_engine(PULL).run()
+    assert summary["planned"] == {DOWNLOAD: 1}
+    assert read_local(tmp_path, 'a.txt') == b'alpha, changed remotely'
+
+
+def test_pull_reports_conflict_when_both_sides_changed(backend, make_engine, tmp_path):
+    backend.store.write('/sync/a.txt', b'alpha')
+    make_engine(PULL).run()
+
+    backend.store.write('/sync/a.txt', b'remote edit')
+    write_local(tmp_path, 'a.txt', b'local edit!')
+    summary = make_engine(PULL).run()
+    assert summary["conflicts"] == ['a.txt']
+    # 冲突的文件两边都保持不变
+    assert read_local(tmp_path, 'a.txt') == b'local edit!'
+    assert backend.store.read('/sync/a.txt') == b'remote edit'
+
+
+def test_pull_propagates_deletes_only_when_enabled(backend, make_engine, tmp_path):
+    backend.store.write('/sync/keep.txt', b'keep')
+    backend.store.write('/sync/gone.txt', b'gone')
+    make_engine(PULL).run()
+    backend.store.remove('/sync/gone.txt')
+    # 只存在于本地、从未同步过的文件不会被删除
+    write_local(tmp_path, 'local-only.txt', b'mine')
+
+    make_engine(PULL).run()
+    assert (tmp_path / 'local' / 'gone.txt').exists()
+
+    summary = make_engine(PULL, delete=True).run()
+    assert summary["planned"] == {DELETE_LOCAL: 1}
+    assert not (tmp_path / 'local' / 'gone.txt').exists()
+    assert read_local(tmp_path, 'keep.txt') == b'keep'
+    assert read_local(tmp_path, 'local-only.txt') == b'mine'
@@ -0,0 +1,262 @@
+"""
+上游保护层：令牌桶、限流退避、熔断和AIMD并发调整
+"""
+
+import io
+import time
+import threading
+
+import pytest
+import requests
+
+import upstream
+from upstream import (TokenBucket, CircuitBreaker, AdaptiveLimiter, AccountGuard, UpstreamGuard,
+                      UpstreamUnavailable)
+from upload_pipeline import UploadPipeline
+from fake_baidu import FakeBackend, FakeConfig, FakeBaiduError, ERRNO_THROTTLED
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录退避等待的时间，不真正等待"""
+    recorded = []
+    monkeypatch.setattr(upstream.time, 'sleep', recorded.append)
+    return recorded
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+def flaky(errors, result='ok'):
+    """依次抛出errors中的异常，之后返回result，calls记录调用次数"""
+    errors = list(errors)
+
+    def fn(*args, **kwargs):
+        fn.calls += 1
+        if errors:
+            raise errors.pop(0)
+        return result
+    fn.calls = 0
+    return fn
+
+
+def make_guard(**options):
+    defaults = dict(rate=1000, burst=1000, retries=3, breaker_threshold=100, breaker_reset=30,
+                    concurrency_min=1, concurrency_max=8, queue_timeout=1)
+    defaults.update(options)
+    return AccountGuard(**defaults)
+
+
+# ---- 令牌桶 ----
+
+def test_token_bucket_allows_burst_then_limits():
+    bucket = TokenBucket(rate=1, burst=3)
+    assert all(bucket.acquire(timeout=0) for _ in range(3))
+    # 桶已空，1秒才补充1个令牌
+    assert bucket.acquire(timeout=0.05) is False
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate=50, burst=1)
+    assert bucket.acquire(timeout=0)
+    started = time.monotonic()
+    assert bucket.acquire(timeout=1)
+    assert time.monotonic() - started >= 0.01
+    assert bucket.waits == 1
+
+
+# ---- 重试与退避 ----
+
+@pytest.mark.parametrize('error', [
+    FakeBaiduError(ERRNO_THROTTLED, "请求过于频繁"),
+    http_error(429),
+])
+def test_throttled_calls_back_off_and_retry(sleeps, error):
+    guard = make_guard()
+    fn = flaky([error, error])
+
+    assert guard.call('list', fn) == 'ok'
+    assert fn.calls == 3
+    assert len(sleeps) == 2
+    stats = guard.stats()
+    assert stats["throttled"] == 2
+    assert stats["retried"] == 2
+
+
+def test_backoff_grows_exponentially_with_cap(monkeypatch):
+    monkeypatch.setattr(upstream.random, 'uniform', lambda low, high: high)
+    delays = [upstream.backoff_delay(attempt, base=0.5, cap=4) for attempt in range(5)]
+    assert delays == [0.5, 1, 2, 4, 4]
+
+
+def test_persistent_throttling_becomes_unavailable(sleeps):
+    guard = make_guard(retries=2)
+    fn = flaky([FakeBaiduError(ERRNO_THROTTLED, "请求过于频繁")] * 10)
+
+    with pytest.raises(UpstreamUnavailable) as info:
+        guard.call('list', fn)
+    assert fn.calls == 3
+    assert info.value.retry_after is not None
+
+
+def test_business_errors_are_not_retried(sleeps):
+    guard = make_guard()
+    fn = flaky([FakeBaiduError(-9, "文件不存在")])
+
+    with pytest.raises(FakeBaiduError):
+        guard.call('meta', fn)
+    assert fn.calls == 1
+    assert sleeps == []
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retry_rewinds_seekable_streams(sleeps):
+    guard = make_guard()
+    seen = []
+
+    def upload(stream):
+        seen.append(stream.read())
+        if len(seen) == 1:
+            raise requests.ConnectionError("连接被重置")
+        return 'md5'
+
+    assert guard.call('upload_slice', upload, io.BytesIO(b'slice')) == 'md5'
+    assert seen == [b'slice', b'slice']
+
+
+# ---- 熔断 ----
+
+def test_breaker_opens_after_consecutive_failures(sleeps):
+    guard = make_guard(retries=0, breaker_threshold=2, breaker_reset=30)
+    fn = flaky([requests.ConnectionError("down")] * 10)
+
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            guard.call('list', fn)
+    assert guard.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(UpstreamUnavailable) as info:
+        guard.call('list', fn)
+    # 熔断期间不再调用上游
+    assert fn.calls == 2
+    assert 0 < info.value.retry_after <= 30
+
+
+def test_breaker_half_open_allows_single_probe():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow() is not None
+
+    time.sleep(0.06)
+    assert breaker.allow() is None
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 试探调用结束前其他调用仍被拒绝
+    assert breaker.allow() is not None
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() is None
+
+
+def test_breaker_reopens_when_probe_fails():
+    breaker = CircuitBreaker(threshold=5, reset_timeout=0.05)
+    for _ in range(5):
+        breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow() is None
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow() is not None
+    assert breaker.trips == 2
+
+
+# ---- AIMD并发调整 ----
+
+def test_limiter_halves_on_throttle_and_grows_additively():
+    limiter = AdaptiveLimiter(minimum=1, maximum=8)
+    assert limiter.acquire(timeout=0)
+    limiter.release(throttled=True)
+    assert limiter.limit == 4
+
+    for _ in range(4):
+        assert limiter.acquire(timeout=0)
+        limiter.release()
+    assert 4.5 < limiter.limit < 5.5
+
+    for _ in range(10):
+        assert limiter.acquire(timeout=0)
+        limiter.release(throttled=True)
+    assert limiter.limit == 1
+
+
+def test_limiter_blocks_beyond_limit():
+    limiter = AdaptiveLimiter(minimum=1, maximum=2)
+    assert limiter.acquire(timeout=0)
+    assert limiter.acquire(timeout=0)
+    assert limiter.acquire(timeout=0.01) is False
+
+
+def test_guard_lowers_concurrency_when_throttled(sleeps):
+    guard = make_guard(concurrency_max=8)
+    guard.call('list', flaky([FakeBaiduError(ERRNO_THROTTLED, "请求过于频繁")]))
+    assert guard.stats()["concurrency_limit"] < 8
+
+
+# ---- 与模拟后端配合 ----
+
+def test_upload_slices_are_retried_only_by_guard(sleeps):
+    backend = FakeBackend(FakeConfig(latency=0, jitter=0, throttle_rate=1.0))
+    client = backend.drive_class()()
+    backend.config.throttle_rate = 0
+    assert client.login(bduss='test-account')
+    backend.config.throttle_rate = 1.0
+
+    guarded = UpstreamGuard(rate=1000, burst=1000, retries=2, breaker_threshold=100).wrap(client, 'test-account')
+    with pytest.raises(UpstreamUnavailable):
+        UploadPipeline(guarded, '/t/a.bin', slice_size=4, parallel=1).upload(io.BytesIO(b'12345678'))
+
+    # 每个分片最多尝试retries+1次，流水线本身不再叠加重试
+    assert backend.stats()["calls"]["upload_slice"] == 3
+
+
+def test_open_breaker_fails_upload_without_sleeping(sleeps):
+    backend = FakeBackend(FakeConfig(latency=0, jitter=0))
+    client = backend.drive_class()()
+    assert client.login(bduss='test-account')
+
+    guard = UpstreamGuard(rate=1000, burst=1000, retries=0, breaker_threshold=1, breaker_reset=30)
+    guarded = guard.wrap(client, 'test-account')
+    guard.for_account('test-account').breaker.record_failure()
+
+    with pytest.raises(UpstreamUnavailable):
+        UploadPipeline(guarded, '/t/a.bin', slice_size=4, parallel=1).upload(io.BytesIO(b'12345678'))
+    assert 'upload_slice' not in backend.stats()["calls"]
+    assert sleeps == []
+
+
+def test_transfers_do_not_take_metadata_slots():
+    guard = make_guard(concurrency_min=1, concurrency_max=1, transfer_concurrency_max=1, queue_timeout=0.05)
+    started, finish = threading.Event(), threading.Event()
+
+    def transfer(*args):
+        started.set()
+        finish.wait(5)
+
+    worker = threading.Thread(target=guard.call, args=('upload_slice', transfer))
+    worker.start()
+    try:
+        assert started.wait(5)
+        # 唯一的元数据名额没有被进行中的传输占用
+        assert guard.call('list', lambda: 'ok') == 'ok'
+        with pytest.raises(UpstreamUnavailable):
+            guard.call('download_file', lambda: 'ok')
+        stats = guard.stats()
+        assert stats["transfer_in_flight"] == 1
+        assert stats["in_flight"] == 0
+    finally:
+        finish.set()
+        worker.join(5)
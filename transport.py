@@ -0,0 +1,276 @@
+"""
+上游HTTP传输层
+进程内所有访问百度网盘的HTTP请求共用一组按主机划分的keep-alive连接池：每个BaiDuDrive客户端的会话、
+流式下载代理和分段下载都挂载同一个HTTPAdapter，Cookie仍保存在各自的会话中；
+同时缓存DNS解析结果，可选地通过httpx以HTTP/2转发下载，并提供连接池使用情况的统计
+"""
+
+import os
+import time
+import socket
+import threading
+import logging
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 连接池按主机划分，最多保留的主机数和每个主机的最大连接数
+TRANSPORT_POOL_HOSTS = int(os.environ.get('TRANSPORT_POOL_HOSTS', 32))
+TRANSPORT_POOL_SIZE = int(os.environ.get('TRANSPORT_POOL_SIZE', 64))
+# 为1时连接数达到上限后等待空闲连接，否则临时新建连接，用完后不放回池中
+TRANSPORT_POOL_BLOCK = os.environ.get('TRANSPORT_POOL_BLOCK', '0') == '1'
+# 为1时缓存DNS解析结果；缓存通过替换进程内的socket.getaddrinfo实现，需要显式开启
+TRANSPORT_DNS_CACHE = os.environ.get('TRANSPORT_DNS_CACHE', '0') == '1'
+# DNS解析结果的缓存时间（秒），0为不缓存
+TRANSPORT_DNS_TTL = int(os.environ.get('TRANSPORT_DNS_TTL', 300))
+# 为1时下载代理通过httpx使用HTTP/2，需要安装httpx[http2]
+TRANSPORT_HTTP2 = os.environ.get('TRANSPORT_HTTP2', '0') == '1'
+
+
+class SharedAdapter(HTTPAdapter):
+    """可以挂载到多个会话上的HTTPAdapter，会话关闭时不关闭共享的连接池"""
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+class Transport:
+    """进程内共享的连接池"""
+
+    def __init__(self, pool_hosts=TRANSPORT_POOL_HOSTS, pool_size=TRANSPORT_POOL_SIZE, pool_block=TRANSPORT_POOL_BLOCK):
+        self.pool_hosts = pool_hosts
+        self.pool_size = pool_size
+        self.pool_block = pool_block
+        self.adapter = self._create_adapter()
+        self.attached = 0
+        self._session = None
+        # 创建共享会话时会在持有锁的情况下调用attach，需要可重入
+        self._lock = threading.RLock()
+
+    def _create_adapter(self):
+        return SharedAdapter(pool_connections=self.pool_hosts, pool_maxsize=self.pool_size,
+                             pool_block=self.pool_block)
+
+    def attach(self, session):
+        """让会话改用共享连接池，会话原有的适配器被关闭"""
+        for prefix in ('https://', 'http://'):
+            previous = session.adapters.get(prefix)
+            session.mount(prefix, self.adapter)
+            if previous is not None and previous is not self.adapter:
+                previous.close()
+        with self._lock:
+            self.attached += 1
+        return session
+
+    def attach_client(self, client):
+        """让BaiDuDrive客户端的HTTP会话改用共享连接池"""
+        try:
+            session = client.drive._baidupcs._session
+        except AttributeError:
+            return False
+        self.attach(session)
+        return True
+
+    def create_session(self):
+        """新建使用共享连接池、不保存Cookie的会话"""
+        session = requests.Session()
+        session.cookies.set_policy(reject_cookies())
+        return self.attach(session)
+
+    @property
+    def session(self):
+        """不带Cookie的共享会话，用于访问下载链接等不需要登录态的请求"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self.create_session()
+        return self._session
+
+    def reset(self):
+        """丢弃所有连接池；fork之后子进程不能继续使用父进程的连接"""
+        self.adapter.init_poolmanager(self.pool_hosts, self.pool_size, block=self.pool_block)
+
+    def stats(self):
+        """每个主机连接池的使用情况"""
+        pools = {}
+        manager = self.adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            queue = pool.pool
+            if queue is None:
+                continue
+            # 队列中预先放入maxsize个占位的None，取走的数量就是正在使用的连接数
+            pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "in_use": queue.maxsize - queue.qsize(),
+                "idle": sum(1 for conn in list(queue.queue) if conn is not None),
+                "max_size": queue.maxsize,
+                "connections_created": pool.num_connections,
+                "requests": pool.num_requests,
+            }
+        return {
+            "pool_hosts": self.pool_hosts,
+            "pool_size": self.pool_size,
+            "pool_block": self.pool_block,
+            "attached_sessions": self.attached,
+            "pools": pools,
+            "dns_cache": dns_cache.stats() if dns_cache is not None else None,
+            "http2": TRANSPORT_HTTP2,
+        }
+
+
+class DNSCache:
+    """缓存socket.getaddrinfo的结果；过期后重新解析，解析失败时继续使用旧结果"""
+
+    def __init__(self, ttl=TRANSPORT_DNS_TTL, resolver=None):
+        self.ttl = ttl
+        self.resolver = resolver or socket.getaddrinfo
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        if not host or is_ip_address(host):
+            return self.resolver(host, port, family, type, proto, flags)
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return list(entry[0])
+            self.misses += 1
+        try:
+            result = self.resolver(host, port, family, type, proto, flags)
+        except socket.gaierror:
+            if entry is None:
+                raise
+            with self._lock:
+                self.stale += 1
+            logger.warning(f"DNS解析 {host} 失败，继续使用缓存的结果")
+            return list(entry[0])
+        with self._lock:
+            self._entries[key] = (result, now + self.ttl)
+        return list(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+            }
+
+
+def reject_cookies():
+    """拒绝保存任何Cookie的策略。共享会话为所有账号发送请求，如果保存了某个账号响应中的Set-Cookie，
+    重定向时requests会丢弃显式传入的Cookie请求头而改用会话中的Cookie，导致Cookie被带到其他账号的请求上"""
+    return DefaultCookiePolicy(allowed_domains=[])
+
+
+def is_ip_address(host):
+    host = host.decode('ascii', 'ignore') if isinstance(host, bytes) else str(host)
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host.strip('[]'))
+            return True
+        except (OSError, ValueError):
+            continue
+    return False
+
+
+dns_cache = None
+
+
+def install_dns_cache(ttl=TRANSPORT_DNS_TTL):
+    """用带缓存的解析替换socket.getaddrinfo，ttl为0时不启用；重复调用只安装一次"""
+    global dns_cache
+    if ttl <= 0 or dns_cache is not None:
+        return dns_cache
+    dns_cache = DNSCache(ttl)
+    socket.getaddrinfo = dns_cache.getaddrinfo
+    return dns_cache
+
+
+# ---- 可选的HTTP/2下载 ----
+
+class HTTP2Response:
+    """把httpx的流式响应包装成下载代理使用的requests.Response接口"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    def iter_content(self, chunk_size=None):
+        return self._response.iter_bytes(chunk_size)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_http2_client = None
+
+
+def get_http2_client():
+    """共享的httpx客户端（HTTP/2），首次使用时创建"""
+    global _http2_client
+    if _http2_client is None:
+        try:
+            import httpx
+            import h2  # noqa: F401
+        except ImportError as e:
+            raise ImportError(f"TRANSPORT_HTTP2=1需要安装httpx[http2]: pip install 'httpx[http2]' ({e})")
+        with transport._lock:
+            if _http2_client is None:
+                client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=TRANSPORT_POOL_HOSTS * TRANSPORT_POOL_SIZE,
+                                        max_keepalive_connections=TRANSPORT_POOL_SIZE),
+                    follow_redirects=True,
+                )
+                client.cookies.jar.set_policy(reject_cookies())
+                _http2_client = client
+    return _http2_client
+
+
+def stream_get(url, headers, timeout=(10, 60)):
+    """以流式方式GET，返回requests.Response或接口相同的对象"""
+    if TRANSPORT_HTTP2:
+        import httpx
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        client = get_http2_client()
+        request = client.build_request('GET', url, headers=headers,
+                                       timeout=httpx.Timeout(read, connect=connect))
+        return HTTP2Response(client.send(request, stream=True))
+    return transport.session.get(url, headers=headers, stream=True, timeout=timeout)
+
+
+transport = Transport()
+
+
+def _reset_after_fork():
+    global _http2_client
+    transport.reset()
+    _http2_client = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
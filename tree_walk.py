@@ -0,0 +1,67 @@
+"""
+目录树遍历
+以有限并发的方式逐层展开子目录，发现一个目录的内容就立即产出，不需要等整棵树遍历完成
+"""
+
+import os
+import json
+import base64
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 遍历时同时展开的目录数量
+WALK_CONCURRENCY = int(os.environ.get('WALK_CONCURRENCY', 4))
+# 默认最大遍历深度
+WALK_MAX_DEPTH = int(os.environ.get('WALK_MAX_DEPTH', 20))
+
+
+def walk(list_dir, root, max_depth=WALK_MAX_DEPTH, concurrency=WALK_CONCURRENCY):
+    """遍历root下的目录树，list_dir(path)返回该目录的条目列表
+
+    逐个产出 ("entry", 条目, 深度) 或 ("error", 目录路径, 异常)；根目录的直接子项深度为1
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='walk')
+    pending = [(root, 1)]
+    running = {}
+    try:
+        while pending or running:
+            # 控制同时展开的目录数量，待展开的目录按深度优先的顺序排队
+            while pending and len(running) < concurrency:
+                path, depth = pending.pop()
+                running[executor.submit(list_dir, path)] = (path, depth)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, depth = running.pop(future)
+                try:
+                    items = future.result()
+                except Exception as e:
+                    yield "error", path, e
+                    continue
+                for item in items:
+                    yield "entry", item, depth
+                    if item.get("type") == "directory" and depth < max_depth:
+                        pending.append((item["path"], depth + 1))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_ndjson(records):
+    """把记录序列编码为NDJSON，每行一个JSON对象"""
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def encode_cursor(offset):
+    """分页游标，对客户端不透明"""
+    return base64.urlsafe_b64encode(f"o:{offset}".encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """解析分页游标，格式错误时抛出ValueError"""
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+    except Exception:
+        raise ValueError("cursor参数无效")
+    if not value.startswith('o:') or not value[2:].isdigit():
+        raise ValueError("cursor参数无效")
+    return int(value[2:])
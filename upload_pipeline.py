@@ -0,0 +1,101 @@
+"""
+分片上传流水线
+按固定大小从输入流中读取数据块，边读取边计算MD5等哈希，并把数据块作为分片并发上传到百度网盘，
+全部分片完成后合并为目标文件；内存占用只与同时上传的分片数量有关，不需要先把整个文件写到磁盘
+"""
+
+import io
+import os
+import threading
+
+from concurrency import get_executor
+from rapid_upload import ContentHasher
+
+# 每个分片的大小
+SLICE_SIZE = int(os.environ.get('UPLOAD_SLICE_SIZE', 4 * 1024 * 1024))
+# 同时上传的分片数量
+UPLOAD_PARALLEL = int(os.environ.get('UPLOAD_PARALLEL', 4))
+# 进程内所有上传共用的分片上传线程数，与上游调用线程池（UPSTREAM_WORKERS）分开
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 16))
+
+
+def read_block(stream, size):
+    """从流中读取size字节，流结束时返回不足size的剩余数据"""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+def upload_slice(client, block):
+    """上传单个分片，返回分片MD5；限流和临时错误的重试由client外层的上游保护层（upstream.py）负责，
+    这里不再重试，避免重试次数叠加，也不在熔断期间继续等待"""
+    return client.drive.upload_slice(io.BytesIO(block))
+
+
+class UploadPipeline:
+    """把输入流以分片方式并发上传到remote_path"""
+
+    def __init__(self, client, remote_path, slice_size=SLICE_SIZE, parallel=UPLOAD_PARALLEL, executor=None):
+        self.client = client
+        self.remote_path = remote_path
+        self.slice_size = slice_size
+        self.parallel = max(1, parallel)
+        self.executor = executor or get_executor('upload', UPLOAD_WORKERS)
+        self.bytes_read = 0
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+
+    def _upload_slice(self, send, block):
+        slice_md5 = send(io.BytesIO(block))
+        with self._lock:
+            self.bytes_uploaded += len(block)
+        return slice_md5
+
+    def upload(self, stream, hashes=None):
+        """读取stream并上传，返回文件大小、哈希和分片数量；已知哈希时通过hashes传入，读取时不再重复计算"""
+        hasher = ContentHasher() if hashes is None else None
+        futures = []
+        # 在请求线程中取出上传方法，上游保护层据此把线程池中的分片上传耗时计入当前请求的Server-Timing
+        send = self.client.drive.upload_slice
+        # 限制同时在内存中等待上传的分片数量
+        slots = threading.BoundedSemaphore(self.parallel)
+
+        try:
+            while True:
+                block = read_block(stream, self.slice_size)
+                if not block:
+                    break
+                if hasher is not None:
+                    hasher.update(block)
+                self.bytes_read += len(block)
+
+                slots.acquire()
+                future = self.executor.submit(self._upload_slice, send, block)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+                del block
+
+                # 已有分片失败（保护层重试后仍失败或已熔断）时尽早结束，不再继续读取
+                failed = next((f for f in futures if f.done() and f.exception()), None)
+                if failed is not None:
+                    failed.result()
+
+            if not futures:
+                # 空文件无法合并分片，直接整体上传
+                self.client.drive.upload_file(io.BytesIO(b''), self.remote_path)
+                return dict(hashes or hasher.digest(), slices=0)
+
+            slice_md5s = [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        self.client.drive.combine_slices(slice_md5s, self.remote_path)
+        return dict(hashes or hasher.digest(), slices=len(slice_md5s))
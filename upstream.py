@@ -0,0 +1,392 @@
+"""
+上游调用保护层
+所有对BaiDuDrive客户端的调用都经过按账号划分的保护：令牌桶限制调用速率，
+可重试的错误（限流errno 31034、HTTP 429/5xx、连接错误）按指数退避加随机抖动重试，
+连续失败达到阈值时熔断一段时间，同时根据是否被限流以AIMD方式调整允许的并发数；
+上传下载文件内容等长时间传输使用单独的并发限制，不会占满列表等元数据调用的名额
+"""
+
+import os
+import re
+import time
+import random
+import threading
+import logging
+
+import requests
+
+logger = logging.getLogger('baidu_drive_api')
+
+# 每个账号每秒允许的调用数和突发容量
+UPSTREAM_RATE = float(os.environ.get('UPSTREAM_RATE', 20))
+UPSTREAM_BURST = int(os.environ.get('UPSTREAM_BURST', 40))
+# 可重试错误的最大重试次数，以及退避的基础时间和上限（秒）
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', 4))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get('UPSTREAM_BACKOFF_BASE', 0.5))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get('UPSTREAM_BACKOFF_MAX', 8))
+# 连续失败多少次后熔断，以及熔断持续的时间（秒）
+UPSTREAM_BREAKER_THRESHOLD = int(os.environ.get('UPSTREAM_BREAKER_THRESHOLD', 10))
+UPSTREAM_BREAKER_RESET = float(os.environ.get('UPSTREAM_BREAKER_RESET', 30))
+# 每个账号的并发数范围，被限流时减半，成功时缓慢增加
+UPSTREAM_CONCURRENCY_MIN = int(os.environ.get('UPSTREAM_CONCURRENCY_MIN', 1))
+UPSTREAM_CONCURRENCY_MAX = int(os.environ.get('UPSTREAM_CONCURRENCY_MAX', 16))
+# 每个账号同时进行的文件内容传输（上传下载文件、上传分片）的上限，与元数据调用的并发数分开计算
+UPSTREAM_TRANSFER_CONCURRENCY_MAX = int(os.environ.get('UPSTREAM_TRANSFER_CONCURRENCY_MAX', 8))
+# 等待令牌或并发名额的最长时间（秒）
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', 30))
+
+# 百度网盘表示请求过于频繁的错误码
+THROTTLE_ERRNOS = {31034}
+
+# 传输文件内容的方法，耗时远长于元数据调用，使用单独的并发限制
+TRANSFER_METHODS = {'download_file', 'upload_file', 'upload_slice'}
+
+ERRNO_PATTERN = re.compile(r'errno\D{0,3}(-?\d+)', re.IGNORECASE)
+
+
+class UpstreamUnavailable(Exception):
+    """上游暂时不可用（熔断或排队超时），可以稍后重试"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def error_code(exc):
+    """从异常中取出百度网盘的错误码"""
+    code = getattr(exc, 'error_code', None)
+    if code is None:
+        match = ERRNO_PATTERN.search(str(exc))
+        code = match.group(1) if match else None
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def http_status(exc):
+    response = getattr(exc, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def is_throttled(exc):
+    """是否为限流错误"""
+    return error_code(exc) in THROTTLE_ERRNOS or http_status(exc) == 429
+
+
+def is_retryable(exc):
+    """是否为可以重试的临时错误"""
+    if is_throttled(exc):
+        return True
+    status = http_status(exc)
+    if status is not None and status >= 500:
+        return True
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+def error_kind(exc):
+    """错误类别：throttled（限流）、transient（可重试的临时错误）或error（业务错误等）"""
+    if is_throttled(exc):
+        return 'throttled'
+    if is_retryable(exc):
+        return 'transient'
+    return 'error'
+
+
+def backoff_delay(attempt, base=UPSTREAM_BACKOFF_BASE, cap=UPSTREAM_BACKOFF_MAX):
+    """第attempt次重试前的等待时间，指数退避加全抖动"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """令牌桶，rate为每秒补充的令牌数，burst为桶容量"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.waits = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """取一个令牌，需要等待时阻塞；超过timeout仍取不到时返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    if waited:
+                        self.waits += 1
+                    return True
+                wait = (1 - self.tokens) / self.rate if self.rate > 0 else 1.0
+            if deadline is not None and now + wait > deadline:
+                return False
+            waited = True
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后打开，reset_timeout后进入半开状态，放行一次试探调用"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否允许调用；熔断中返回剩余的等待秒数，允许时返回None"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            # 半开状态下只放行一个试探调用
+            if self._probing:
+                return self.reset_timeout
+            self.state = self.HALF_OPEN
+            self._probing = True
+            return None
+
+    def cancel_probe(self):
+        """放行的试探调用没有真正发出时，允许下一个调用继续试探"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = self.CLOSED
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.threshold and self.failures >= self.threshold):
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    logger.warning(f"上游连续失败{self.failures}次，熔断{self.reset_timeout}秒")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+class AdaptiveLimiter:
+    """AIMD并发限制：成功时上限每轮加1，被限流时上限减半"""
+
+    def __init__(self, minimum, maximum):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class AccountGuard:
+    """单个账号的限速、重试、熔断和并发控制"""
+
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, retries=UPSTREAM_RETRIES,
+                 breaker_threshold=UPSTREAM_BREAKER_THRESHOLD, breaker_reset=UPSTREAM_BREAKER_RESET,
+                 concurrency_min=UPSTREAM_CONCURRENCY_MIN, concurrency_max=UPSTREAM_CONCURRENCY_MAX,
+                 transfer_concurrency_max=UPSTREAM_TRANSFER_CONCURRENCY_MAX,
+                 queue_timeout=UPSTREAM_QUEUE_TIMEOUT, observer=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.limiter = AdaptiveLimiter(concurrency_min, concurrency_max)
+        self.transfer_limiter = AdaptiveLimiter(concurrency_min, transfer_concurrency_max)
+        self.retries = retries
+        self.queue_timeout = queue_timeout
+        # observer(name, seconds, error, context)在每次实际发出调用后执行，error为None或错误类别
+        self.observer = observer
+        self.calls = 0
+        self.retried = 0
+        self.throttled = 0
+        self.failures = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def call(self, name, fn, *args, **kwargs):
+        """调用fn，可重试的错误自动重试；参数中的可定位流在重试前回到调用时的位置"""
+        return self.invoke(name, fn, args, kwargs)
+
+    def invoke(self, name, fn, args, kwargs, context=None):
+        """同call，context原样传给observer，用于把调用耗时归到发起调用的请求上"""
+        positions = stream_positions(args, kwargs)
+        limiter = self.transfer_limiter if name in TRANSFER_METHODS else self.limiter
+        attempt = 0
+        while True:
+            retry_after = self.breaker.allow()
+            if retry_after is not None:
+                self._count('rejected')
+                raise UpstreamUnavailable(f"上游调用已熔断: {name}", retry_after=retry_after)
+            if not self.bucket.acquire(self.queue_timeout):
+                self.breaker.cancel_probe()
+                self._count('rejected')
+                raise UpstreamUnavailable(f"上游调用排队超时: {name}", retry_after=1)
+            if not limiter.acquire(self.queue_timeout):
+                self.breaker.cancel_probe()
+                self._count('rejected')
+                raise UpstreamUnavailable(f"上游并发已满: {name}", retry_after=1)
+
+            self._count('calls')
+            throttled = False
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttled(e)
+                self._observe(name, started, error_kind(e), context)
+                if throttled:
+                    self._count('throttled')
+                if not is_retryable(e):
+                    # 业务错误（文件不存在等）说明上游是正常的
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.retries or positions is None:
+                    self._count('failures')
+                    if throttled:
+                        # 重试后仍被限流，调用方应稍后再试
+                        raise UpstreamUnavailable(f"上游限流: {name}", retry_after=UPSTREAM_BACKOFF_MAX) from e
+                    raise
+                delay = backoff_delay(attempt)
+                logger.info(f"上游调用 {name} 失败，{delay:.2f}秒后第{attempt + 1}次重试: {e}")
+                self._count('retried')
+            else:
+                self._observe(name, started, None, context)
+                self.breaker.record_success()
+                return result
+            finally:
+                limiter.release(throttled)
+
+            time.sleep(delay)
+            rewind_streams(positions)
+            attempt += 1
+
+    def _observe(self, name, started, error, context):
+        if self.observer is not None:
+            try:
+                self.observer(name, time.perf_counter() - started, error, context)
+            except Exception as e:
+                logger.warning(f"记录上游调用指标失败: {e}")
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "calls": self.calls,
+                "retried": self.retried,
+                "throttled": self.throttled,
+                "failures": self.failures,
+                "rejected": self.rejected,
+            }
+        return dict(counters, **{
+            "breaker": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            "transfer_concurrency_limit": round(self.transfer_limiter.limit, 2),
+            "transfer_in_flight": self.transfer_limiter.in_flight,
+            "tokens": round(self.bucket.tokens, 2),
+            "token_waits": self.bucket.waits,
+        })
+
+
+def stream_positions(args, kwargs):
+    """记录参数中文件类对象的当前位置；有不可定位的流时返回None，表示不能重试"""
+    positions = []
+    for value in list(args) + list(kwargs.values()):
+        if hasattr(value, 'read'):
+            seekable = getattr(value, 'seekable', None)
+            if not seekable or not seekable():
+                return None
+            positions.append((value, value.tell()))
+    return positions
+
+
+def rewind_streams(positions):
+    for stream, position in positions:
+        stream.seek(position)
+
+
+class GuardedClient:
+    """代理BaiDuDrive客户端（以及client.drive），公开方法的调用都经过AccountGuard"""
+
+    def __init__(self, target, guard, context=None):
+        self._target = target
+        self._guard = guard
+        self._context = context
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name == 'drive':
+            return GuardedClient(value, self._guard, self._context)
+        if name.startswith('_') or not callable(value):
+            return value
+        # 在取方法的线程中确定调用上下文，方法被提交到线程池执行时也能归到原来的请求
+        context = self._context() if self._context is not None else None
+        return lambda *args, **kwargs: self._guard.invoke(name, value, args, kwargs, context)
+
+    @property
+    def unwrapped(self):
+        return self._target
+
+
+class UpstreamGuard:
+    """按账号管理AccountGuard；context是返回当前调用上下文的函数，结果传给observer"""
+
+    def __init__(self, context=None, **options):
+        self.context = context
+        self.options = options
+        self._guards = {}
+        self._lock = threading.Lock()
+
+    def for_account(self, account):
+        with self._lock:
+            guard = self._guards.get(account)
+            if guard is None:
+                guard = self._guards[account] = AccountGuard(**self.options)
+            return guard
+
+    def wrap(self, client, account):
+        """返回经过该账号保护层的客户端"""
+        return GuardedClient(client, self.for_account(account), self.context)
+
+    def stats(self):
+        """按账号汇总的限流、重试和熔断状态"""
+        with self._lock:
+            guards = dict(self._guards)
+        return {account: guard.stats() for account, guard in guards.items()}